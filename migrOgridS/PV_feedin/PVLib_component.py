@@ -1,9 +1,35 @@
+import os
+
 import pandas as pd
-import pvlib
-from pvlib.pvsystem import PVSystem
-from pvlib.modelchain import ModelChain
-from pvlib.location import Location
 
+# pvlib is imported on first use, importing it takes longer than most feed-in calculations
+SAM_CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', '.cache')
+
+_sam_tables = {}
+
+
+def retrieve_sam(name):
+    """
+    Returns the SAM table name (e.g. 'SandiaMod', 'sandiainverter') of pvlib.pvsystem.retrieve_sam(). The csv
+    is parsed once per pvlib version and cached as pickle in SAM_CACHE, within a process the table is kept in memory.
+    """
+    if name not in _sam_tables:
+        import pvlib
+
+        filename = os.path.join(SAM_CACHE, 'sam_' + name.lower() + '_' + pvlib.__version__ + '.pkl')
+
+        if os.path.isfile(filename):
+            table = pd.read_pickle(filename)
+        else:
+            table = pvlib.pvsystem.retrieve_sam(name)
+            if not os.path.isdir(SAM_CACHE):
+                os.makedirs(SAM_CACHE, exist_ok=True)
+            table.to_pickle(filename + '.' + str(os.getpid()), protocol=-1)
+            os.replace(filename + '.' + str(os.getpid()), filename)
+
+        _sam_tables[name] = table
+
+    return _sam_tables[name]
 
 
 def get_pv_feedin(filename='data/Lifuka_weather_2005.csv'):
@@ -18,6 +44,10 @@ def get_pv_feedin(filename='data/Lifuka_weather_2005.csv'):
     PV_feedin       as Pandas.Series [W/Wp]
 
     """
+    from pvlib.pvsystem import PVSystem
+    from pvlib.modelchain import ModelChain
+    from pvlib.location import Location
+
     weather=pd.read_csv(filename)
     weather.rename(columns={'v_wind': 'wind_speed'}, inplace=True)
     weather.set_index(pd.to_datetime(weather['timestamp']), inplace=True)
@@ -25,8 +55,8 @@ def get_pv_feedin(filename='data/Lifuka_weather_2005.csv'):
     times= weather.index
 
     # Initialize PV Module
-    sandia_modules = pvlib.pvsystem.retrieve_sam('SandiaMod')
-    sapm_inverters = pvlib.pvsystem.retrieve_sam('sandiainverter')
+    sandia_modules = retrieve_sam('SandiaMod')
+    sapm_inverters = retrieve_sam('sandiainverter')
 
     # own module parameters
     invertername = 'ABB__MICRO_0_25_I_OUTD_US_240_240V__CEC_2014_'
@@ -1,11 +1,8 @@
 import pandas as pd
 import numpy as np
-from pvlib import solarposition as sp
 from collections import OrderedDict
-from pvlib import tools
-from pvlib import irradiance
-from pvlib.location import Location
-from reninjas_pv import run_plant_model
+
+# pvlib is imported on first use inside the functions
 
 
 LAT_STEP = 0.5
@@ -67,6 +64,8 @@ def get_sunpos (weather, lat, lon):
     else:
         t = None
 
+    from pvlib import solarposition as sp
+
     sun_pos = sp.get_solarposition(weather.index, lat, lon, altitude=9.90, pressure=p, temperature=t)
     return sun_pos
 
@@ -77,6 +76,159 @@ def doy (weather):
     return doy
 
 
+# coefficients a, b, c of the Reindl diffuse fraction df = a + b * kt + c * cos(zenith) for the clearness index
+# ranges kt <= 0.3, 0.3 < kt <= 0.78 and kt > 0.78
+REINDL_COEFFICIENTS = np.array([[1.02, -0.254, 0.0123],
+                                [1.4, -1.794, 0.177],
+                                [0.0, 0.486, 0.182]])
+
+
+def _buffers (shape, out, names=('dni', 'dhi', 'kt')):
+    if out is None:
+        return OrderedDict((name, np.empty(shape)) for name in names)
+    return out
+
+
+def clearness_index (ghi, extra_i, cos_zenith, out=None):
+    """
+    Returns kt = ghi / (extra_i * cos(zenith)), negative values and nan are set to zero. All arguments are
+    arrays of the same shape, e.g. [site, hour].
+    """
+    if out is None:
+        out = np.empty(np.broadcast(ghi, extra_i, cos_zenith).shape)
+
+    np.multiply(extra_i, cos_zenith, out=out)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        np.divide(ghi, out, out=out)
+    np.maximum(out, 0, out=out)
+    np.copyto(out, 0, where=np.isnan(out))
+    return out
+
+
+def dni_from_ghi (ghi, dhi, zenith, cos_zenith=None, clearsky_dni=None, clearsky_tolerance=1.1,
+                  zenith_threshold_for_zero_dni=88.0, zenith_threshold_for_clearsky_limit=80.0, out=None):
+    """
+    Array version of pvlib.irradiance.dni(): dni = (ghi - dhi) / cos(zenith), negative values and non-zero values
+    at zenith >= zenith_threshold_for_zero_dni are set to nan, values above clearsky_tolerance * clearsky_dni are
+    limited between zenith_threshold_for_clearsky_limit and zenith_threshold_for_zero_dni. The zenith is in degrees,
+    cos_zenith is computed if not given.
+    """
+    if cos_zenith is None:
+        cos_zenith = np.cos(np.radians(zenith))
+    if out is None:
+        out = np.empty(np.broadcast(ghi, dhi, zenith).shape)
+
+    np.subtract(ghi, dhi, out=out)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        np.divide(out, cos_zenith, out=out)
+
+    out[out < 0] = np.nan
+    out[(zenith >= zenith_threshold_for_zero_dni) & (out != 0)] = np.nan
+
+    if clearsky_dni is not None:
+        max_dni = np.broadcast_to(clearsky_dni * clearsky_tolerance, out.shape)
+        limit = (zenith >= zenith_threshold_for_clearsky_limit) & (zenith < zenith_threshold_for_zero_dni) & \
+                (out > max_dni)
+        out[limit] = max_dni[limit]
+
+    return out
+
+
+def reindl_array (ghi, extra_i, zenith, cos_zenith=None, clearsky_dni=None, out=None):
+    """
+    Reindl decomposition of [site, hour] (or any shape) arrays with precomputed geometry, see reindl(). The diffuse
+    fraction is evaluated in one pass over coefficients selected by the kt range instead of a chain of np.where.
+
+    Parameters
+    -----------
+        ghi, extra_i:   global horizontal and extraterrestial irradiance [W/m^2]
+        zenith:         real solar zenith angle in [°]
+        cos_zenith:     cos(zenith), computed if None
+        clearsky_dni:   clear sky dni [W/m^2] for the limit of dni_from_ghi(), no limit if None
+        out:            OrderedDict of preallocated arrays 'dni', 'dhi' and 'kt' of the input shape
+
+    Returns
+    -------
+    data : OrderedDict of arrays 'dni', 'dhi' and 'kt'
+    """
+    ghi = np.asarray(ghi, dtype=float)
+    if cos_zenith is None:
+        cos_zenith = np.cos(np.radians(zenith))
+
+    out = _buffers(ghi.shape, out)
+    kt, df, work = out['kt'], out['dhi'], out['dni']
+
+    clearness_index(ghi, extra_i, cos_zenith, out=kt)
+
+    segment = (kt > 0.3).astype(np.intp)
+    segment += kt > 0.78
+
+    np.take(REINDL_COEFFICIENTS[:, 0], segment, out=df)
+    np.take(REINDL_COEFFICIENTS[:, 1], segment, out=work)
+    work *= kt
+    df += work
+    np.take(REINDL_COEFFICIENTS[:, 2], segment, out=work)
+    work *= cos_zenith
+    df += work
+
+    # outside the boundaries of the ranges and extreme values
+    zero = (kt <= 0) | ((segment > 0) & (df < 0.1)) | ((df < 0.9) & (kt < 0.2)) | ((df > 0.8) & (kt > 0.6)) | \
+           (df > 1) | (ghi - extra_i >= 0)
+    df[zero] = 0
+
+    # dhi
+    df *= ghi
+
+    dni_from_ghi(ghi, df, zenith, cos_zenith, clearsky_dni, zenith_threshold_for_zero_dni=88.0,
+                 clearsky_tolerance=1.1, zenith_threshold_for_clearsky_limit=64, out=out['dni'])
+
+    return out
+
+
+def erbs_array (ghi, extra_i, zenith, cos_zenith=None, out=None):
+    """
+    Erbs decomposition of [site, hour] (or any shape) arrays with precomputed geometry, see erbs().
+
+    Returns
+    -------
+    data : OrderedDict of arrays 'dni', 'dhi' and 'kt'
+    """
+    ghi = np.asarray(ghi, dtype=float)
+    if cos_zenith is None:
+        cos_zenith = np.cos(np.radians(zenith))
+
+    out = _buffers(ghi.shape, out)
+    kt, df, work = out['kt'], out['dhi'], out['dni']
+
+    np.multiply(extra_i, cos_zenith, out=work)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        np.divide(ghi, work, out=kt)
+    np.maximum(kt, 0, out=kt)
+
+    # 0.9511 - 0.1604 kt + 4.388 kt^2 - 16.638 kt^3 + 12.336 kt^4 for 0.22 < kt <= 0.8
+    np.multiply(kt, 12.336, out=df)
+    df -= 16.638
+    df *= kt
+    df += 4.388
+    df *= kt
+    df -= 0.1604
+    df *= kt
+    df += 0.9511
+
+    low = kt <= 0.22
+    df[low] = 1 - 0.09 * kt[low]
+    df[kt > 0.8] = 0.165
+
+    # dhi
+    df *= ghi
+
+    np.subtract(ghi, df, out=work)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        np.divide(work, cos_zenith, out=work)
+
+    return out
+
+
 def reindl (lat,lon, times, ghi, extra_i, zenith):
     """
     this function calculates dhi, dni and the clearness index kt
@@ -110,48 +262,15 @@ def reindl (lat,lon, times, ghi, extra_i, zenith):
         [1] Reindl et al. (1990): Diffuse fraction correlations
 
     """
+    from pvlib.location import Location
 
-    i0_h = extra_i * tools.cosd(zenith)
-
-    kt = ghi / i0_h
-
-    kt = np.maximum(kt, 0)
-    kt.fillna(0, inplace=True)
-
-    # for kt outside the boundaries, set diffuse fraction to zero
-    df = 0.0
-
-    # for 0<kt<=0.3  set diffuse fraction
-    df = np.where((kt > 0) & (kt <= 0.3), 1.02 - 0.254 * kt + 0.0123 * tools.cosd(zenith), df)
-
-    # for 0.3<kt<0.78  and df>=0.1, set diffuse fraction
-    df = np.where((kt > 0.3) & (kt <= 0.78) & (1.4 - 1.794 * kt + 0.177 * tools.cosd(zenith) >= 0.1),
-                  1.4 - 1.794 * kt + 0.177 * tools.cosd(zenith), df)
-    # for kt > 0.78 and df>=0.1
-    df = np.where((kt > 0.78) & (0.486 * kt + 0.182 * tools.cosd(zenith) >= 0.1),
-                  0.486 * kt + 0.182 * tools.cosd(zenith), df)
-
-    # remove extreme values
-    df = np.where((df < 0.9) & (kt < 0.2), 0, df)
-    df = np.where((df > 0.8) & (kt > 0.6), 0, df)
-    df = np.where((df > 1), 0, df)
-    df = np.where(((ghi - extra_i) >= 0), 0, df)
-
-    dhi = df * ghi
+    clearsky_dni = Location(lat, lon).get_clearsky(times).dni
 
-    dni = irradiance.dni(ghi, dhi, zenith,
-                         clearsky_dni=Location(lat, lon).get_clearsky(times).dni,
-                         zenith_threshold_for_zero_dni=88.0,
-                         clearsky_tolerance=1.1,
-                         zenith_threshold_for_clearsky_limit=64)
+    data = reindl_array(ghi, np.asarray(extra_i, dtype=float), np.asarray(zenith, dtype=float),
+                        clearsky_dni=np.asarray(clearsky_dni, dtype=float))
 
-    data = OrderedDict()
-    data['dni'] = dni
-    data['dhi'] = dhi
-    data['kt'] = kt
-
-    if isinstance(dni, pd.Series):
-        data = pd.DataFrame(data)
+    if isinstance(ghi, pd.Series):
+        data = pd.DataFrame(data, index=ghi.index)
 
     return data
 
@@ -205,41 +324,16 @@ def erbs (ghi,extra_i, zenith):
 
     """
 
-    # This Z needs to be the true Zenith angle, not apparent,
-    # to get extraterrestrial horizontal radiation)
-    i0_h = extra_i * tools.cosd(zenith)
-
-    kt = ghi / i0_h
-    kt = np.maximum(kt, 0)
-
-    # For Kt <= 0.22, set the diffuse fraction
-    df = 1 - 0.09 * kt
-
-    # For Kt > 0.22 and Kt <= 0.8, set the diffuse fraction
-    df = np.where((kt > 0.22) & (kt <= 0.8),
-                  0.9511 - 0.1604 * kt + 4.388 * kt ** 2 -
-                  16.638 * kt ** 3 + 12.336 * kt ** 4,
-                  df)
-
-    # For Kt > 0.8, set the diffuse fraction
-    df = np.where(kt > 0.8, 0.165, df)
-
-    dhi = df * ghi
-
-    dni = (ghi - dhi) / tools.cosd(zenith)
-
-    data = OrderedDict()
-    data['dni'] = dni
-    data['dhi'] = dhi
-    data['kt'] = kt
+    data = erbs_array(ghi, np.asarray(extra_i, dtype=float), np.asarray(zenith, dtype=float))
 
-    if isinstance(dni, pd.Series):
-        data = pd.DataFrame(data)
+    if isinstance(ghi, pd.Series):
+        data = pd.DataFrame(data, index=ghi.index)
 
     return data
 
 
 def philippines_pv(location_filepath=None):
+    from PV_feedin.reninjas_pv import run_plant_model
 
     location = pd.read_csv(location_filepath, sep=',')
     location.set_index('Index', inplace=True)
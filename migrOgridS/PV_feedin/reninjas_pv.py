@@ -21,13 +21,107 @@ import math
 import numpy as np
 import pandas as pd
 
-import trigon
+from . import trigon
 
 # Constants
 R_TAMB = 20  # Reference ambient temperature (degC)
 R_TMOD = 25  # Reference module temperature (degC)
 R_IRRADIANCE = 1  # Reference irradiance (kW/m2)
 
+# Coefficients k_1 ... k_6 of the relative efficiency, from {1}
+HULD_COEFFICIENTS = {
+    'csi': (-0.017162, -0.040289, -0.004681, 0.000148, 0.000169, 0.000005),
+    'cdte': (-0.103251, -0.040446, -0.001667, -0.002075, -0.001445, -0.000023)
+}
+
+
+def _relative_efficiency (log_g, temp, positive, k, out, work):
+    # eff = 1 + ln(G) * (k_1 + k_2 ln(G)) + T * (k_3 + ln(G) * (k_4 + k_5 ln(G)) + k_6 T), evaluated in place
+    np.multiply(log_g, k[4], out=out)
+    out += k[3]
+    out *= log_g
+    out += k[2]
+    np.multiply(temp, k[5], out=work)
+    out += work
+    out *= temp
+
+    np.multiply(log_g, k[1], out=work)
+    work += k[0]
+    work *= log_g
+    out += work
+    out += 1
+
+    # G <= 0 or missing and negative efficiencies give no output
+    out[~positive] = 0
+    np.maximum(out, 0, out=out)
+    return out
+
+
+def relative_efficiency (irradiance, tamb=None, technology='csi', c_temp_amb=1, c_temp_irrad=35,
+                         dtype=np.float64, out=None):
+    """
+    Array kernel of PVPanel.panel_relative_efficiency for any shape of input, e.g. [site, hour]. ln(G) and the
+    module temperature are computed once and shared by all technologies, the polynomial is evaluated in place.
+
+    Parameters
+    ----------
+    irradiance : array
+        In-plane irradiance in kW/m2
+    tamb : array or float, default None
+        Ambient temperature in deg C, broadcast against irradiance. R_TAMB if None.
+    technology : str, tuple of 6 coefficients or a list of them
+        Key of HULD_COEFFICIENTS or the coefficients k_1 ... k_6. A list adds a leading technology axis to the result.
+    dtype : numpy dtype, default np.float64
+        np.float32 halves memory traffic for large batches
+    out : array, default None
+        Output buffer of the result shape and dtype
+    Returns
+    -------
+    eff : array
+    """
+    g = np.asarray(irradiance, dtype=dtype)
+    batch = isinstance(technology, list)
+    technologies = technology if batch else [technology]
+    coefficients = [HULD_COEFFICIENTS[t] if isinstance(t, str) else t for t in technologies]
+
+    if out is None:
+        out = np.empty((len(technologies),) + g.shape if batch else g.shape, dtype=dtype)
+
+    positive = g > 0
+
+    # G_: normalized in-plane irradiance, only its logarithm is needed
+    log_g = np.zeros(g.shape, dtype=dtype)
+    np.divide(g, R_IRRADIANCE, out=log_g, where=positive)
+    np.log(log_g, out=log_g, where=positive)
+
+    # T_: normalized module temperature
+    temp = np.multiply(g, c_temp_irrad, dtype=dtype)
+    temp += np.asarray(R_TAMB if tamb is None else tamb, dtype=dtype) * c_temp_amb
+    temp -= R_TMOD
+
+    work = np.empty(g.shape, dtype=dtype)
+    for i, k in enumerate(coefficients):
+        _relative_efficiency(log_g, temp, positive, k, out[i] if batch else out, work)
+
+    return out
+
+
+def panel_power_array (direct, diffuse=None, tamb=None, technology='csi', panel_aperture=1.0,
+                       panel_ref_efficiency=1.0, c_temp_amb=1, c_temp_irrad=35, dtype=np.float64, out=None):
+    """
+    Array kernel of PVPanel.panel_power: returns power in kW for direct and diffuse in-plane irradiance arrays,
+    e.g. [site, hour], see relative_efficiency() for the remaining parameters.
+    """
+    irradiance = np.array(direct, dtype=dtype)
+    if diffuse is not None:
+        irradiance += np.asarray(diffuse, dtype=dtype)
+
+    out = relative_efficiency(irradiance, tamb, technology, c_temp_amb, c_temp_irrad, dtype=dtype, out=out)
+    irradiance *= panel_aperture * panel_ref_efficiency
+    out *= irradiance
+
+    return out
+
 
 class PVPanel(object):
     """
@@ -80,13 +174,11 @@ class PVPanel(object):
             assert direct.index.equals(diffuse.index), index_msg
         if tamb is not None:
             assert direct.index.equals(tamb.index), index_msg
-        if self.use_diffuse:
-            irradiance = direct + diffuse
-        else:
-            irradiance = direct
-        return (irradiance * self.panel_aperture
-                * self.panel_relative_efficiency(irradiance, tamb)
-                * self.panel_ref_efficiency)
+        power = panel_power_array(direct.values, diffuse.values if self.use_diffuse else None,
+                                  None if tamb is None else tamb.values, self.coefficients,
+                                  self.panel_aperture, self.panel_ref_efficiency,
+                                  self.c_temp_tamb, self.c_temp_irrad)
+        return pd.Series(power, index=direct.index)
 
     def panel_relative_efficiency (self, irradiance, tamb):
         """
@@ -100,20 +192,14 @@ class PVPanel(object):
         tamb : pandas Series
             Ambient temperature in deg C
         """
-        # G_: normalized in-plane irradiance
-        G_ = irradiance / R_IRRADIANCE
-        # T_: normalized module temperature
-        T_ = (self.c_temp_tamb * tamb + self.c_temp_irrad * irradiance) - R_TMOD
-        # NB: np.log without base implies base e or ln
-        eff = (1 + self.k_1 * np.log(G_)
-               + self.k_2 * (np.log(G_)) ** 2
-               + T_ * (self.k_3
-                       + self.k_4 * np.log(G_)
-                       + self.k_5 * (np.log(G_)) ** 2)
-               + self.k_6 * (T_ ** 2))
-        eff.fillna(0, inplace=True)  # NaNs in case that G_ was <= 0
-        eff[eff < 0] = 0  # Also make sure efficiency can't be negative
-        return eff
+        eff = relative_efficiency(irradiance.values, None if tamb is None else np.asarray(tamb),
+                                  self.coefficients, self.c_temp_tamb, self.c_temp_irrad)
+        return pd.Series(eff, index=irradiance.index)
+
+    @property
+    def coefficients (self):
+        """Coefficients k_1 ... k_6 of the relative efficiency"""
+        return self.k_1, self.k_2, self.k_3, self.k_4, self.k_5, self.k_6
 
 
 class CSiPanel(PVPanel):
@@ -121,12 +207,7 @@ class CSiPanel(PVPanel):
 
     def __init__ (self, **kwargs):
         super(CSiPanel, self).__init__(**kwargs)
-        self.k_1 = -0.017162
-        self.k_2 = -0.040289
-        self.k_3 = -0.004681
-        self.k_4 = 0.000148
-        self.k_5 = 0.000169
-        self.k_6 = 0.000005
+        self.k_1, self.k_2, self.k_3, self.k_4, self.k_5, self.k_6 = HULD_COEFFICIENTS['csi']
 
 
 class CdTePanel(PVPanel):
@@ -134,12 +215,7 @@ class CdTePanel(PVPanel):
 
     def __init__ (self, **kwargs):
         super(CdTePanel, self).__init__(**kwargs)
-        self.k_1 = -0.103251
-        self.k_2 = -0.040446
-        self.k_3 = -0.001667
-        self.k_4 = -0.002075
-        self.k_5 = -0.001445
-        self.k_6 = -0.000023
+        self.k_1, self.k_2, self.k_3, self.k_4, self.k_5, self.k_6 = HULD_COEFFICIENTS['cdte']
 
 
 _PANEL_TYPES = {
@@ -177,6 +253,104 @@ def optimal_tilt (lat):
         return 40  # Simply use 40 degrees above lat 50
 
 
+def optimize_orientation (ghi, dhi, dni, lat, sun_elevation, sun_azimuth, tamb=None, demand=None,
+                          tilts=np.arange(0, 61, 5), azimuths=np.arange(90, 271, 10), technology='csi',
+                          system_loss=0.10, albedo=0.3, chunk=1, site_chunk=None, dtype=np.float64):
+    """
+    Evaluates a grid of tilt x azimuth orientations for one or many sites in broadcast array computations of
+    trigon.poa_irradiance_array() and panel_power_array(), instead of the optimal_tilt(lat) heuristic.
+    Parameters
+    ----------
+    ghi, dhi, dni : array [site, hour] or [hour]
+        Irradiance in kW/m2, as passed to run_plant_model
+    lat : float or array [site]
+        Latitude in degrees
+    sun_elevation, sun_azimuth : array [site, hour] or [hour]
+        Sun angles in radians, as passed to trigon.poa_irradiance
+    tamb : array [site, hour] or [hour], default None
+        Ambient temperature in deg C, R_TAMB if None
+    demand : array [site, hour] or [hour], default None
+        If given, the orientation whose output correlates best with the demand profile is chosen, otherwise the
+        one with the highest yield
+    tilts, azimuths : arrays
+        Candidate angles in degrees, azimuth 180 = towards equator like in run_plant_model
+    chunk : int, default 1
+        Number of tilts evaluated per pass
+    site_chunk : int, default None
+        Number of sites evaluated per pass, all sites if None. The memory need is site_chunk x chunk x azimuths x
+        hours values
+    Returns
+    -------
+    best : pandas DataFrame
+        Columns 'tilt', 'azimuth', 'yield' (kWh/kW per year incl. system losses) and 'score' (yield or correlation)
+        for every site
+    surface : numpy array [site, tilt, azimuth]
+        Yield of all orientations
+    """
+    def sites (x):
+        x = np.asarray(x, dtype=dtype)
+        return x.reshape((-1, 1, 1, x.shape[-1]))
+
+    ghi, dhi, dni, sun_elevation, sun_azimuth = [sites(x) for x in (ghi, dhi, dni, sun_elevation, sun_azimuth)]
+    tamb = R_TAMB if tamb is None else sites(tamb)
+    lat = np.broadcast_to(np.asarray(lat, dtype=dtype).reshape(-1), (ghi.shape[0],)).reshape((-1, 1, 1, 1))
+
+    tilts = np.asarray(tilts, dtype=dtype)
+    azimuths = np.radians(np.asarray(azimuths, dtype=dtype)).reshape((1, 1, -1, 1))
+    n_sites = ghi.shape[0]
+    site_chunk = n_sites if site_chunk is None else site_chunk
+
+    surface = np.empty((n_sites, len(tilts), azimuths.size), dtype=dtype)
+    score = np.empty_like(surface)
+
+    if demand is not None:
+        demand = sites(demand)
+        demand = demand - demand.mean(axis=-1, keepdims=True)
+        demand /= np.sqrt((demand ** 2).sum(axis=-1, keepdims=True))
+
+    panel_efficiency = 0.1
+    out = None
+
+    def part (x):
+        # inputs of a single site apply to all sites
+        return x[site] if np.ndim(x) and x.shape[0] > 1 else x
+
+    for first in range(0, n_sites, site_chunk):
+        site = slice(first, first + site_chunk)
+
+        for start in range(0, len(tilts), chunk):
+            tilt = np.radians(tilts[start:start + chunk]).reshape((1, -1, 1, 1))
+
+            direct, diffuse = trigon.poa_irradiance_array(part(ghi) - part(dhi), part(dhi), part(dni), part(lat),
+                                                          part(sun_elevation), part(sun_azimuth),
+                                                          tilt=tilt, azimuth=azimuths, albedo=albedo)
+            if out is None or out.shape != direct.shape:
+                out = np.empty(direct.shape, dtype=dtype)
+            power = panel_power_array(direct, diffuse, part(tamb), technology, 1 / panel_efficiency,
+                                      panel_efficiency, dtype=dtype, out=out)
+
+            surface[site, start:start + chunk] = power.sum(axis=-1) * (1 - system_loss)
+
+            if demand is not None:
+                # Pearson correlation of output and demand over the hours
+                power -= power.mean(axis=-1, keepdims=True)
+                norm = np.sqrt((power ** 2).sum(axis=-1))
+                score[site, start:start + chunk] = np.where(norm > 0, (power * part(demand)).sum(axis=-1) / norm, 0)
+
+    if demand is None:
+        score = surface
+
+    best = score.reshape((n_sites, -1)).argmax(axis=1)
+    i_tilt, i_azimuth = np.unravel_index(best, score.shape[1:])
+
+    result = pd.DataFrame({'tilt': tilts[i_tilt],
+                           'azimuth': np.degrees(azimuths.ravel()[i_azimuth]),
+                           'yield': surface[np.arange(n_sites), i_tilt, i_azimuth],
+                           'score': score[np.arange(n_sites), i_tilt, i_azimuth]})
+
+    return result, surface
+
+
 def run_plant_model (ghi, dhi, dni, coords, capacity=1, tilt=None, tamb=None, azim=180,
                      technology='csi', system_loss=0.10, sun_azimuth=None, sun_elevation=None,
                      include_raw_data=False, **kwargs):
@@ -190,8 +364,9 @@ def run_plant_model (ghi, dhi, dni, coords, capacity=1, tilt=None, tamb=None, az
         for ambient air temperature (in deg C).
     coords : (float, float) tuple
         Latitude and longitude.
-    tilt : float
-        Tilt angle (degrees).
+    tilt : float or 'optimize'
+        Tilt angle (degrees). optimal_tilt(lat) if None, 'optimize' takes tilt and
+        azimuth of the highest yield from optimize_orientation().
     azim : float
         Azimuth angle (degrees, 180 = towards equator).
     tracking : int
@@ -216,10 +391,12 @@ def run_plant_model (ghi, dhi, dni, coords, capacity=1, tilt=None, tamb=None, az
     if (system_loss < 0) or (system_loss > 1):
         raise ValueError('system_loss must be >=0 and <=1')
 
-    if tilt is not None:
-        pass
-    else:
+    if tilt is None:
         tilt = optimal_tilt(coords[0])
+    elif tilt == 'optimize':
+        best = optimize_orientation(ghi, dhi, dni, coords[0], sun_elevation, sun_azimuth, tamb=tamb,
+                                    technology=technology, system_loss=system_loss)[0]
+        tilt, azim = best['tilt'][0], best['azimuth'][0]
 
     # TODO more flexibilty when passing in data, e.g. allow passing in
     # other combinations of data like DNI + global horizontal
@@ -47,3 +47,28 @@ def poa_irradiance(dirhi, dhi, dni, coords, sun_elevation, sun_azimuth, tilt=0,
                      * ((1 - np.cos(panel_tilt)) / 2)).fillna(0)
     return pd.DataFrame({'direct': plane_direct, 'diffuse': plane_diffuse})
 
+
+def poa_irradiance_array(dirhi, dhi, dni, lat, sun_elevation, sun_azimuth, tilt=0, azimuth=np.pi, albedo=0.3):
+    """
+    Array version of poa_irradiance() that broadcasts all arguments against each other, e.g. irradiance and sun
+    angles of shape [site, 1, 1, hour], lat of shape [site, 1, 1, 1], tilt [1, tilt, 1, 1] and azimuth
+    [1, 1, azimuth, 1] give the plane of array irradiance of all orientations of all sites in one pass.
+    Angles are in radians like in poa_irradiance().
+
+    Returns:
+        direct, diffuse : in-plane irradiance arrays of the broadcast shape
+    """
+    # azimuth 3.14 points north on the southern hemisphere
+    azimuth = azimuth + np.pi * (np.asarray(lat) < 0)
+
+    cos_incidence = np.sin(sun_elevation) * np.cos(tilt) \
+                    + np.cos(sun_elevation) * np.sin(tilt) * np.cos(azimuth - sun_azimuth)
+
+    plane_direct = np.nan_to_num(dni * np.clip(cos_incidence, -1, 1))
+    np.maximum(plane_direct, 0, out=plane_direct)
+
+    cos_tilt = np.cos(tilt)
+    plane_diffuse = np.nan_to_num(dhi * ((1 + cos_tilt) / 2) + albedo * (dirhi + dhi) * ((1 - cos_tilt) / 2))
+
+    return plane_direct, plane_diffuse
+
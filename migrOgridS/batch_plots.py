@@ -0,0 +1,191 @@
+"""
+Headless batch plotting of results tables.
+
+plot_batch() renders the unit commitment plot of plots.py for many results .csv files to PNG or SVG files without a
+display (Agg backend) in a pool of worker processes. Every file is read once and only the columns of plots.LEGEND
+are parsed. From it the plot of the whole horizon and the panel sets, e.g. one plot per week ('W') or month ('M'),
+are drawn in one pass. Series longer than the plot is wide in pixels are downsampled per pixel bucket, either to
+the minimum and maximum of every bucket ('minmax'), which keeps the envelope of the series, or with
+largest-triangle-three-buckets ('lttb'):
+
+    files = batch_plots.plot_batch(glob.glob('results/*_8760.csv'), periods=('M', 'W'), fmt='png')
+"""
+
+import logging
+import multiprocessing
+import os
+
+import matplotlib
+matplotlib.use('Agg')
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+from plots import LEGEND
+
+FIGSIZE = (8, 6)
+DPI = 100
+
+# share of the figure width taken by the axes, the legend is placed to the right of them
+AXES_WIDTH = 0.7
+
+
+def read_results(filename, columns=None):
+    """
+    Reads the timestamp and the plotted columns of a results .csv file.
+
+    :param columns: columns to read, all columns of plots.LEGEND found in the file if None     list of str
+    :return: results table with DatetimeIndex, columns renamed by plots.LEGEND                 pd.DataFrame
+    """
+    header = pd.read_csv(filename, nrows=0).columns
+    columns = [c for c in (LEGEND if columns is None else columns) if c in header]
+
+    df = pd.read_csv(filename, usecols=['timestamp'] + columns, index_col='timestamp')
+    df.index = pd.to_datetime(df.index, format='ISO8601')
+
+    # column order of plots.LEGEND instead of the file
+    return df[columns].rename(columns=LEGEND)
+
+
+def minmax(x, y, buckets):
+    """
+    Downsamples y to the minimum and maximum of every bucket, in the order they occur.
+
+    :return: x, y       at most 2 * buckets points                                              np.array, np.array
+    """
+    n = len(y)
+    if n <= 2 * buckets:
+        return x, y
+
+    edges = np.linspace(0, n, buckets + 1).astype(int)
+    # fmin and fmax skip NaN, a bucket of NaN only stays NaN
+    lower = np.fmin.reduceat(y, edges[:-1])
+    upper = np.fmax.reduceat(y, edges[:-1])
+
+    # position of the first minimum and maximum within its bucket
+    bucket = np.repeat(np.arange(buckets), np.diff(edges))
+    k = np.arange(n)
+    first_min = np.full(buckets, n)
+    first_max = np.full(buckets, n)
+    np.minimum.at(first_min, bucket[y == lower[bucket]], k[y == lower[bucket]])
+    np.minimum.at(first_max, bucket[y == upper[bucket]], k[y == upper[bucket]])
+
+    # buckets without a match hold only NaN
+    index = np.unique(np.concatenate([first_min, first_max]))
+    index = index[index < n]
+    return x[index], y[index]
+
+
+def lttb(x, y, buckets):
+    """
+    Largest-triangle-three-buckets: keeps the first and last point and of every bucket in between the point that
+    spans the largest triangle with the point kept before and the mean of the next bucket.
+
+    :return: x, y       buckets + 2 points                                                      np.array, np.array
+    """
+    n = len(y)
+    if n <= buckets + 2:
+        return x, y
+
+    t = np.arange(n, dtype=float)
+    edges = np.linspace(1, n - 1, buckets + 1).astype(int)
+    index = np.zeros(buckets + 2, dtype=int)
+    index[-1] = n - 1
+
+    for b in range(buckets):
+        start, stop = edges[b], edges[b + 1]
+        following = slice(stop, edges[b + 2]) if b + 2 <= buckets else slice(n - 1, n)
+        tm, ym = t[following].mean(), y[following].mean()
+        ta, ya = t[index[b]], y[index[b]]
+
+        area = np.abs((ta - tm) * (y[start:stop] - ya) - (ta - t[start:stop]) * (ym - ya))
+        index[b + 1] = start + int(np.argmax(area))
+
+    return x[index], y[index]
+
+
+METHODS = {'minmax': minmax, 'lttb': lttb}
+
+
+def draw(df, filename, title=None, method='minmax', figsize=FIGSIZE, dpi=DPI):
+    """
+    Draws the unit commitment plot of the results table df like plots.unit_commitment_plot() and saves it to
+    filename, the format follows from its extension.
+    """
+    buckets = int(figsize[0] * dpi * AXES_WIDTH)
+    x = df.index.values
+
+    fig = plt.figure(figsize=figsize)
+    ax = fig.add_subplot(1, 1, 1)
+    for column in df.columns:
+        ax.plot(*METHODS[method](x, df[column].values, buckets), linewidth=1.5, label=column)
+
+    handles, labels = ax.get_legend_handles_labels()
+    ax.legend(handles, labels, bbox_to_anchor=(1.05, 1), loc=2, borderaxespad=0.)
+    ax.set_ylabel('power flow [kW]')
+    ax.set_xlabel('datetime in hourly steps')
+    ax.set_title(title)
+
+    fig.savefig(filename, dpi=dpi, bbox_inches='tight')
+    plt.close(fig)
+
+    return filename
+
+
+def _plot_file(args):
+    """
+    Worker of plot_batch: plots the whole horizon and the panel sets of one results file.
+    """
+    filename, output, periods, fmt, method, dpi = args
+
+    df = read_results(filename)
+    name = os.path.splitext(os.path.basename(filename))[0]
+
+    files = [draw(df, os.path.join(output, name + '.' + fmt), title=name, method=method, dpi=dpi)]
+
+    for period in periods:
+        directory = os.path.join(output, name + '_' + period)
+        if not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+
+        for key, panel in df.groupby(df.index.to_period(period)):
+            # weeks are named by their first day, e.g. 2017-01-02 of 2017-01-02/2017-01-08
+            label = str(key).split('/')[0]
+            files += [draw(panel, os.path.join(directory, label + '.' + fmt), title=name + ' ' + str(key),
+                           method=method, dpi=dpi)]
+
+    logging.info('Plotted ' + filename + ' to ' + str(len(files)) + ' files')
+    return files
+
+
+def plot_batch(files, output='results/plots', periods=('M',), fmt='png', method='minmax', dpi=DPI, processes=None):
+    """
+    The function renders the unit commitment plots of many results files in parallel processes.
+
+    :param files:       results .csv files with timestamp column                                list of str
+    :param output:      directory of the plots, panels go to <output>/<file>_<period>/         str
+    :param periods:     panel sets, pandas period aliases, e.g. 'W' (weeks) or 'M' (months)   list of str
+    :param fmt:         'png' or 'svg'                                                         str
+    :param method:      downsampling, 'minmax' or 'lttb'                                        str
+    :param processes:   number of worker processes, os.cpu_count() if None                     int or None
+    :return: plot files                                                                         list of str
+    """
+    if method not in METHODS:
+        raise ValueError('The downsampling ' + str(method) + ' is not supported. It can be either [minmax] or [lttb]')
+
+    if not os.path.isdir(output):
+        os.makedirs(output, exist_ok=True)
+
+    jobs = [(filename, output, tuple(periods), fmt, method, dpi) for filename in files]
+
+    res = []
+    pool = multiprocessing.Pool(processes)
+    try:
+        for plotted in pool.imap_unordered(_plot_file, jobs):
+            res += plotted
+    finally:
+        pool.close()
+        pool.join()
+
+    return res
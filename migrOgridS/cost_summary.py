@@ -3,6 +3,7 @@ from oemof.solph import Source
 from oemof.solph.components import GenericStorage
 from oemof.solph.custom import DieselGenerator
 from oemof.outputlib import views
+from generator_bank import GeneratorBank
 
 
 def get_lcoe_for_node (results, node):
@@ -115,6 +116,8 @@ def get_lcoe_for_DG (results, node):
     - "Fuel" costs are calculated the same way as OPEX, but for all input
     lows to the GenericEngine/DieselGenerator objects, respectively
 
+    For a GeneratorBank the totals of all units of the bank are returned.
+
     Parameters:
         results:    pd.DataFrame containig the results of the optimization achieved
                     by oemof.outputlib.processing.results()
@@ -139,6 +142,7 @@ def get_lcoe_for_DG (results, node):
     output = 0
     resource = 0
     invest = 0
+    om = 0
     if isinstance(node, str):
         raise TypeError('Node has to be a real node, not str')
 
@@ -146,7 +150,14 @@ def get_lcoe_for_DG (results, node):
         flow = node_data['sequences'][(nodes, flow_name)]
         flow.reset_index(drop=True, inplace=True)
 
-        if nodes[0] == node:
+        if flow_name == 'count':
+            # GeneratorBank: om_costs apply per online unit
+            om = node.om_costs * flow.sum() * node.unit_nominal_value
+
+        elif flow_name == 'online':
+            pass
+
+        elif nodes[0] == node:
             flow_component = node.outputs[nodes[1]]
 
             if flow_name == 'status':
@@ -186,7 +197,7 @@ def get_lcoe (m, results, component_list):
     for i in range(len(component_list)):
         node = m.es.groups[component_list[i]]
 
-        if isinstance(node, DieselGenerator):
+        if isinstance(node, DieselGenerator) or isinstance(node, GeneratorBank):
             n = economic_results.loc[component_list[i]]
             n[0], n[1], n[2], n[3] = get_lcoe_for_DG(results, node)
 
@@ -1,5 +1,19 @@
+import numpy as np
 import pyomo.environ as po
 from oemof.solph.options import Investment
+from generator_bank import GeneratorBank
+from presolve import linear_fuel_curve
+
+# constraint families built by spinning_reserve_constraint and rotating_mass_constraint
+RESERVE_CONSTRAINTS = ['spinning_reserve_l', 'spinning_reserve_u', 'rotating_mass_l', 'rotating_mass_u']
+
+
+def _online_capacity (m, n, o, t):
+    # maximum output of the online units of a generator or generator bank
+    if isinstance(n, GeneratorBank):
+        return m.GeneratorBankBlock.count[n, t] * m.flows[n, o].max[t] * n.unit_nominal_value
+
+    return m.NonConvexFlow.status[n, o, t] * m.flows[n, o].max[t] * m.flows[n, o].nominal_value
 
 
 def gen_order_constraint (m, groups=None):
@@ -16,6 +30,11 @@ def gen_order_constraint (m, groups=None):
 
     groups = [x for _, x in sorted(zip(gen_max, groups))]
 
+    # the units of a generator bank are interchangeable, the order only applies to single generators
+    groups = [n for n in groups if not isinstance(n, GeneratorBank)]
+    if len(groups) < 2:
+        return m
+
     O = {n: [k for (k, v) in n.electrical_output.items()][0] for n in groups}
 
     def gen_order1_rule (m, t):
@@ -124,8 +143,7 @@ def spinning_reserve_constraint (m, limit, groups=None, storage=None):
 
     def spinning_reserve_l_rule (m, t):
 
-        expr = sum([m.NonConvexFlow.status[n, O[n], t] * m.flows[n, O[n]].max[t] *
-                    m.flows[n, O[n]].nominal_value - m.flow[n, O[n], t] for n in groups]) \
+        expr = sum([_online_capacity(m, n, O[n], t) - m.flow[n, O[n], t] for n in groups]) \
                + sr_l_storage \
                >= limit[t]
 
@@ -151,8 +169,7 @@ def spinning_reserve_constraint (m, limit, groups=None, storage=None):
             sr_u_storage += [t*0]
 
     def spinning_reserve_u_rule (m, t):
-        expr = sum([m.NonConvexFlow.status[n, O[n], t] * m.flows[n, O[n]].max[t] *
-                    m.flows[n, O[n]].nominal_value - m.flow[n, O[n], t] for n in groups])\
+        expr = sum([_online_capacity(m, n, O[n], t) - m.flow[n, O[n], t] for n in groups])\
                + sr_u_storage[t]\
                >= limit[t]
 
@@ -179,36 +196,232 @@ def n1_constraint (m, limit, groups=None):
 
     O = {n: [k for (k, v) in n.electrical_output.items()][0] for n in groups}
 
-    def n1_rule (m, t):
-
-        expr = sum([m.NonConvexFlow.status[n, O[n], t] * m.flows[n, O[n]].max[t] *
-                    m.flows[n, O[n]].nominal_value for n in groups]) - \
-               m.NonConvexFlow.status[groups[0], O[groups[0]], t] * m.flows[groups[0], O[groups[0]]].max[t] * \
-               m.flows[groups[0], O[groups[0]]].nominal_value \
-               >= limit[t] * m.NonConvexFlow.status[groups[0], O[groups[0]], t]
+    def n_rule (m, t, n):
+        # outage of one unit of n: a single generator or one unit of an online generator bank
+        if isinstance(n, GeneratorBank):
+            online = m.GeneratorBankBlock.online[n, t]
+            outage = online * m.flows[n, O[n]].max[t] * n.unit_nominal_value
+        else:
+            online = m.NonConvexFlow.status[n, O[n], t]
+            outage = _online_capacity(m, n, O[n], t)
+
+        expr = sum([_online_capacity(m, k, O[k], t) for k in groups]) - outage \
+               >= limit[t] * online
         return expr
 
-    m.n1_constraint = po.Constraint(m.TIMESTEPS, rule=n1_rule)
+    if any(isinstance(n, GeneratorBank) for n in groups):
+        _bank_online(m)
 
-    def n2_rule (m, t):
-        expr = sum([m.NonConvexFlow.status[n, O[n], t] * m.flows[n, O[n]].max[t] *
-                    m.flows[n, O[n]].nominal_value for n in groups]) - \
-               m.NonConvexFlow.status[groups[1], O[groups[1]], t] * m.flows[groups[1], O[groups[1]]].max[t] * \
-               m.flows[groups[1], O[groups[1]]].nominal_value \
-               >= limit[t] * m.NonConvexFlow.status[groups[1], O[groups[1]], t]
-        return expr
+    for i, n in enumerate(groups):
+        setattr(m, 'n' + str(i + 1) + '_constraint',
+                po.Constraint(m.TIMESTEPS, rule=lambda m, t, n=n: n_rule(m, t, n)))
 
-    m.n2_constraint = po.Constraint(m.TIMESTEPS, rule=n2_rule)
+    return m
 
-    def n3_rule (m, t):
-        expr = sum([m.NonConvexFlow.status[n, O[n], t] * m.flows[n, O[n]].max[t] *
-                    m.flows[n, O[n]].nominal_value for n in groups]) - \
-               m.NonConvexFlow.status[groups[2], O[groups[2]], t] * m.flows[groups[2], O[groups[2]]].max[t] * \
-               m.flows[groups[2], O[groups[2]]].nominal_value \
-               >= limit[t] * m.NonConvexFlow.status[groups[2], O[groups[2]], t]
-        return expr
 
-    m.n3_constraint = po.Constraint(m.TIMESTEPS, rule=n3_rule)
+def generator_bank_constraint (m, banks=None):
+    """
+    Adds the integer online-count variable m.GeneratorBankBlock.count of every GeneratorBank to the model and links
+    it to the output limits, the linearised fuel curve and the om costs of the online units, which are weighted by
+    the length of the time steps like the variable costs.
+    """
+    banks = [n for n in (banks or []) if isinstance(n, GeneratorBank)]
+    if not banks:
+        return m
+
+    m.GENERATOR_BANKS = po.Set(initialize=banks, ordered=True)
+    m.GeneratorBankBlock = po.Block()
+    block = m.GeneratorBankBlock
+
+    O = {n: [k for (k, v) in n.electrical_output.items()][0] for n in banks}
+    I = {n: [k for (k, v) in n.fuel_input.items()][0] for n in banks}
+    fuel = {n: linear_fuel_curve(n.fuel_curve, n.unit_nominal_value) for n in banks}
+
+    block.count = po.Var(m.GENERATOR_BANKS, m.TIMESTEPS, within=po.NonNegativeIntegers,
+                         bounds=lambda block, n, t: (0, n.units))
+
+    def max_rule (block, n, t):
+        return m.flow[n, O[n], t] <= block.count[n, t] * m.flows[n, O[n]].max[t] * n.unit_nominal_value
+
+    block.max = po.Constraint(m.GENERATOR_BANKS, m.TIMESTEPS, rule=max_rule)
+
+    def min_rule (block, n, t):
+        return m.flow[n, O[n], t] >= block.count[n, t] * n.min * n.unit_nominal_value
+
+    block.min = po.Constraint(m.GENERATOR_BANKS, m.TIMESTEPS, rule=min_rule)
+
+    def fuel_rule (block, n, t):
+        intercept, slope = fuel[n]
+        return m.flow[I[n], n, t] == block.count[n, t] * intercept + m.flow[n, O[n], t] * slope
+
+    block.fuel = po.Constraint(m.GENERATOR_BANKS, m.TIMESTEPS, rule=fuel_rule)
+
+    m.objective.set_value(m.objective.expr + sum(block.count[n, t] * n.om_costs * n.unit_nominal_value *
+                                                 m.timeincrement[t] for n in banks for t in m.TIMESTEPS))
 
     return m
 
+
+def om_costs_weighting (m, groups):
+    """
+    Weights the om costs of the NonConvex generator flows of groups by the length of the time steps, like the
+    variable costs weighted by objective_weighting. NonConvexFlow adds status * om_costs * nominal_value of every
+    time step unweighted, the objective gets the difference for the time steps longer or shorter than one hour.
+    """
+    flows = [(n, o) for n in groups if not isinstance(n, GeneratorBank) for o, f in n.outputs.items()
+             if f.nonconvex is not None and getattr(f.nonconvex, 'om_costs', None)]
+    T = [t for t in m.TIMESTEPS if m.timeincrement[t] != 1]
+
+    if flows and T:
+        m.objective.set_value(m.objective.expr + sum((m.timeincrement[t] - 1) * m.NonConvexFlow.status[n, o, t] *
+                                                     m.flows[n, o].nonconvex.om_costs * m.flows[n, o].nominal_value
+                                                     for (n, o) in flows for t in T))
+
+    return m
+
+
+def diesel_limit_constraint (m, limit, source):
+    """
+    Limits the fuel taken from the diesel source over the horizon to limit, e.g. the epsilon constraint of a
+    cost vs. diesel trade-off.
+    """
+    flows = [(i, o) for (i, o) in m.FLOWS if i is source]
+
+    m.diesel_limit = po.Constraint(expr=sum(m.flow[i, o, t] * m.timeincrement[t]
+                                            for (i, o) in flows for t in m.TIMESTEPS) <= limit)
+
+    return m
+
+
+def renewable_share_constraint (m, share, groups, demand):
+    """
+    Requires that at least the fraction share of the demand over the horizon is not covered by the generators.
+    """
+    O = {n: [k for (k, v) in n.electrical_output.items()][0] for n in groups}
+    I = [i for (i, o) in m.FLOWS if o is demand]
+
+    generation = sum(m.flow[n, O[n], t] * m.timeincrement[t] for n in groups for t in m.TIMESTEPS)
+    consumption = sum(m.flow[i, demand, t] * m.timeincrement[t] for i in I for t in m.TIMESTEPS)
+
+    m.renewable_share = po.Constraint(expr=generation <= (1 - share) * consumption)
+
+    return m
+
+
+def _bank_online (m):
+    # binary indicator count >= 1 of every generator bank, only needed for the N-1 criterion
+    block = m.GeneratorBankBlock
+    if hasattr(block, 'online'):
+        return
+
+    block.online = po.Var(m.GENERATOR_BANKS, m.TIMESTEPS, within=po.Binary)
+
+    def online_rule (block, n, t):
+        return block.online[n, t] <= block.count[n, t]
+
+    block.online_l = po.Constraint(m.GENERATOR_BANKS, m.TIMESTEPS, rule=online_rule)
+
+    def online_u_rule (block, n, t):
+        return block.count[n, t] <= n.units * block.online[n, t]
+
+    block.online_u = po.Constraint(m.GENERATOR_BANKS, m.TIMESTEPS, rule=online_u_rule)
+
+
+def _values (var, index):
+    return np.array([var[i].value for i in index], dtype=float)
+
+
+def _online_capacity_values (m, n, o, T):
+    if isinstance(n, GeneratorBank):
+        online = _values(m.GeneratorBankBlock.count, [(n, t) for t in T]) * n.unit_nominal_value
+    else:
+        online = _values(m.NonConvexFlow.status, [(n, o, t) for t in T]) * m.flows[n, o].nominal_value
+
+    return online * np.array([m.flows[n, o].max[t] for t in T])
+
+
+def reserve_violations (m, sr_limit, rm_limit, groups=None, storage=None):
+    """
+    Evaluates the spinning reserve and rotating mass constraints of a solved model for all time steps at once, no
+    matter if their rows are active. Returns the violation of every constraint family per time step (0 if satisfied).
+    """
+    T = list(m.TIMESTEPS)
+
+    O = {n: [k for (k, v) in n.electrical_output.items()][0] for n in groups}
+
+    flow = sum(_values(m.flow, [(n, O[n], t) for t in T]) for n in groups)
+
+    headroom = sum(_online_capacity_values(m, n, O[n], T) for n in groups) - flow
+
+    if storage is not None:
+        if isinstance(storage.investment, Investment):
+            size = m.GenericInvestmentStorageBlock.invest[storage].value
+            capacity = _values(m.GenericInvestmentStorageBlock.capacity, [(storage, t) for t in T])
+        else:
+            size = storage.nominal_capacity
+            capacity = _values(m.GenericStorageBlock.capacity, [(storage, t) for t in T])
+
+        available = capacity - size * np.array([storage.capacity_min[t] for t in T])
+
+        l_storage = size * storage.nominal_output_capacity_ratio
+        sr_u_storage = available * storage.nominal_output_capacity_ratio
+        rm_u_storage = available * np.array([storage.outflow_conversion_factor[t] for t in T])
+    else:
+        l_storage = sr_u_storage = rm_u_storage = 0
+
+    sr_limit = np.asarray(sr_limit, dtype=float)
+    rm_limit = np.asarray(rm_limit, dtype=float)
+
+    return {'spinning_reserve_l': np.maximum(sr_limit - headroom - l_storage, 0),
+            'spinning_reserve_u': np.maximum(sr_limit - headroom - sr_u_storage, 0),
+            'rotating_mass_l': np.maximum(rm_limit - flow - l_storage, 0),
+            'rotating_mass_u': np.maximum(rm_limit - flow - rm_u_storage, 0)}
+
+
+def seed_reserve_constraints (m, seed=()):
+    """
+    Deactivates the reserve constraints of all time steps except seed. Inactive rows are not passed to the solver,
+    add_violated_reserve_constraints() activates them again where needed.
+    """
+    seed = set(seed)
+
+    for name in RESERVE_CONSTRAINTS:
+        for t in m.TIMESTEPS:
+            if t not in seed:
+                getattr(m, name)[t].deactivate()
+
+    return m
+
+
+def add_violated_reserve_constraints (m, sr_limit, rm_limit, groups=None, storage=None, tol=1e-6):
+    """
+    Activates the reserve constraints of every time step in which the current solution violates one of them and
+    returns the number of time steps added.
+    """
+    T = list(m.TIMESTEPS)
+
+    violation = reserve_violations(m, sr_limit, rm_limit, groups=groups, storage=storage)
+    violated = np.flatnonzero(np.max(list(violation.values()), axis=0) > tol)
+
+    added = 0
+
+    for i in violated:
+        rows = [getattr(m, name)[T[i]] for name in RESERVE_CONSTRAINTS]
+        if not all(row.active for row in rows):
+            for row in rows:
+                row.activate()
+            added += 1
+
+    return added
+
+
+def mark_reserve_constraints_lazy (m, opt, level=1):
+    """
+    Sets the Gurobi attribute Lazy of all reserve constraints through pyomo's gurobi_persistent interface opt, so
+    that the solver keeps them out of the active model and only adds violated rows.
+    """
+    for name in RESERVE_CONSTRAINTS:
+        for t in m.TIMESTEPS:
+            opt.set_linear_constraint_attr(getattr(m, name)[t], 'Lazy', level)
+
+    return m
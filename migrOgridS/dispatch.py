@@ -0,0 +1,268 @@
+"""
+Real-time dispatch: setpoints for the next hours from the current plant state and a short forecast.
+
+The model of main_RH.create_optimization_model is built once and kept in memory. Every call only updates its
+parameters - the fixed demand and PV flows, the reserve limits and the initial storage capacity - and solves it
+within a time limit, with gurobi_persistent the model stays loaded in the solver. If no solution is found within
+the deadline, the setpoints of a rule-based heuristic are returned instead.
+"""
+
+import itertools
+import logging
+import time
+
+import numpy as np
+import pandas as pd
+
+import main_RH as main
+import presolve
+
+
+def heuristic_dispatch(demand, pv, soc, cap_batt, gens, sr_requirement=0.2, rm_requirement=0.4, input_ratio=0.546,
+                       output_ratio=0.546, inflow_efficiency=0.92, outflow_efficiency=0.92, capacity_min=0.5,
+                       capacity_max=1):
+    """
+    Rule-based setpoints: PV covers the demand and charges the battery, the battery discharges down to capacity_min
+    and the smallest unit combination that respects the generator order and covers the residual demand plus
+    spinning reserve runs proportionally loaded. The generators produce at least the rotating mass the battery
+    cannot provide with its output power and remaining energy (custom_constraints.rotating_mass_constraint).
+    Generator output above the residual demand goes to excess, like in the model the generators cannot charge the
+    battery.
+
+    :param demand:  demand forecast [kW]                                            np.array
+    :param pv:      PV feed-in forecast [kW]                                        np.array
+    :param soc:     current absolute storage capacity [kWh]                         float
+    :param gens:    generator parameters, see presolve.generator_data()             list of dict
+    :return: setpoints                                                              dict of np.array
+    """
+    p_min = np.array([g['p_min'] for g in gens])
+    p_max = np.array([g['p_max'] for g in gens])
+
+    combinations = []
+    for combination in itertools.product([0, 1], repeat=len(gens)):
+        on = np.array(combination, dtype=bool)
+        if len(gens) > 1 and on[1] and not on[0]:
+            continue
+        combinations += [on]
+    combinations.sort(key=lambda on: p_max[on].sum())
+
+    n = len(demand)
+    res = {'storage_in': np.zeros(n), 'storage_out': np.zeros(n), 'soc': np.zeros(n), 'excess': np.zeros(n)}
+    for g in gens:
+        res[g['node'].label] = np.zeros(n)
+        res[g['node'].label + '_status'] = np.zeros(n)
+
+    soc_min = capacity_min * cap_batt
+    soc_max = capacity_max * cap_batt
+
+    for t in range(n):
+        net = pv[t] - demand[t]
+        charge = discharge = 0.0
+
+        if net > 0:
+            charge = min(net, input_ratio * cap_batt, (soc_max - soc) / inflow_efficiency)
+            res['excess'][t] += net - charge
+            residual = 0.0
+        else:
+            discharge = min(-net, output_ratio * cap_batt, max(soc - soc_min, 0) * outflow_efficiency)
+            residual = -net - discharge
+
+        # rotating mass refers to the storage capacity at the end of the hour
+        remaining = max(soc + charge * inflow_efficiency - discharge / outflow_efficiency - soc_min, 0)
+        output = max(residual, rm_requirement * demand[t] - min(output_ratio * cap_batt,
+                                                                 remaining * outflow_efficiency))
+
+        # the battery provides reserve with its remaining output power and energy
+        storage_reserve = min(output_ratio * cap_batt, max(soc - soc_min, 0) * outflow_efficiency) - discharge
+        required = output + sr_requirement * demand[t] - storage_reserve
+
+        on = next((on for on in combinations if p_max[on].sum() >= max(required, output)), combinations[-1])
+        if output <= 0 and required <= 0:
+            on = np.zeros(len(gens), dtype=bool)
+
+        if on.any():
+            load = np.clip(output * p_max[on] / p_max[on].sum(), p_min[on], p_max[on])
+            res['excess'][t] += load.sum() - residual
+
+            for g, value in zip([g for g, o in zip(gens, on) if o], load):
+                res[g['node'].label][t] = value
+                res[g['node'].label + '_status'][t] = 1
+
+        soc += charge * inflow_efficiency - discharge / outflow_efficiency
+        res['storage_in'][t] = charge
+        res['storage_out'][t] = discharge
+        res['soc'][t] = soc
+
+    return res
+
+
+class RealtimeDispatch(object):
+    """
+    Hot dispatch model for the plant controller.
+
+    Parameters:
+        cap_pv:     installed PV capacity                                           float
+        cap_batt:   installed storage capacity                                      float
+        horizon:    number of hours of the forecast and the setpoints               int
+        cost:       cost dict, main_RH.get_cost_dict(horizon) if None               dict
+        solver:     'gurobi_persistent' keeps the model loaded in Gurobi, other
+                    solvers get the model written anew on every call                str
+        gap:        allowable gap of the optimization                               float
+    """
+
+    def __init__ (self, cap_pv, cap_batt, horizon=24, cost=None, solver='gurobi_persistent', gap=0.01):
+        import pyomo.environ as po
+
+        self.horizon = horizon
+        self.cap_pv = cap_pv
+        self.cap_batt = cap_batt
+        self.solver = solver
+        self.gap = gap
+
+        if cost is None:
+            cost = main.get_cost_dict(horizon)
+
+        index = pd.date_range('2017-01-01', periods=horizon, freq='h')
+        feedin = pd.DataFrame({'PV': np.zeros(horizon), 'demand_el': np.zeros(horizon)}, index=index)
+
+        m, gen_set = main.create_optimization_model('simulation', feedin, 0.5 * cap_batt, cost, cap_pv, cap_batt,
+                                                    iterstatus=False, reserve_params=True)
+        self.m = m
+        self.gens = presolve.generator_data(gen_set)
+
+        groups = m.es.groups
+        self.storage = groups['storage']
+        self.demand_flow = (groups['electricity'], groups['demand'])
+        self.pv_flow = (groups['PV'], groups['electricity_dc'])
+        self.storage_in = (groups['electricity_dc'], self.storage)
+        self.storage_out = (self.storage, groups['electricity_dc'])
+        self.excess = (groups['electricity'], groups['excess'])
+
+        # the storage balance of the first time step refers to the mutable initial capacity
+        t0 = m.TIMESTEPS.first()
+        storage = self.storage
+        m.GenericStorageBlock.balance[storage, t0].deactivate()
+        m.initial_soc = po.Param(initialize=0.5 * cap_batt, mutable=True)
+        m.initial_balance = po.Constraint(
+            expr=m.GenericStorageBlock.capacity[storage, t0] ==
+            m.initial_soc * (1 - storage.capacity_loss[t0]) +
+            m.flow[self.storage_in[0], storage, t0] * storage.inflow_conversion_factor[t0] -
+            m.flow[storage, self.storage_out[1], t0] / storage.outflow_conversion_factor[t0])
+
+        self.opt = None
+        if solver == 'gurobi_persistent':
+            self.opt = po.SolverFactory(solver)
+            self.opt.set_instance(m)
+            self.opt.set_gurobi_param('MIPGap', gap)
+
+    def _update (self, demand, pv, soc, gen_status):
+        m = self.m
+        T = list(m.TIMESTEPS)
+
+        m.initial_soc = soc
+        for t in T:
+            m.flow[self.demand_flow + (t,)].fix(demand[t])
+            m.flow[self.pv_flow + (t,)].fix(pv[t])
+            m.sr_limit[t] = 0.2 * demand[t]
+            m.rm_limit[t] = 0.4 * demand[t]
+
+        # current status as start values of the first hour
+        for g in self.gens:
+            m.NonConvexFlow.status[g['node'], g['bus'], T[0]].value = gen_status.get(g['node'].label, 0)
+
+        if self.opt is not None:
+            for t in T:
+                self.opt.update_var(m.flow[self.demand_flow + (t,)])
+                self.opt.update_var(m.flow[self.pv_flow + (t,)])
+            # constraints holding mutable parameters are passed anew
+            rows = [m.initial_balance] + [getattr(m, name)[t] for name in
+                                          ['spinning_reserve_l', 'spinning_reserve_u', 'rotating_mass_l',
+                                           'rotating_mass_u'] for t in T]
+            for row in rows:
+                self.opt.remove_constraint(row)
+                self.opt.add_constraint(row)
+
+    def _solve (self, time_limit):
+        m = self.m
+
+        if self.opt is not None:
+            self.opt.set_gurobi_param('TimeLimit', time_limit)
+            self.opt.solve(tee=False, load_solutions=False, warmstart=True)
+            if self.opt.get_model_attr('SolCount') == 0:
+                return False
+            self.opt.load_vars()
+            return True
+
+        m.solve(solver=self.solver, solve_kwargs={'tee': False, 'warmstart': True},
+                cmdline_options={'MIPGap': self.gap, 'TimeLimit': time_limit})
+
+        results = m.solver_results
+        if str(results.solver.status) not in ('ok', 'warning', 'aborted'):
+            return False
+        termination = str(results.solver.termination_condition)
+        if termination in ('optimal', 'feasible'):
+            return True
+
+        # a solve stopped by the time limit keeps its incumbent, if it found one
+        try:
+            return termination == 'maxTimeLimit' and abs(float(results.problem.upper_bound)) < np.inf
+        except (TypeError, ValueError):
+            return False
+
+    def _setpoints (self):
+        m = self.m
+        T = list(m.TIMESTEPS)
+
+        def values(var, key):
+            return np.array([var[key + (t,)].value for t in T], dtype=float)
+
+        res = {'storage_in': values(m.flow, self.storage_in),
+               'storage_out': values(m.flow, self.storage_out),
+               'soc': values(m.GenericStorageBlock.capacity, (self.storage,)),
+               'excess': values(m.flow, self.excess)}
+        for g in self.gens:
+            res[g['node'].label] = values(m.flow, (g['node'], g['bus']))
+            res[g['node'].label + '_status'] = np.round(values(m.NonConvexFlow.status, (g['node'], g['bus'])))
+        return res
+
+    def setpoints (self, demand, pv, soc, gen_status=None, deadline=1.0):
+        """
+        Returns the setpoints of the next hours.
+
+        :param demand:      demand forecast [kW] of horizon hours                       pd.Series or np.array
+        :param pv:          PV capacity factor forecast of horizon hours                pd.Series or np.array
+        :param soc:         current absolute storage capacity [kWh]                     float
+        :param gen_status:  current status of the generators {label: 0 or 1}            dict
+        :param deadline:    latency budget of the call in seconds                       float
+        :return: setpoints  generator outputs and status, storage flows and capacity,
+                            excess                                                      pd.DataFrame
+                 source     'optimal' or 'heuristic'                                    str
+        """
+        start = time.time()
+        index = demand.index if isinstance(demand, pd.Series) else None
+        demand = np.asarray(demand, dtype=float)
+        pv = np.asarray(pv, dtype=float) * self.cap_pv
+
+        if len(demand) != self.horizon or len(pv) != self.horizon:
+            raise ValueError('The forecasts have to cover ' + str(self.horizon) + ' hours')
+
+        self._update(demand, pv, soc, gen_status or {})
+
+        # keep a margin for reading the solution
+        time_limit = deadline - (time.time() - start) - 0.05
+        solved = False
+        if time_limit > 0:
+            try:
+                solved = self._solve(time_limit)
+            except Exception:
+                logging.exception('Dispatch solve failed')
+
+        if solved:
+            res, source = self._setpoints(), 'optimal'
+        else:
+            logging.warning('No dispatch solution within ' + str(deadline) + ' s, using the heuristic')
+            res, source = heuristic_dispatch(demand, pv, soc, self.cap_batt, self.gens), 'heuristic'
+
+        logging.info('Dispatch (' + source + ') in ' + str(round(time.time() - start, 3)) + ' s')
+
+        return pd.DataFrame(res, index=index), source
@@ -0,0 +1,739 @@
+"""
+Direct matrix builder for the microgrid MILP.
+
+The model of main.create_energysystem_model is assembled as sparse constraint matrix, bounds, integrality and
+objective vector with NumPy and SciPy instead of pyomo expression trees, and solved in-process with HiGHS through
+scipy.optimize.milp. It covers the topology of this project: engine generators with linearised fuel curve and status,
+generator banks, fixed PV, GenericStorage, transformers such as the inverter, fixed demand and excess sinks, and the
+spinning reserve, rotating mass and generator order constraints of custom_constraints.
+
+The model is set up in two steps, so that the structure can be reused for new timeseries:
+
+- describe() reads the parameters of the oemof nodes into a structure, which only holds labels and numbers, and the
+  data, i.e. the fixed flow profiles, the reserve limits and the initial storage capacity.
+- FastModel compiles the structure into the column layout and the coefficients of the matrix once, bind() sets the
+  data dependent bounds and coefficients.
+
+results() returns the same structure as oemof.outputlib.processing.results, so that cost_summary.get_lcoe,
+main.sizing_results and main.results_postprocessing can be used unchanged. parity_check() compares the model with
+the pyomo path.
+"""
+
+import logging
+import os
+import pickle
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.optimize import Bounds, LinearConstraint, milp
+
+RESERVE_ROWS = ['spinning_reserve_l', 'spinning_reserve_u', 'rotating_mass_l', 'rotating_mass_u']
+
+
+def _sequence(value, T):
+    # values of an oemof sequence or scalar for T time steps, None counts as 0
+    try:
+        values = [value[t] for t in range(T)]
+    except TypeError:
+        values = [value] * T
+    return np.array([0 if v is None else v for v in values], dtype=float)
+
+
+def node_label(node):
+    """Label of a node as used in the structure of describe()"""
+    return None if node is None else str(node.label)
+
+
+def _investment(investment):
+    if investment is None:
+        return None
+    maximum = getattr(investment, 'maximum', None)
+    return {'ep_costs': investment.ep_costs or 0,
+            'minimum': getattr(investment, 'minimum', None) or 0,
+            'maximum': np.inf if maximum is None else float(maximum)}
+
+
+def describe(es, gen_set, storage, sr_limit, rm_limit, timeincrement=None):
+    """
+    Reads the parameters of the energy system es into a structure and its data.
+
+    :param es:              energy system, e.g. from main.create_energysystem()            oemof.solph.EnergySystem
+    :param gen_set:         generators with reserve and order constraints                  list
+    :param storage:         storage contributing to the reserves or None                   GenericStorage
+    :param sr_limit:        spinning reserve requirement per time step                     array like
+    :param rm_limit:        rotating mass requirement per time step                        array like
+    :param timeincrement:   length of the time steps in hours, hourly if None              list of int
+    :return: structure      topology and parameters, labels and numbers only                dict
+             data           fixed flow profiles, reserve limits and initial capacities     dict
+    """
+    from generator_bank import GeneratorBank
+    from presolve import linear_fuel_curve
+    from oemof.solph import Bus
+    from oemof.solph.components import GenericStorage
+
+    T = len(es.timeindex)
+    weights = np.ones(T) if timeincrement is None else np.asarray(timeincrement, dtype=float)
+
+    structure = {'timesteps': T, 'timeincrement': weights, 'buses': [], 'flows': [], 'transformers': [],
+                 'generators': [], 'storages': [], 'reserve': None}
+    data = {'actual_value': {}, 'sr_limit': np.asarray(sr_limit, dtype=float),
+            'rm_limit': np.asarray(rm_limit, dtype=float), 'initial_capacity': {}}
+
+    generators = set(gen_set)
+
+    for (i, o), flow in sorted(es.flows().items(), key=lambda x: (node_label(x[0][0]), node_label(x[0][1]))):
+        name = (node_label(i), node_label(o))
+        structure['flows'] += [{'name': name,
+                                'nominal_value': flow.nominal_value,
+                                'min': _sequence(flow.min, T),
+                                'max': _sequence(flow.max, T),
+                                'fixed': bool(flow.fixed),
+                                'nonconvex': flow.nonconvex is not None,
+                                'variable_costs': _sequence(flow.variable_costs, T),
+                                'fixed_costs': flow.fixed_costs or 0,
+                                'investment': _investment(flow.investment)}]
+        if flow.fixed:
+            data['actual_value'][name] = _sequence(flow.actual_value, T)
+
+    for n in sorted(es.nodes, key=node_label):
+        if isinstance(n, Bus):
+            structure['buses'] += [node_label(n)]
+
+        elif n in generators or hasattr(n, 'fuel_curve'):
+            (i, fuel), = n.inputs.items()
+            (o, flow), = n.outputs.items()
+            bank = isinstance(n, GeneratorBank)
+            unit_nominal_value = n.unit_nominal_value if bank else flow.nominal_value
+            intercept, slope = linear_fuel_curve(n.fuel_curve, unit_nominal_value)
+            structure['generators'] += [{'label': node_label(n),
+                                         'fuel': (node_label(i), node_label(n)),
+                                         'output': (node_label(n), node_label(o)),
+                                         'bank': bank,
+                                         'units': n.units if bank else 1,
+                                         'unit_nominal_value': unit_nominal_value,
+                                         'min': _sequence(n.min if bank else flow.min, T),
+                                         'max': _sequence(flow.max, T),
+                                         'om_costs': (n.om_costs if bank else flow.nonconvex.om_costs) or 0,
+                                         'intercept': intercept,
+                                         'slope': slope}]
+
+        elif isinstance(n, GenericStorage):
+            (i, inflow), = n.inputs.items()
+            (o, outflow), = n.outputs.items()
+            iteration = getattr(n, 'initial_iteration', None)
+            structure['storages'] += [{'label': node_label(n),
+                                       'input': (node_label(i), node_label(n)),
+                                       'output': (node_label(n), node_label(o)),
+                                       'nominal_capacity': n.nominal_capacity,
+                                       'investment': _investment(n.investment),
+                                       'capacity_loss': _sequence(n.capacity_loss, T),
+                                       'inflow_conversion_factor': _sequence(n.inflow_conversion_factor, T),
+                                       'outflow_conversion_factor': _sequence(n.outflow_conversion_factor, T),
+                                       'capacity_min': _sequence(n.capacity_min, T),
+                                       'capacity_max': _sequence(n.capacity_max, T),
+                                       'input_ratio': n.nominal_input_capacity_ratio,
+                                       'output_ratio': n.nominal_output_capacity_ratio,
+                                       'fixed_costs': n.fixed_costs or 0,
+                                       # initial_iteration False: initial_capacity is absolute (rolling horizon)
+                                       'relative_initial': iteration is None or bool(iteration)}]
+            data['initial_capacity'][node_label(n)] = n.initial_capacity
+
+        elif hasattr(n, 'conversion_factors'):
+            if len(n.inputs) != 1 or len(n.outputs) != 1:
+                raise ValueError('Transformer ' + node_label(n) + ' needs exactly one input and one output')
+            (i, _), = n.inputs.items()
+            (o, _), = n.outputs.items()
+            structure['transformers'] += [{'label': node_label(n),
+                                           'input': (node_label(i), node_label(n)),
+                                           'output': (node_label(n), node_label(o)),
+                                           'input_factor': _sequence(n.conversion_factors[i], T),
+                                           'output_factor': _sequence(n.conversion_factors[o], T)}]
+
+    # reserves and order refer to the generators sorted by their maximum output like in custom_constraints
+    gens = [g for g in structure['generators'] if g['label'] in set(node_label(n) for n in gen_set)]
+    gens.sort(key=lambda g: g['units'] * g['unit_nominal_value'] * g['max'][0])
+    structure['reserve'] = {'generators': [g['label'] for g in gens],
+                            'storage': node_label(storage)}
+
+    return structure, data
+
+
+class FastModel(object):
+    """
+    Microgrid MILP as sparse matrix, compiled from the structure of describe().
+
+    Parameters:
+        structure:  topology and parameters, see describe()                         dict
+        data:       data bound to the model, see bind()                             dict or None
+        es:         energy system the structure was read from, needed to key
+                    results() by nodes like processing.results                      oemof.solph.EnergySystem
+    """
+
+    def __init__ (self, structure, data=None, es=None):
+        self.structure = structure
+        self.es = es
+        self.x = None
+        self.solver_results = None
+
+        start = time.time()
+        self._compile()
+        logging.info('Compiled matrix model with ' + str(self.n_columns) + ' columns and ' + str(self.n_rows) +
+                     ' rows in ' + str(round(time.time() - start, 3)) + ' s')
+
+        if data is not None:
+            self.bind(data)
+
+    @classmethod
+    def from_energysystem (cls, es, gen_set, storage, sr_limit, rm_limit, timeincrement=None):
+        """Returns the compiled and bound model of the energy system es, see describe()"""
+        structure, data = describe(es, gen_set, storage, sr_limit, rm_limit, timeincrement)
+        return cls(structure, data, es=es)
+
+    # layout ##########################################################################################################
+
+    def _add_columns (self, key, length, lb=0, ub=np.inf, integer=0):
+        self.columns[key] = (self.n_columns, length)
+        self._lb.append(np.broadcast_to(np.asarray(lb, dtype=float), (length,)).copy())
+        self._ub.append(np.broadcast_to(np.asarray(ub, dtype=float), (length,)).copy())
+        self._integrality.append(np.full(length, integer, dtype=np.uint8))
+        self._c.append(np.zeros(length))
+        self.n_columns += length
+
+    def column (self, key):
+        """Returns the column indices of the variable key, e.g. ('flow', 'PV', 'electricity_dc')"""
+        start, length = self.columns[key]
+        return np.arange(start, start + length)
+
+    def _add_rows (self, name, terms, lb=-np.inf, ub=np.inf, length=None):
+        # terms: (column key or index array, coefficients, slot name or None), one row per time step
+        T = self.structure['timesteps'] if length is None else length
+        start = self.n_rows
+
+        for key, coefficients, slot in terms:
+            columns = self.column(key) if isinstance(key, tuple) else np.asarray(key)
+            columns = np.broadcast_to(columns, (T,))
+            if slot is not None:
+                self.slots[slot] = (self._nnz, T)
+            self._rows.append(np.arange(start, start + T))
+            self._cols.append(columns)
+            self._vals.append(np.broadcast_to(np.asarray(coefficients, dtype=float), (T,)).copy())
+            self._nnz += T
+
+        self.rows[name] = (start, T)
+        self._row_lb.append(np.broadcast_to(np.asarray(lb, dtype=float), (T,)).copy())
+        self._row_ub.append(np.broadcast_to(np.asarray(ub, dtype=float), (T,)).copy())
+        self.n_rows += T
+
+    def _compile (self):
+        s = self.structure
+        T = s['timesteps']
+        w = s['timeincrement']
+
+        self.columns = OrderedDict()
+        self.rows = OrderedDict()
+        self.slots = {}
+        self.n_columns = self.n_rows = self._nnz = 0
+        self._lb, self._ub, self._integrality, self._c = [], [], [], []
+        self._rows, self._cols, self._vals, self._row_lb, self._row_ub = [], [], [], [], []
+        self.constant = 0.0
+        # row bound offsets of the reserve rows that hold constant storage terms
+        self._reserve_offset = {}
+
+        generators = {g['output']: g for g in s['generators']}
+        storages = {st['label']: st for st in s['storages']}
+        storage_flows = {}
+        for st in s['storages']:
+            storage_flows[st['input']] = (st, 'input_ratio')
+            storage_flows[st['output']] = (st, 'output_ratio')
+
+        # flows
+        for f in s['flows']:
+            name = f['name']
+            nominal_value = f['nominal_value']
+            lb, ub = 0, np.inf
+
+            if f['investment'] is None and nominal_value is not None:
+                ub = f['max'] * nominal_value
+                if not f['nonconvex'] and name not in generators:
+                    lb = f['min'] * nominal_value
+
+            if name in storage_flows:
+                st, ratio = storage_flows[name]
+                if st['investment'] is None and st[ratio] is not None:
+                    ub = np.minimum(ub, st[ratio] * st['nominal_capacity'])
+
+            self._add_columns(('flow',) + name, T, lb, ub)
+            self._c[-1][:] = f['variable_costs'] * w
+
+            if f['investment'] is not None:
+                investment = f['investment']
+                self._add_columns(('invest',) + name, 1, investment['minimum'], investment['maximum'])
+                self._c[-1][:] = investment['ep_costs'] + f['fixed_costs']
+            elif nominal_value is not None:
+                self.constant += f['fixed_costs'] * nominal_value
+
+        # generator status and online count
+        for g in s['generators']:
+            if g['bank']:
+                self._add_columns(('count', g['label']), T, 0, g['units'], integer=1)
+            else:
+                self._add_columns(('status', g['label']), T, 0, 1, integer=1)
+            self._c[-1][:] = g['om_costs'] * g['unit_nominal_value'] * w
+
+        # storage capacity
+        for st in s['storages']:
+            if st['investment'] is None:
+                self._add_columns(('capacity', st['label']), T, st['capacity_min'] * st['nominal_capacity'],
+                                  st['capacity_max'] * st['nominal_capacity'])
+                self.constant += st['fixed_costs'] * st['nominal_capacity']
+            else:
+                self._add_columns(('capacity', st['label']), T)
+                investment = st['investment']
+                self._add_columns(('invest', st['label']), 1, investment['minimum'], investment['maximum'])
+                self._c[-1][:] = investment['ep_costs'] + st['fixed_costs']
+
+        # bus balances
+        for bus in s['buses']:
+            terms = [(('flow',) + f['name'], 1, None) for f in s['flows'] if f['name'][1] == bus] + \
+                    [(('flow',) + f['name'], -1, None) for f in s['flows'] if f['name'][0] == bus]
+            if terms:
+                self._add_rows('balance_' + bus, terms, 0, 0)
+
+        # transformers: flow(i, n) * factor(o) == flow(n, o) * factor(i)
+        for tr in s['transformers']:
+            self._add_rows('conversion_' + tr['label'],
+                           [(('flow',) + tr['input'], tr['output_factor'], None),
+                            (('flow',) + tr['output'], -tr['input_factor'], None)], 0, 0)
+
+        # investment flows, fixed ones follow their profile
+        for f in s['flows']:
+            if f['investment'] is None:
+                continue
+            name = f['name']
+            if f['fixed']:
+                self._add_rows('fixed_' + '_'.join(name), [(('flow',) + name, 1, None),
+                                                           (self.column(('invest',) + name), 0, name)], 0, 0)
+            else:
+                self._add_rows('max_' + '_'.join(name), [(('flow',) + name, 1, None),
+                                                         (self.column(('invest',) + name), -f['max'], None)],
+                               ub=0)
+
+        # generators: output limits and fuel curve of the online units
+        for g in s['generators']:
+            online = ('count' if g['bank'] else 'status', g['label'])
+            p_max = g['max'] * g['unit_nominal_value']
+            p_min = g['min'] * g['unit_nominal_value']
+            self._add_rows('max_' + g['label'], [(('flow',) + g['output'], 1, None), (online, -p_max, None)], ub=0)
+            self._add_rows('min_' + g['label'], [(('flow',) + g['output'], 1, None), (online, -p_min, None)], lb=0)
+            self._add_rows('fuel_' + g['label'], [(('flow',) + g['fuel'], 1, None),
+                                                  (online, -g['intercept'], None),
+                                                  (('flow',) + g['output'], -g['slope'], None)], 0, 0)
+
+        # storages
+        for st in s['storages']:
+            capacity = self.column(('capacity', st['label']))
+            balance = [(capacity, 1, None),
+                       (('flow',) + st['input'], -w * st['inflow_conversion_factor'], None),
+                       (('flow',) + st['output'], w / st['outflow_conversion_factor'], None)]
+            # capacity(t-1) of t > 0, the first time step refers to the initial capacity
+            previous = np.concatenate(([capacity[0]], capacity[:-1]))
+            keep = -(1 - st['capacity_loss'])
+            keep[0] = 0
+            balance += [(previous, keep, None)]
+
+            if st['investment'] is None:
+                self._add_rows('storage_balance_' + st['label'], balance, 0, 0)
+                continue
+
+            invest = self.column(('invest', st['label']))
+            self._add_rows('storage_balance_' + st['label'], balance + [(invest, 0, 'initial_' + st['label'])], 0, 0)
+            self._add_rows('storage_max_' + st['label'], [(capacity, 1, None), (invest, -st['capacity_max'], None)],
+                           ub=0)
+            self._add_rows('storage_min_' + st['label'], [(capacity, 1, None), (invest, -st['capacity_min'], None)],
+                           lb=0)
+            for flow, ratio in ((st['input'], 'input_ratio'), (st['output'], 'output_ratio')):
+                if st[ratio] is not None:
+                    self._add_rows('storage_' + ratio + '_' + st['label'],
+                                   [(('flow',) + flow, 1, None), (invest, -st[ratio], None)], ub=0)
+
+        # reserves and generator order, see custom_constraints
+        reserve = s['reserve']
+        gens = [g for g in s['generators'] if g['label'] in reserve['generators']]
+        gens.sort(key=lambda g: reserve['generators'].index(g['label']))
+
+        if gens:
+            output = [(('flow',) + g['output'], 1, None) for g in gens]
+            headroom = [(('count' if g['bank'] else 'status', g['label']), g['max'] * g['unit_nominal_value'], None)
+                        for g in gens] + [(('flow',) + g['output'], -1, None) for g in gens]
+
+            st = storages.get(reserve['storage'])
+            l_storage, sr_u_storage, rm_u_storage = [], [], []
+            offset = dict((name, np.zeros(T)) for name in RESERVE_ROWS)
+
+            if st is not None:
+                capacity = self.column(('capacity', st['label']))
+                ratio = st['output_ratio']
+                outflow = st['outflow_conversion_factor']
+                sr_u_storage = [(capacity, ratio, None)]
+                rm_u_storage = [(capacity, outflow, None)]
+
+                if st['investment'] is None:
+                    size = st['nominal_capacity']
+                    offset['spinning_reserve_l'] += size * ratio
+                    offset['rotating_mass_l'] += size * ratio
+                    offset['spinning_reserve_u'] -= size * st['capacity_min'] * ratio
+                    offset['rotating_mass_u'] -= size * st['capacity_min'] * outflow
+                else:
+                    invest = self.column(('invest', st['label']))
+                    l_storage = [(invest, ratio, None)]
+                    sr_u_storage += [(invest, -st['capacity_min'] * ratio, None)]
+                    rm_u_storage += [(invest, -st['capacity_min'] * outflow, None)]
+
+            self._add_rows('spinning_reserve_l', headroom + l_storage)
+            self._add_rows('spinning_reserve_u', headroom + sr_u_storage)
+            self._add_rows('rotating_mass_l', output + l_storage)
+            self._add_rows('rotating_mass_u', output + rm_u_storage)
+            self._reserve_offset = offset
+
+        single = [g for g in gens if not g['bank']]
+        if len(single) >= 2:
+            self._add_rows('gen_order1', [(('status', single[0]['label']), 1, None),
+                                          (('status', single[1]['label']), -1, None)], lb=0)
+
+        self.lb = np.concatenate(self._lb)
+        self.ub = np.concatenate(self._ub)
+        self.integrality = np.concatenate(self._integrality)
+        self.c = np.concatenate(self._c)
+        self.row_lb = np.concatenate(self._row_lb)
+        self.row_ub = np.concatenate(self._row_ub)
+        self.A_rows = np.concatenate(self._rows)
+        self.A_cols = np.concatenate(self._cols)
+        self.A_vals = np.concatenate(self._vals)
+
+        del self._lb, self._ub, self._integrality, self._c, self._rows, self._cols, self._vals
+        del self._row_lb, self._row_ub
+
+    # data ############################################################################################################
+
+    def bind (self, data):
+        """
+        Sets the data dependent bounds and coefficients of the model.
+
+        :param data:    {'actual_value': {flow name: profile},
+                         'sr_limit': spinning reserve requirement per time step,
+                         'rm_limit': rotating mass requirement per time step,
+                         'initial_capacity': {storage label: relative or absolute capacity}}     dict
+        """
+        s = self.structure
+        flows = {f['name']: f for f in s['flows']}
+
+        for name, profile in data['actual_value'].items():
+            f = flows[name]
+            profile = np.asarray(profile, dtype=float)
+            if f['investment'] is None:
+                columns = self.column(('flow',) + name)
+                self.lb[columns] = self.ub[columns] = profile * f['nominal_value']
+            else:
+                start, length = self.slots[name]
+                self.A_vals[start:start + length] = -profile
+
+        for st in s['storages']:
+            initial = data['initial_capacity'][st['label']]
+            keep = 1 - st['capacity_loss'][0]
+            start, length = self.rows['storage_balance_' + st['label']]
+
+            if st['investment'] is None:
+                if st['relative_initial']:
+                    initial = initial * st['nominal_capacity']
+                self.row_lb[start] = self.row_ub[start] = initial * keep
+            else:
+                slot, _ = self.slots['initial_' + st['label']]
+                self.A_vals[slot] = -initial * keep if st['relative_initial'] else 0
+                self.row_lb[start] = self.row_ub[start] = 0 if st['relative_initial'] else initial * keep
+
+        limits = {'spinning_reserve_l': data['sr_limit'], 'spinning_reserve_u': data['sr_limit'],
+                  'rotating_mass_l': data['rm_limit'], 'rotating_mass_u': data['rm_limit']}
+        for name, limit in limits.items():
+            if name in self.rows:
+                start, length = self.rows[name]
+                self.row_lb[start:start + length] = np.asarray(limit, dtype=float) - self._reserve_offset[name]
+
+        self.data = data
+        self.x = None
+        return self
+
+    # solve ###########################################################################################################
+
+    def matrix (self):
+        """Returns the constraint matrix as scipy.sparse.csr_matrix"""
+        A = sparse.csr_matrix((self.A_vals, (self.A_rows, self.A_cols)), shape=(self.n_rows, self.n_columns))
+        # slots of unused data and the capacity(t-1) term of the first time step are 0
+        A.eliminate_zeros()
+        return A
+
+    def solve (self, gap=0.01, time_limit=None, disp=False):
+        """
+        Solves the model with HiGHS through scipy.optimize.milp.
+
+        :param gap:         allowable relative gap of the optimization                     float
+        :param time_limit:  time limit in seconds                                          float or None
+        :return: objective                                                                  float
+        """
+        options = {'disp': disp, 'mip_rel_gap': gap}
+        if time_limit is not None:
+            options['time_limit'] = time_limit
+
+        start = time.time()
+        res = milp(self.c, integrality=self.integrality, bounds=Bounds(self.lb, self.ub),
+                   constraints=LinearConstraint(self.matrix(), self.row_lb, self.row_ub), options=options)
+        self.solver_results = res
+
+        logging.info('HiGHS: ' + res.message + ' in ' + str(round(time.time() - start, 3)) + ' s')
+
+        if res.x is None:
+            raise RuntimeError('No solution of the matrix model: ' + res.message)
+
+        self.x = res.x
+        return self.objective()
+
+    def objective (self, hours=None):
+        """
+        Returns the objective value of the solution including the constant fixed costs. With hours only the costs of
+        the first hours time steps are summed up, e.g. the committed part of a rolling horizon window.
+        """
+        if hours is None:
+            return float(self.c.dot(self.x)) + self.constant
+
+        T = self.structure['timesteps']
+        committed = np.ones(self.n_columns, dtype=bool)
+        for start, length in self.columns.values():
+            if length == T:
+                committed[start + hours:start + length] = False
+        return float(self.c[committed].dot(self.x[committed])) + self.constant
+
+    def values (self, key):
+        """Returns the solution values of the variable key"""
+        return self.x[self.column(key)]
+
+    # results #########################################################################################################
+
+    def results (self):
+        """
+        Returns the results in the structure of oemof.outputlib.processing.results: {(node, node) or (node, None):
+        {'sequences': pd.DataFrame, 'scalars': pd.Series}}. Without energy system the keys hold the labels.
+        """
+        if self.x is None:
+            raise RuntimeError('The model has not been solved')
+
+        nodes = {} if self.es is None else {node_label(n): n for n in self.es.nodes}
+        if self.es is not None:
+            index = self.es.timeindex
+        elif getattr(self, 'index', None) is not None:
+            index = self.index
+        else:
+            index = pd.RangeIndex(self.structure['timesteps'])
+
+        sequences, scalars = OrderedDict(), OrderedDict()
+
+        for key in self.columns:
+            name, labels = key[0], key[1:]
+            if len(labels) == 1:
+                labels = labels + (None,)
+            node_key = tuple(nodes.get(label, label) if label is not None else None for label in labels)
+
+            if name == 'invest':
+                scalars.setdefault(node_key, OrderedDict())['invest'] = float(self.values(key)[0])
+            else:
+                sequences.setdefault(node_key, OrderedDict())[name] = self.values(key)
+
+        # status and count belong to the output flow of the generator like in processing.results
+        for g in self.structure['generators']:
+            if not g['bank']:
+                generator = nodes.get(g['label'], g['label'])
+                output = tuple(nodes.get(label, label) for label in g['output'])
+                sequences[output]['status'] = sequences.pop((generator, None))['status']
+
+        res = {}
+        for key in list(sequences.keys()) + [k for k in scalars if k not in sequences]:
+            res[key] = {'sequences': pd.DataFrame(sequences.get(key, {}), index=index),
+                        'scalars': pd.Series(scalars.get(key, {}), dtype=float)}
+        return res
+
+    def load_into (self, pm):
+        """
+        Sets the variables of the pyomo model pm of the same energy system to the solution, e.g. as MIP start.
+        """
+        nodes = {node_label(n): n for n in pm.es.nodes}
+        investment = [st['label'] for st in self.structure['storages'] if st['investment'] is not None]
+        x = np.where(self.integrality > 0, np.round(self.x), self.x)
+
+        for key, (first, length) in self.columns.items():
+            for t in range(length):
+                pyomo_variable(pm, nodes, investment, key, t).value = float(x[first + t])
+
+        return pm
+
+    # serialization ###################################################################################################
+
+    def save (self, filename):
+        """
+        Writes the compiled model, i.e. structure, column and row layout, matrix and bound data, without energy system
+        and solution. The file is replaced atomically, so that parallel workers never read a partial file.
+        """
+        state = {k: v for k, v in self.__dict__.items() if k not in ('es', 'x', 'solver_results')}
+
+        directory = os.path.dirname(filename)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+
+        with open(filename + '.' + str(os.getpid()), 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(filename + '.' + str(os.getpid()), filename)
+
+    @classmethod
+    def load (cls, filename, es=None):
+        """Returns the model saved in filename, without energy system results() are keyed by labels"""
+        with open(filename, 'rb') as f:
+            state = pickle.load(f)
+
+        m = cls.__new__(cls)
+        m.__dict__.update(state)
+        m.es = es
+        m.x = None
+        m.solver_results = None
+        return m
+
+
+def create_fast_model(mode, feedin, initial_batt_cap, cost, iterstatus=None, PV_source=True, storage_source=True,
+                      timeincrement=None, gen_banks=None):
+    """
+    The function sets up the energy system like main.create_energysystem_model and returns its matrix model, see
+    main.create_energysystem_model() for the parameters.
+
+    :return: m       matrix model                           FastModel
+             gen_set generators integrated in the model     list
+    """
+    import main
+
+    es, gen_set, storage = main.create_energysystem(mode, feedin, initial_batt_cap, cost, iterstatus=iterstatus,
+                                                    PV_source=PV_source, storage_source=storage_source,
+                                                    gen_banks=gen_banks)
+
+    reserve_base = feedin['demand_max'] if 'demand_max' in feedin else feedin['demand_el']
+
+    m = FastModel.from_energysystem(es, gen_set, storage, reserve_base * 0.2, reserve_base * 0.4, timeincrement)
+
+    return [m, gen_set]
+
+
+def pyomo_variable (pm, nodes, investment, key, t):
+    """
+    Returns the pyomo variable of the column key of a matrix model at time step t. nodes maps labels to the nodes of
+    pm, investment holds the labels of the investment storages.
+    """
+    name = key[0]
+
+    if name == 'flow':
+        return pm.flow[nodes[key[1]], nodes[key[2]], t]
+    if name == 'status':
+        g = nodes[key[1]]
+        return pm.NonConvexFlow.status[g, list(g.outputs.keys())[0], t]
+    if name == 'count':
+        return pm.GeneratorBankBlock.count[nodes[key[1]], t]
+    if name == 'capacity':
+        block = pm.GenericInvestmentStorageBlock if key[1] in investment else pm.GenericStorageBlock
+        return block.capacity[nodes[key[1]], t]
+    if name == 'invest' and len(key) == 3:
+        return pm.InvestmentFlow.invest[nodes[key[1]], nodes[key[2]]]
+    return pm.GenericInvestmentStorageBlock.invest[nodes[key[1]]]
+
+
+def parity_check (mode='investment', hours=168, file='data/timeseries.csv', solver='cbc', gap=1e-6, rtol=1e-4,
+                  cost=None, gen_banks=None):
+    """
+    Compares the matrix model with the pyomo model of main.create_energysystem_model for the first hours of file.
+
+    - Both models are built from the same energy system and solved, the optimal objectives have to agree.
+    - The solution of the matrix model is loaded into the pyomo model: every active constraint has to be satisfied
+      and the pyomo objective has to equal the objective of the matrix model.
+    - Both results hold the same keys, sequence columns and scalars, get_lcoe and results_postprocessing accept the
+      results of the matrix model.
+
+    :return: report     objectives, largest violation, differences and 'passed'            dict
+    """
+    import pyomo.environ as po
+    from oemof.outputlib import processing
+    import cost_summary as lcoe
+    import main
+
+    feedin = main.get_timeseries(file).iloc[:hours]
+    if cost is None:
+        cost = main.get_cost_dict(hours)
+
+    pm, gen_set = main.create_energysystem_model(mode, feedin, 0.5, cost, gen_banks=gen_banks)
+    storage = pm.es.groups.get('storage')
+    reserve_base = feedin['demand_el']
+
+    start = time.time()
+    fast = FastModel.from_energysystem(pm.es, gen_set, storage, reserve_base * 0.2, reserve_base * 0.4)
+    fast_objective = fast.solve(gap=gap)
+    report = {'fast_time': time.time() - start, 'fast_objective': fast_objective}
+
+    # solution of the matrix model in the pyomo model
+    fast.load_into(pm)
+
+    violation = 0.0
+    for row in pm.component_data_objects(po.Constraint, active=True):
+        body = po.value(row.body)
+        if row.has_lb():
+            violation = max(violation, po.value(row.lower) - body)
+        if row.has_ub():
+            violation = max(violation, body - po.value(row.upper))
+    report['max_violation'] = violation
+    report['objective_at_fast_solution'] = po.value(pm.objective)
+
+    start = time.time()
+    pm.solve(solver=solver, solve_kwargs={'tee': False}, cmdline_options={'ratioGap': gap} if solver == 'cbc' else {'MIPGap': gap})
+    report['pyomo_time'] = time.time() - start
+    report['pyomo_objective'] = po.value(pm.objective)
+
+    pyomo_results = processing.results(pm)
+    fast_results = fast.results()
+
+    report['missing_keys'] = [k for k in pyomo_results if k not in fast_results]
+    report['extra_keys'] = [k for k in fast_results if k not in pyomo_results]
+    report['column_differences'] = [k for k in pyomo_results if k in fast_results and
+                                    sorted(pyomo_results[k]['sequences'].columns) !=
+                                    sorted(fast_results[k]['sequences'].columns)]
+    report['scalar_differences'] = [k for k in pyomo_results if k in fast_results and
+                                    sorted(pyomo_results[k]['scalars'].index) !=
+                                    sorted(fast_results[k]['scalars'].index)]
+
+    components = [c for c in ['demand', 'PV', 'storage'] + [g.label for g in gen_set] + ['excess']
+                  if c in pm.es.groups]
+    lcoe.get_lcoe(fast, fast_results, components)
+    main.results_postprocessing(fast_results, components)
+
+    def close(a, b):
+        return abs(a - b) <= rtol * max(abs(a), abs(b), 1)
+
+    report['passed'] = (violation <= 1e-6 * max(1, abs(fast_objective)) and
+                        close(report['objective_at_fast_solution'], fast_objective) and
+                        close(report['pyomo_objective'], fast_objective) and
+                        not (report['missing_keys'] or report['extra_keys'] or report['column_differences'] or
+                             report['scalar_differences']))
+
+    logging.info('Parity ' + mode + ': ' + str(report))
+
+    return report
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+
+    for mode in ['simulation', 'investment']:
+        report = parity_check(mode)
+        print(mode, 'passed' if report['passed'] else 'FAILED', report)
@@ -0,0 +1,204 @@
+"""
+Fleet pipeline: sizes the mini-grids of many sites in one run, from weather data to LCOE.
+
+For a site list (e.g. PV_feedin/data/philippines_coords.csv) and the demand of every site, the PV feed-in of all
+sites is generated in batch with the array kernels of PV_feedin, one investment model per site is built and solved
+in a pool of worker processes and the sizing and LCOE results are appended to one fleet table as soon as a site is
+solved. Every row carries a hash of the site's inputs, sites whose inputs did not change since the last run are
+skipped.
+"""
+
+import hashlib
+import logging
+import multiprocessing
+import os
+
+import numpy as np
+import pandas as pd
+
+import main
+from PV_feedin import merra_processing, reninjas_pv, trigon
+
+COMPONENTS = ['demand', 'PV', 'storage', 'pp_oil_1', 'pp_oil_2', 'pp_oil_3', 'excess']
+SIZING = ['PV', 'storage']
+
+
+def read_sites(filename='PV_feedin/data/philippines_coords.csv'):
+    """
+    Reads a site list with the columns 'Index', 'Coor Lat' and 'Coor Long'.
+
+    :return: sites with columns lat and lon                                         pd.DataFrame
+    """
+    sites = pd.read_csv(filename, sep=',', index_col='Index')
+    sites.rename(columns={'Coor Lat': 'lat', 'Coor Long': 'lon'}, inplace=True)
+    return sites[['lat', 'lon']]
+
+
+def batch_pv_feedin(sites, weather, technology='csi', system_loss=0.10):
+    """
+    The function returns the PV feed-in per kW installed capacity of all sites. Solar position and clear sky dni
+    are computed per site with pvlib, decomposition, plane of array irradiance and panel model run on [site, hour]
+    arrays for all sites at once. The panels face the equator with optimal_tilt(lat).
+
+    :param sites:       sites with columns lat and lon, see read_sites()                pd.DataFrame
+    :param weather:     {site: weather with columns ghi, TOA_i and temp_air [W/m^2, degC]
+                        on the same hourly index}, e.g. from merra_processing.slice_merra2  dict
+    :return: feed-in    capacity factor with one column per site                        pd.DataFrame
+    """
+    from pvlib.location import Location
+
+    index = weather[sites.index[0]].index
+    times = pd.DatetimeIndex(index)
+
+    def stack(column):
+        return np.vstack([np.asarray(weather[site][column], dtype=float) for site in sites.index])
+
+    ghi = stack('ghi')
+    toa = stack('TOA_i')
+    tamb = stack('temp_air')
+
+    position = [merra_processing.get_sunpos(weather[site], row.lat, row.lon) for site, row in sites.iterrows()]
+    zenith = np.vstack([p['zenith'].values for p in position])
+    elevation = np.radians(np.vstack([p['elevation'].values for p in position]))
+    azimuth = np.radians(np.vstack([p['azimuth'].values for p in position]))
+    clearsky_dni = np.vstack([Location(row.lat, row.lon).get_clearsky(times).dni.values
+                              for site, row in sites.iterrows()])
+
+    irradiance = merra_processing.reindl_array(ghi, toa, zenith, clearsky_dni=clearsky_dni)
+    dni = np.nan_to_num(irradiance['dni'])
+
+    lat = sites['lat'].values[:, None]
+    tilt = np.radians([reninjas_pv.optimal_tilt(x) for x in sites['lat']])[:, None]
+
+    direct, diffuse = trigon.poa_irradiance_array((ghi - irradiance['dhi']) / 1000, irradiance['dhi'] / 1000,
+                                                  dni / 1000, lat, elevation, azimuth, tilt=tilt, azimuth=np.pi)
+
+    panel_efficiency = 0.1
+    power = reninjas_pv.panel_power_array(direct, diffuse, tamb, technology, 1 / panel_efficiency, panel_efficiency)
+    power *= 1 - system_loss
+    np.minimum(power, 1, out=power)
+
+    return pd.DataFrame(power.T, index=index, columns=sites.index)
+
+
+def input_hash(*values):
+    """
+    Returns a hash of the inputs of a site, numpy arrays and pandas objects are hashed by their values.
+    """
+    sha = hashlib.sha1()
+    for value in values:
+        if isinstance(value, (pd.Series, pd.DataFrame)):
+            value = value.values
+        if isinstance(value, np.ndarray):
+            sha.update(np.ascontiguousarray(value, dtype=float).tobytes())
+        else:
+            sha.update(repr(value).encode())
+    return sha.hexdigest()
+
+
+def _size_site(args):
+    """
+    Worker of size_fleet: builds and solves the investment model of one site and returns its row of the fleet table.
+    """
+    site, key, feedin, cost, gap = args
+
+    import cost_summary as lcoe
+
+    logging.info('Sizing site ' + str(site))
+
+    m = main.create_energysystem_model('investment', feedin, 0.5, cost)[0]
+    results = main.solve_and_create_results(m, lp_write=False, gap=gap)
+
+    row = {'site': site, 'input_hash': key}
+
+    sizing = main.sizing_results(results, m, SIZING)
+    for nodes, value in sizing.iloc[:, 0].items():
+        row['size_' + str(nodes[0])] = float(value)
+
+    economic = lcoe.get_lcoe(m, results, COMPONENTS)
+    for label, values in economic.iterrows():
+        for column, value in values.items():
+            row[column + '_' + label] = float(value)
+
+    costs = economic[['CAPEX', 'OPEX', 'fuel_cost']].values.astype(float).sum()
+    row['lcoe'] = costs / feedin['demand_el'].sum()
+
+    return row
+
+
+def read_fleet_table(filename):
+    """
+    Returns the fleet table, for sites sized more than once only the last row is kept.
+    """
+    if not os.path.isfile(filename):
+        return pd.DataFrame(columns=['site', 'input_hash'])
+
+    table = pd.read_csv(filename, sep=',', dtype={'input_hash': str})
+    return table.drop_duplicates(subset='site', keep='last').set_index('site', drop=False)
+
+
+def size_fleet(sites, demand, weather=None, feedin=None, filename='results/fleet.csv', cost=None, gap=0.01,
+               processes=None):
+    """
+    The function sizes PV and storage of every site and streams the results into the fleet table filename.
+
+    :param sites:       sites with columns lat and lon, see read_sites()                pd.DataFrame
+    :param demand:      hourly demand with one column per site                          pd.DataFrame
+    :param weather:     {site: weather}, see batch_pv_feedin(), only used if feedin is None    dict
+    :param feedin:      PV capacity factor with one column per site, generated from
+                        weather if None                                                 pd.DataFrame or None
+    :param filename:    fleet table, rows of unchanged sites are kept                   str
+    :param cost:        cost dict, main.get_cost_dict(len(demand)) if None              dict
+    :param gap:         allowable gap of the optimization                               float
+    :param processes:   number of worker processes, os.cpu_count() if None              int or None
+    :return: fleet table with one row per site                                          pd.DataFrame
+    """
+    if cost is None:
+        cost = main.get_cost_dict(len(demand))
+
+    if feedin is None:
+        feedin = batch_pv_feedin(sites, weather)
+
+    table = read_fleet_table(filename)
+
+    jobs = []
+    for site, row in sites.iterrows():
+        key = input_hash(row.lat, row.lon, feedin[site], demand[site], cost, gap)
+        if site in table.index and table.loc[site, 'input_hash'] == key:
+            continue
+
+        timeseries = pd.DataFrame({'PV': feedin[site].values, 'demand_el': demand[site].values},
+                                  index=demand.index)
+        jobs += [(site, key, timeseries, cost, gap)]
+
+    logging.info('Sizing ' + str(len(jobs)) + ' of ' + str(len(sites)) + ' sites, the others are unchanged')
+
+    if jobs:
+        directory = os.path.dirname(filename)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        columns = None if table.empty else [c for c in table.columns]
+        pool = multiprocessing.Pool(processes)
+        try:
+            for row in pool.imap_unordered(_size_site, jobs):
+                if columns is None:
+                    columns = list(row.keys())
+                pd.DataFrame([row], columns=columns).to_csv(filename, sep=',', mode='a', index=False,
+                                                            header=not os.path.isfile(filename))
+        finally:
+            pool.close()
+            pool.join()
+
+    return read_fleet_table(filename)
+
+
+if __name__ == '__main__':
+    # Lifuka demand and feed-in for all sites of the site list
+    sites = read_sites()
+    timeseries = main.get_timeseries('data/timeseries.csv')
+
+    demand = pd.DataFrame({site: timeseries['demand_el'] for site in sites.index})
+    feedin = pd.DataFrame({site: timeseries['PV'] for site in sites.index})
+
+    print(size_fleet(sites, demand, feedin=feedin))
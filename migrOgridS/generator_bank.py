@@ -0,0 +1,33 @@
+from oemof.network import Transformer
+
+
+class GeneratorBank(Transformer):
+    """
+    Bank of identical engine generators that is modelled with one integer online-count variable per time step
+    instead of a binary status per unit and time step, see custom_constraints.generator_bank_constraint().
+
+    The electrical output flow covers the whole bank, i.e. its nominal_value is units * unit_nominal_value, and
+    its fixed_costs apply to the whole bank. Fuel input and electrical output are linked by the linearised
+    fuel_curve of one unit (see presolve.linear_fuel_curve), which is exact for a bank that shares its load equally.
+
+    Parameters:
+        fuel_input:         {bus: Flow} fuel input of the bank, carries the fuel costs
+        electrical_output:  {bus: Flow} electrical output of the bank
+        units:              number of identical units                               int
+        unit_nominal_value: nominal electrical output of one unit                   float
+        fuel_curve:         fuel consumption of one unit at load fractions,
+                            e.g. {'1': 42, '0.75': 33, '0.5': 22, '0.25': 16}       dict
+        min:                minimum load of an online unit as fraction               float
+        om_costs:           costs per online unit, hour and kW of unit capacity     float
+    """
+
+    def __init__ (self, fuel_input, electrical_output, units, unit_nominal_value, fuel_curve, min=0.3,
+                  om_costs=0, **kwargs):
+        super(GeneratorBank, self).__init__(inputs=fuel_input, outputs=electrical_output, **kwargs)
+        self.fuel_input = fuel_input
+        self.electrical_output = electrical_output
+        self.units = units
+        self.unit_nominal_value = unit_nominal_value
+        self.fuel_curve = fuel_curve
+        self.min = min
+        self.om_costs = om_costs
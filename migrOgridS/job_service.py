@@ -0,0 +1,361 @@
+"""
+Local job service for optimization runs.
+
+Run specifications are submitted as JSON through a small HTTP API, stored in a SQLite database and executed by a
+fixed number of worker processes, so that several users share one machine without oversubscribing its cores: every
+worker solves with an equal share of the cores as solver threads.
+Identical specifications are only run once.
+
+    python job_service.py --workers 4 --port 8765
+
+    POST /jobs          submit a specification, returns {"id": ..., "duplicate": ...}
+    GET  /jobs          status of all jobs
+    GET  /jobs/<id>     status, progress and result location of one job
+
+A specification holds the keys
+    kind        'sizing' (main.py) or 'rolling_horizon' (solver_strategies.rolling_horizon)
+    mode        'investment' or 'simulation', sizing only
+    timeseries  csv file holding pv and demand_el values
+    cost        overrides of the cost dict, e.g. {"pp_oil_1": {"var": 1.4}}
+    PH, CH, SH  prediction, control and simulation horizon in hours
+    PV, Storage installed capacities, rolling horizon only
+    gap         allowable gap of the optimization
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import sqlite3
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+DEFAULT_SPEC = {'kind': 'sizing', 'mode': 'investment', 'timeseries': 'data/timeseries.csv', 'cost': {},
+                'PH': 8760, 'CH': 120, 'SH': 8760, 'PV': None, 'Storage': None, 'gap': 0.01}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    spec_hash   TEXT UNIQUE,
+    spec        TEXT,
+    status      TEXT,
+    progress    TEXT,
+    result      TEXT,
+    error       TEXT,
+    submitted   REAL,
+    started     REAL,
+    finished    REAL
+)
+"""
+
+
+def spec_hash(spec):
+    """Returns the hash of a complete specification, key order does not matter"""
+    return hashlib.sha1(json.dumps(spec, sort_keys=True).encode()).hexdigest()
+
+
+class JobStore(object):
+    """
+    Durable job queue in a SQLite database. Every process opens its own connection.
+
+    Parameters:
+        path:   database file, it is created if it does not exist
+    """
+
+    def __init__ (self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+
+        connection = self._connect()
+        try:
+            connection.execute(SCHEMA)
+        finally:
+            connection.close()
+
+    def _connect (self):
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def submit (self, spec):
+        """
+        Queues a specification, missing keys are taken from DEFAULT_SPEC. A specification that is queued, running or
+        done already is not queued again, a failed one is re-queued.
+
+        :return: id, duplicate          job id and whether it existed before        int, boolean
+        """
+        spec = dict(DEFAULT_SPEC, **spec)
+        if spec['kind'] not in ('sizing', 'rolling_horizon'):
+            raise ValueError('Unknown kind of job ' + str(spec['kind']))
+
+        key = spec_hash(spec)
+        connection = self._connect()
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            row = connection.execute('SELECT id, status FROM jobs WHERE spec_hash = ?', (key,)).fetchone()
+
+            if row is None:
+                cursor = connection.execute(
+                    'INSERT INTO jobs (spec_hash, spec, status, progress, submitted) VALUES (?, ?, ?, ?, ?)',
+                    (key, json.dumps(spec), 'queued', '{}', time.time()))
+                job, duplicate = cursor.lastrowid, False
+            elif row['status'] == 'failed':
+                connection.execute("UPDATE jobs SET status = 'queued', error = NULL, progress = '{}' WHERE id = ?",
+                                   (row['id'],))
+                job, duplicate = row['id'], False
+            else:
+                job, duplicate = row['id'], True
+
+            connection.execute('COMMIT')
+        finally:
+            connection.close()
+
+        return job, duplicate
+
+    def claim (self):
+        """Marks the oldest queued job as running and returns (id, spec), None if the queue is empty"""
+        connection = self._connect()
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            row = connection.execute("SELECT id, spec FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1").fetchone()
+            if row is not None:
+                connection.execute("UPDATE jobs SET status = 'running', started = ? WHERE id = ?",
+                                   (time.time(), row['id']))
+            connection.execute('COMMIT')
+        finally:
+            connection.close()
+
+        return None if row is None else (row['id'], json.loads(row['spec']))
+
+    def update (self, job, **values):
+        """Sets columns of a job, progress and result are stored as JSON"""
+        for key in ('progress', 'result'):
+            if key in values:
+                values[key] = json.dumps(values[key])
+
+        connection = self._connect()
+        try:
+            connection.execute('UPDATE jobs SET ' + ', '.join(k + ' = ?' for k in values) + ' WHERE id = ?',
+                               list(values.values()) + [job])
+        finally:
+            connection.close()
+
+    def requeue_running (self):
+        """Puts jobs that were running when the service stopped back into the queue"""
+        connection = self._connect()
+        try:
+            connection.execute("UPDATE jobs SET status = 'queued', progress = '{}' WHERE status = 'running'")
+        finally:
+            connection.close()
+
+    def jobs (self, job=None):
+        """Returns all jobs or the job with id job as list of dicts"""
+        connection = self._connect()
+        try:
+            if job is None:
+                rows = connection.execute('SELECT * FROM jobs ORDER BY id').fetchall()
+            else:
+                rows = connection.execute('SELECT * FROM jobs WHERE id = ?', (job,)).fetchall()
+        finally:
+            connection.close()
+
+        res = []
+        for row in rows:
+            job = dict(row)
+            for key in ('spec', 'progress', 'result'):
+                job[key] = json.loads(job[key]) if job[key] is not None else None
+            res += [job]
+        return res
+
+
+def mip_gap(m):
+    """Returns the relative MIP gap of the last solve of m from the solver results, None if it is not available"""
+    try:
+        problem = m.es.results['Problem'][0]
+        lower, upper = float(problem['Lower bound']), float(problem['Upper bound'])
+        return abs(upper - lower) / max(abs(upper), 1e-10)
+    except (AttributeError, KeyError, IndexError, TypeError, ValueError):
+        return None
+
+
+def get_cost(spec, horizon, module):
+    """Cost dict of module for horizon with the overrides of the specification"""
+    cost = module.get_cost_dict(horizon)
+    for component, values in spec['cost'].items():
+        cost[component].update(values)
+    return cost
+
+
+def run_job(job, spec, store, results='results/jobs', threads=None):
+    """
+    Runs one specification and writes its results to results/<job>/, the solver uses threads threads.
+
+    :return: result     files written and key figures of the run            dict
+    """
+    path = os.path.join(results, str(job))
+    if not os.path.isdir(path):
+        os.makedirs(path, exist_ok=True)
+
+    if spec['kind'] == 'sizing':
+        import main
+        import cost_summary as lcoe
+
+        store.update(job, progress={'stage': 'build'})
+        cost = get_cost(spec, spec['PH'], main)
+        feed = main.get_timeseries(spec['timeseries']).iloc[:spec['PH']]
+        m = main.create_energysystem_model(spec['mode'], feed, 0.5, cost)[0]
+
+        store.update(job, progress={'stage': 'solve'})
+        results_el = main.solve_and_create_results(m, lp_write=False, gap=spec['gap'], threads=threads)
+
+        components_list = ['demand', 'PV', 'storage', 'pp_oil_1', 'pp_oil_2', 'pp_oil_3', 'excess']
+        files = {'flows': os.path.join(path, 'flows.csv'), 'lcoe': os.path.join(path, 'lcoe.csv')}
+        main.results_postprocessing(results_el, components_list).to_csv(files['flows'])
+        lcoe.get_lcoe(m, results_el, components_list).to_csv(files['lcoe'])
+
+        if spec['mode'] == 'investment':
+            files['sizing'] = os.path.join(path, 'invest.csv')
+            main.sizing_results(results_el, m, ['PV', 'storage']).to_csv(files['sizing'])
+
+        store.update(job, progress={'stage': 'done', 'mip_gap': mip_gap(m)})
+        return {'files': files, 'objective': m.objective()}
+
+    import solver_strategies
+
+    def progress(window, windows, m):
+        store.update(job, progress={'stage': 'solve', 'window': window, 'windows': windows, 'mip_gap': mip_gap(m)})
+
+    import main_RH
+
+    log_path = os.path.join(path, 'log')
+    objective = solver_strategies.rolling_horizon(spec['PV'], spec['Storage'], SH=spec['SH'], PH=spec['PH'],
+                                                  CH=spec['CH'], log_path=log_path, file=spec['timeseries'],
+                                                  progress=progress, cost=get_cost(spec, spec['CH'], main_RH),
+                                                  threads=threads)
+    return {'files': {'log': log_path}, 'objective': objective}
+
+
+def worker(path, results, poll=1.0, threads=None):
+    """
+    Worker process: runs queued jobs one after another with threads solver threads until it is terminated.
+    """
+    store = JobStore(path)
+
+    while True:
+        claimed = store.claim()
+        if claimed is None:
+            time.sleep(poll)
+            continue
+
+        job, spec = claimed
+        logging.info('Worker ' + str(os.getpid()) + ' runs job ' + str(job))
+        try:
+            result = run_job(job, spec, store, results, threads)
+            store.update(job, status='done', result=result, finished=time.time())
+        except Exception as e:
+            logging.exception('Job ' + str(job) + ' failed')
+            store.update(job, status='failed', error=repr(e), finished=time.time())
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def make_handler(store):
+    """Returns the request handler class of the HTTP API for store"""
+
+    class JobHandler(BaseHTTPRequestHandler):
+
+        def _send (self, code, data):
+            body = json.dumps(data, default=str).encode()
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET (self):
+            parts = [p for p in self.path.split('/') if p]
+            if parts == ['jobs']:
+                self._send(200, store.jobs())
+            elif len(parts) == 2 and parts[0] == 'jobs' and parts[1].isdigit():
+                jobs = store.jobs(int(parts[1]))
+                self._send(200, jobs[0]) if jobs else self._send(404, {'error': 'unknown job'})
+            else:
+                self._send(404, {'error': 'unknown path'})
+
+        def do_POST (self):
+            if [p for p in self.path.split('/') if p] != ['jobs']:
+                return self._send(404, {'error': 'unknown path'})
+            try:
+                spec = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                job, duplicate = store.submit(spec)
+            except (ValueError, TypeError) as e:
+                # invalid JSON, no JSON object or unknown kind of job
+                return self._send(400, {'error': str(e)})
+            except Exception as e:
+                # e.g. sqlite3.Error of a locked or unwritable database
+                logging.exception('Submitting a job failed')
+                return self._send(500, {'error': repr(e)})
+            self._send(200, {'id': job, 'duplicate': duplicate})
+
+        def log_message (self, format, *args):
+            logging.debug(format % args)
+
+    return JobHandler
+
+
+def serve(path='results/jobs.sqlite', results='results/jobs', host='127.0.0.1', port=8765, workers=None):
+    """
+    Starts the worker processes and serves the HTTP API until it is interrupted.
+
+    :param path:    SQLite database of the queue                            str
+    :param results: directory of the job results                            str
+    :param host:    address of the API, local only by default               str
+    :param port:    port of the API                                         int
+    :param workers: number of worker processes, os.cpu_count() if None      int or None
+    """
+    store = JobStore(path)
+    store.requeue_running()
+
+    # every worker gets an equal share of the cores for its solver
+    cpus = os.cpu_count() or 1
+    workers = workers or cpus
+    threads = max(1, cpus // workers)
+
+    processes = [multiprocessing.Process(target=worker, args=(path, results, 1.0, threads), daemon=True)
+                 for i in range(workers)]
+    for process in processes:
+        process.start()
+
+    server = ThreadingHTTPServer((host, port), make_handler(store))
+    logging.info('Job service on http://' + host + ':' + str(port) + ' with ' + str(len(processes)) + ' workers of ' +
+                 str(threads) + ' solver threads')
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        for process in processes:
+            process.terminate()
+            process.join()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local job service for optimization runs')
+    parser.add_argument('--db', default='results/jobs.sqlite')
+    parser.add_argument('--results', default='results/jobs')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    serve(args.db, args.results, args.host, args.port, args.workers)
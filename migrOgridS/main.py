@@ -1,15 +1,14 @@
 import logging
-import custom_constraints as constraints
 import pandas as pd
 import os
 import time
 
-from oemof.outputlib import processing, views
-from oemof.solph import (Sink, Transformer, Source, Bus, Flow, NonConvex,
-                         Model, EnergySystem, components, custom, Investment)
-from oemof.tools import logger, economics
-from oemof.network import Node
-import cost_summary as lcoe
+from oemof.tools import economics
+from time_resolution import aggregate_timeseries, disaggregate_results, resolution_increments
+from timeseries_loader import load_timeseries
+
+# oemof.solph, oemof.outputlib, pyomo and the modules building on them are imported on first use inside the
+# functions, so that starting a worker or loading data does not pay for them
 
 
 # cost dictionary #####################################################################################################
@@ -48,6 +47,8 @@ def get_sim_params(cost):
     :return: sim_params dict parameter inputs for the energy system model
     """
 
+    from oemof.solph import Investment
+
     sim_params = {'pv': {'nominal_capacity': 264.07523381,
                          'investment': Investment( ep_costs=cost['pv']['epc'] )},
                   'storage': {'nominal_capacity': 337.807019472,
@@ -66,29 +67,56 @@ def add_inverter(i, o, name, eta=1):
 
      :return: sim_params dict parameter inputs for the energy system model
      """
+    from oemof.solph import Transformer, Flow
+
     return Transformer( label=name,
                         inputs={i: Flow()},
                         outputs={o: Flow()},
                         conversion_factors={o: eta} )
 
 
-def create_energysystem_model(mode, feedin, initial_batt_cap, cost, iterstatus=None, PV_source=True,
-                              storage_source=True):
+def add_generator_bank(i, o, name, units, unit_nominal_value, fuel_curve, cost, min=0.3):
     """
-       The function stes up the energy system model and resturns the operational model m, which equals the
-       MILP formulation
-       :param cost:     mode    optimization mode ['simulation','investment' ] as    str
-                        feed    timeseries holding pv and demand_el values          pd.DataFrame
-                        initial_batt_cap initial SOC of the battery  takes          float values from 0-1
-                        cost    cost dict derived from get_cost_dict()              dict
-                        iterstatus None (only important for RH)                     boolean
-                        PV_source include PV source 'True', exclude 'False'         boolean
-                        storage_source include BSS source 'True', exclude 'False'   boolean
-
+     The function returns a bank of identical engine generators with fuel input i and electrical output o,
+     a certain label/name and the costs of cost[name] GeneratorBank object
+     :param cost:   i   fuel bus
+                    o   electricity bus
+                    name label of the bank as str
+                    units number of identical units                                 int
+                    unit_nominal_value nominal electrical output of one unit        float
+                    fuel_curve fuel consumption of one unit at load fractions       dict
+                    cost cost dict derived from get_cost_dict()                     dict
+                    min minimum load of an online unit takes                        float values from 0-1
+
+     :return: GeneratorBank object
+     """
+    from oemof.solph import Flow
+    from generator_bank import GeneratorBank
+
+    return GeneratorBank( label=name,
+                          fuel_input={i: Flow( variable_costs=cost[name]['var'] )},
+                          electrical_output={o: Flow( nominal_value=units * unit_nominal_value,
+                                                      max=1,
+                                                      fixed_costs=cost[name]['fix'] )},
+                          units=units,
+                          unit_nominal_value=unit_nominal_value,
+                          fuel_curve=fuel_curve,
+                          min=min,
+                          om_costs=cost[name]['o&m'] )
+
+
+def create_energysystem(mode, feedin, initial_batt_cap, cost, iterstatus=None, PV_source=True, storage_source=True,
+                        gen_banks=None):
+    """
+       The function sets up the energy system with its components, see create_energysystem_model() for the
+       parameters. It is shared by the pyomo model and the direct matrix builder of fast_builder.py.
 
-       :return: m       operational model   oemof.solph.model
-                gen_set list of oemof.solph.custom.EngineGenerator objects integrated in the model
+       :return: energysystem    energy system with the registered components    oemof.solph.EnergySystem
+                gen_set         generators of the energy system                 list
+                storage         storage of the energy system or None            oemof.solph.components.GenericStorage
        """
+    from oemof.solph import (Sink, Source, Bus, Flow, NonConvex, EnergySystem, components, custom)
+    from oemof.network import Node
 
     ##################################### Initialize the energy system##################################################
     # initialize time steps
@@ -162,6 +190,10 @@ def create_energysystem_model(mode, feedin, initial_batt_cap, cost, iterstatus=N
     # List all generators in a list called gen_set
     gen_set = [generator1, generator2, generator3]
 
+    for bank in gen_banks or []:
+        gen_set += [add_generator_bank( b_oil, b_el, cost=cost, name=bank['label'],
+                                        **{k: v for k, v in bank.items() if k != 'label'} )]
+
     sim_params = get_sim_params( cost )
 
     if mode == 'simulation':
@@ -210,22 +242,77 @@ def create_energysystem_model(mode, feedin, initial_batt_cap, cost, iterstatus=N
     if storage_source == 1 or PV_source == 1:
         inverter1 = add_inverter( b_dc, b_el, 'Inv_pv' )
 
+    return [energysystem, gen_set, storage]
+
+
+def create_energysystem_model(mode, feedin, initial_batt_cap, cost, iterstatus=None, PV_source=True,
+                              storage_source=True, timeincrement=None, lazy_reserve=False, presolve_bounds=False,
+                              gen_banks=None):
+    """
+       The function stes up the energy system model and resturns the operational model m, which equals the
+       MILP formulation
+       :param cost:     mode    optimization mode ['simulation','investment' ] as    str
+                        feed    timeseries holding pv and demand_el values          pd.DataFrame
+                        initial_batt_cap initial SOC of the battery  takes          float values from 0-1
+                        cost    cost dict derived from get_cost_dict()              dict
+                        iterstatus None (only important for RH)                     boolean
+                        PV_source include PV source 'True', exclude 'False'         boolean
+                        storage_source include BSS source 'True', exclude 'False'   boolean
+                        timeincrement length of the time steps in hours for
+                                      aggregated timeseries, hourly if None         list of int
+                        lazy_reserve generate the reserve constraints lazily
+                                     in solve_and_create_results()                  boolean
+                        presolve_bounds derive bounds for PV, storage and
+                                        generator status, see presolve.py           boolean
+                        gen_banks  banks of identical generators added to the
+                                   single generators, e.g. [{'label': 'pp_bank',
+                                   'units': 4, 'unit_nominal_value': 80,
+                                   'fuel_curve': {...}}], costs are taken from
+                                   cost[label]                                      list of dict
+
+
+       :return: m       operational model   oemof.solph.model
+                gen_set list of oemof.solph.custom.EngineGenerator objects integrated in the model
+       """
+    from oemof.solph import Model
+    import custom_constraints as constraints
+    import presolve
+
+    energysystem, gen_set, storage = create_energysystem( mode, feedin, initial_batt_cap, cost, iterstatus=iterstatus,
+                                                          PV_source=PV_source, storage_source=storage_source,
+                                                          gen_banks=gen_banks )
+
+    demand_feedin = feedin['demand_el']
+
     ################################# optimization ############################
     # create Optimization model based on energy_system
     logging.info( "Create optimization problem" )
 
-    m = Model( energysystem )
+    if timeincrement is None:
+        m = Model( energysystem )
+    else:
+        # variable resolution time index, see time_resolution.aggregate_timeseries()
+        m = Model( energysystem, timeincrement=timeincrement, objective_weighting=timeincrement )
 
     ################################# constraints ############################
     # add constraints to the model
 
+    constraints.generator_bank_constraint( m, banks=gen_set )
+
+    if timeincrement is not None:
+        # om costs per time step of the generators, weighted like the variable costs
+        constraints.om_costs_weighting( m, gen_set )
+
+    # reserves refer to the peak demand of a time step if the timeseries is aggregated
+    reserve_base = feedin['demand_max'] if 'demand_max' in feedin else demand_feedin
+
     #spinning reserve constraint
     sr_requirement = 0.2
-    sr_limit = demand_feedin * sr_requirement
+    sr_limit = reserve_base * sr_requirement
 
     #rotating mass constraint
     rm_requirement = 0.4
-    rm_limit = demand_feedin * rm_requirement
+    rm_limit = reserve_base * rm_requirement
 
     constraints.spinning_reserve_constraint( m, sr_limit, groups=gen_set, storage=storage )
 
@@ -237,28 +324,155 @@ def create_energysystem_model(mode, feedin, initial_batt_cap, cost, iterstatus=N
 
     constraints.rotating_mass_constraint( m, rm_limit, groups=gen_set, storage=storage )
 
+    # reserve inputs, e.g. for lazy reserve constraints and the matrix model of a warm start (warm_start.py)
+    m.reserve = {'sr_limit': sr_limit, 'rm_limit': rm_limit, 'groups': gen_set, 'storage': storage}
+
+    if presolve_bounds:
+        presolve.tighten_bounds( m, feedin, cost, gen_set, sr_requirement=sr_requirement,
+                                 rm_requirement=rm_requirement, timeincrement=timeincrement )
+
+    if lazy_reserve:
+        # start with the reserve constraints of the peak demand time step of every day, the days are counted in
+        # hours elapsed at the start of a step, so that aggregated time steps are grouped by day as well
+        base = pd.Series( reserve_base.values )
+        increments = [1] * len( base ) if timeincrement is None else list( timeincrement )
+        hours = pd.Series( increments ).cumsum() - increments
+        seed = base.groupby( hours.values // 24 ).idxmax()
+        constraints.seed_reserve_constraints( m, seed=seed.tolist() )
+
+        m.lazy_reserve = m.reserve
+
     return [m, gen_set]
 
 
-def solve_and_create_results(m, lp_write=True, gap=0.01):
+# termination conditions of a solve that found a solution
+SOLVED = ('optimal', 'feasible')
+
+
+def termination_condition(m):
+    """
+    The function returns the termination condition of the last solve of the operational model m, e.g. 'optimal',
+    'feasible', 'infeasible' or 'maxTimeLimit'. oemof only warns if a solve ends without optimal solution.
+
+    :param m:   operational model   om.solph.model
+    :return: termination condition, None if m holds no solver results      str or None
+    """
+    results = getattr( m, 'solver_results', None )
+    if results is None:
+        results = getattr( m.es, 'results', None )
+
+    try:
+        return str( results.solver.termination_condition )
+    except AttributeError:
+        return None
+
+
+def solve_and_create_results(m, lp_write=True, gap=0.01, solver='gurobi', max_iter=50,
+                             model_file=os.path.join( 'results', 'Lifuka.mps.gz' ), warm_start=None, scenario=None,
+                             profile=None, threads=None):
     """
     The function solves the optimization problem represented by the operational model m and returns a results table.
-    It can also be chosen to write an lp file.
+    It can also be chosen to write the model file, it is exported with numeric names and a label map before warm
+    starts or lazy constraints change the model, see model_export.py.
+
+    If m was built with lazy_reserve=True, the reserve constraints are generated lazily: with solver
+    'gurobi_persistent' they are passed as lazy constraints to Gurobi, otherwise the model is re-solved with warm
+    start and the reserve constraints of all violated hours added until none is violated.
 
     :param m:   operational model   om.solph.model
-    :param lp_write:  write LP-file 'True' don't write LP-file 'False'  boolean
+    :param lp_write:  write model file 'True' don't write it 'False'    boolean
     :param gap: allowable gap of optimization takes                     float values [0,1]
+    :param solver: solver name passed to pyomo, 'race' races the
+                   configurations of solver_race.py                   str
+    :param max_iter: maximum number of lazy reserve iterations          int
+    :param model_file: .mps or .lp file, compressed if it ends with .gz str
+    :param warm_start: solution store, the nearest solved scenario is
+                       passed as MIP start and the solution is stored   warm_start.SolutionStore
+    :param scenario: model class and parameter vector of m, see
+                     warm_start.scenario_vector()                       tuple
+    :param profile: name of a solver profile of solver_tuning.tune(), its
+                    configuration and gap replace solver and gap left
+                    at their defaults, see profile_settings()           str
+    :param threads: number of solver threads, all cores if None        int
     :return: res results table                                          pd.DataFrame
     """
+    import pyomo.environ as po
+    from oemof.outputlib import processing
+    import custom_constraints as constraints
+    import model_export
+    import solver_race
+    import solver_tuning
 
+    configs = None
+    if profile is not None:
+        solver, gap, configs = solver_tuning.profile_settings( profile, solver, gap )
 
+    options = {'MIPGap': gap}
+    if threads is not None:
+        options['Threads'] = threads
+
+    lazy = getattr( m, 'lazy_reserve', None )
+
+    if lazy is not None and solver == 'gurobi_persistent':
+        for name in constraints.RESERVE_CONSTRAINTS:
+            getattr( m, name ).activate()
+
+    # the pyomo model is written before warm start values and lazy constraints change it
     if lp_write == True:
-        m.write( os.path.join( 'results', 'Lifuka.lp' ), io_options={'symbolic_solver_labels': True} )
+        model_export.export_model( m, model_file )
+
+    start = None
+    if warm_start is not None:
+        start = warm_start.prepare( m, scenario )
+    warm = start is not None and start['accepted']
 
     # solve with specific optimization options (passed to pyomo)
     logging.info( "Solve optimization problem" )
+    solve_time = time.time()
+
+    if lazy is not None and solver == 'gurobi_persistent':
+        opt = po.SolverFactory( solver )
+        opt.set_instance( m )
+        constraints.mark_reserve_constraints_lazy( m, opt )
+        for name, value in options.items():
+            opt.set_gurobi_param( name, value )
+        m.es.results = m.solver_results = opt.solve( tee=False, warmstart=warm )
 
-    m.solve( solver='gurobi', solve_kwargs={'tee': False}, cmdline_options={'MIPGap': gap} )
+    elif solver == 'race':
+        # the matrix model holds all reserve constraints, the lazy iterations are not needed
+        solver_race.race( m, configs=configs, gap=gap, cpus=threads,
+                          model_class=scenario[0] if scenario is not None else None )
+
+    else:
+        m.solve( solver=solver, solve_kwargs={'tee': False, 'warmstart': warm}, cmdline_options=options )
+
+        for iteration in range( max_iter if lazy is not None else 0 ):
+            added = constraints.add_violated_reserve_constraints( m, **lazy )
+            if added == 0:
+                break
+
+            logging.info( 'Added reserve constraints for ' + str( added ) + ' violated hours' )
+            m.solve( solver=solver, solve_kwargs={'tee': False, 'warmstart': True}, cmdline_options=options )
+
+        else:
+            # max_iter is used up, the solution of the last solve has not been checked yet
+            violated = 0
+            if lazy is not None:
+                violation = constraints.reserve_violations( m, **lazy )
+                violated = sum( max( values ) > 1e-6 for values in zip( *violation.values() ) )
+            if violated > 0:
+                logging.warning( 'The reserve constraints of ' + str( violated ) + ' hours are still violated after ' +
+                                 str( max_iter ) + ' lazy reserve iterations, the solution is not feasible' )
+
+    solve_time = time.time() - solve_time
+
+    # the race raises if no configuration found a solution
+    solved = solver == 'race' or termination_condition( m ) in SOLVED
+    if not solved:
+        logging.warning( 'The solver terminated with ' + str( termination_condition( m ) ) + ' without solution' )
+
+    if warm_start is not None and solved:
+        warm_start.record( m, scenario, solve_time, start )
 
     # cmdline_options = {'MIPGap': 0.01}
 
@@ -280,6 +494,7 @@ def sizing_results(results, m, sizing_list):
      :param  sizing list:   labels of sizing components ['PV', 'storage'] list of str
      :return: results       sizing results table pd.DataFrame
      """
+    from oemof.outputlib import views
 
     res = {}
 
@@ -295,40 +510,59 @@ def sizing_results(results, m, sizing_list):
     return result
 
 
-def results_postprocessing(n, component_list, time_horizon=None):
+def results_postprocessing(n, component_list, time_horizon=None, timeincrement=None, index=None):
+    """
+    The function returns the sequences of the components in component_list as one results table.
+
+    :param time_horizon:    number of hours to return, all if None                          int
+    :param timeincrement:   length of the time steps of a model of an aggregated timeseries,
+                            its results are mapped back to the hourly grid, see
+                            time_resolution.disaggregate_results()                          list of int
+    :param index:           hourly index of the original timeseries                         pd.DatetimeIndex
+    :return: res results table                                                              pd.DataFrame
+    """
+    from oemof.outputlib import views
+
     generator_list = []
 
     for i in range( len( component_list ) ):
         d1 = views.node( n, component_list[i] )['sequences']
-
-        if time_horizon is not None:
-            generator_list.append( d1.iloc[:time_horizon] )
-        else:
-            generator_list.append( d1 )
+        generator_list.append( d1 )
 
     res = pd.concat( generator_list, axis=1 )
 
+    if timeincrement is not None:
+        res = disaggregate_results( res, timeincrement, index )
+
+    if time_horizon is not None:
+        res = res.iloc[:time_horizon]
+
     return res
 
 
-def get_timeseries(file='data/timeseries_Lifuka.csv'):
-    timeseries = pd.read_csv( file, sep=',' )
-    timeseries.set_index( pd.DatetimeIndex( timeseries['timestamp'], freq='H' ), inplace=True )
-    timeseries.drop( labels='timestamp', axis=1, inplace=True )
-    timeseries['PV'][timeseries['PV'] > 1] = 1
-    return timeseries
+def get_timeseries(file='data/timeseries_Lifuka.csv', date_from=None, date_to=None):
+    """
+    Returns the timeseries holding pv and demand_el values, see timeseries_loader.load_timeseries()
+    """
+    return load_timeseries( file, date_from=date_from, date_to=date_to )
 
 
 if __name__ == '__main__':
 
     ## this is the place where the Lifuka case study is specified ###
 
+    from oemof.outputlib import processing
+    import cost_summary as lcoe
+
     path = 'results'
     filepath = '/diesel_pv_batt_inv_4_'
 
     PH = 8760
     sim_mode = 'investment'
 
+    # (hours, step length) pairs of an aggregated sizing run, e.g. ((None, 4),), hourly if None
+    resolution = None
+
     time_measure = {}
 
     components_list = ['demand', 'PV', 'storage', 'pp_oil_1', 'pp_oil_2', 'pp_oil_3', 'excess']
@@ -343,13 +577,21 @@ if __name__ == '__main__':
     feed = get_timeseries()
     feed = feed.iloc[:PH]
 
-    m = create_energysystem_model( sim_mode, feed, initial_capacity, cost_dict )[0]
+    timeincrement = None
+    if resolution is not None:
+        timeincrement = resolution_increments( PH, resolution )
+        hourly_index = feed.index
+        feed = aggregate_timeseries( feed, timeincrement )
+
+    m = create_energysystem_model( sim_mode, feed, initial_capacity, cost_dict, timeincrement=timeincrement )[0]
 
     results = solve_and_create_results( m, gap=0.03 )
 
     economic_results = lcoe.get_lcoe( m, results, components_list ).to_csv( path + filepath + 'lcoe.csv' )
 
-    results_flows = results_postprocessing( results, components_list, time_horizon=PH )
+    # results of an aggregated run are mapped back to the hourly grid
+    results_flows = results_postprocessing( results, components_list, time_horizon=PH, timeincrement=timeincrement,
+                                            index=hourly_index if resolution is not None else None )
 
     if sim_mode == 'investment':
         sizing_df = sizing_results( results, m, sizing_list )
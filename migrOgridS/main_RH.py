@@ -1,15 +1,12 @@
 import logging
-import custom_constraints as constraints
 import pandas as pd
 import os
 import time
 
-from oemof.outputlib import processing, views
-from oemof.solph import (Sink, Transformer, Source, Bus, Flow, NonConvex,
-                         Model, EnergySystem, components, custom, Investment)
-from oemof.tools import logger, economics
-from oemof.network import Node
-import cost_summary as lcoe
+from oemof.tools import economics
+from timeseries_loader import load_timeseries
+
+# oemof.solph, oemof.outputlib and pyomo are imported on first use inside the functions, see main.py
 
 # cost dictionary #####################################################################################################
 #######################################################################################################################
@@ -35,6 +32,8 @@ def get_cost_dict(PH):
 
 
 def get_sim_params(cost):
+    from oemof.solph import Investment
+
     sim_params = {'pv': {'nominal_capacity': 265.017017,
                          'investment': Investment( ep_costs=cost['pv']['epc'] )},
                   'storage': {'nominal_capacity': 268.1211092,
@@ -43,16 +42,30 @@ def get_sim_params(cost):
 
 
 def add_inverter(i, o, name, eta=1):
+    from oemof.solph import Transformer, Flow
+
     return Transformer( label=name,
                         inputs={i: Flow()},
                         outputs={o: Flow()},
                         conversion_factors={o: eta} )
 
 
-def create_optimization_model(mode, feedin, initial_batt_cap, cost, cap_pv, cap_batt,iterstatus=None, PV_source=True, storage_source=True,logger=False):
+def create_energysystem(feedin, initial_batt_cap, cost, cap_pv, cap_batt, iterstatus=None, PV_source=True,
+                        storage_source=True, gen_status=None):
+    """
+    Sets up the energy system of one rolling horizon window, see create_optimization_model(). It is shared by the
+    pyomo model and the matrix model templates of model_template.py.
 
-    if logger==1:
-        logger.define_logging()
+    :return: energysystem, gen_set, storage
+    """
+    from oemof.solph import (Sink, Source, Bus, Flow, NonConvex, EnergySystem, components, custom)
+    from oemof.network import Node
+
+    # initial on/off status of the generators, carried over from the previous rolling horizon window. It is only
+    # informational: NonConvex uses initial_status for startup costs and minimum up and down times, which the
+    # generators do not have, so the status of the first time step is not constrained by it
+    if gen_status is None:
+        gen_status = {}
 
     ##################################### Initialize the energy system##################################################
 
@@ -91,7 +104,8 @@ def create_optimization_model(mode, feedin, initial_batt_cap, cost, cap_pv, cap_
                                                                         min=0.3,
                                                                         max=1,
                                                                         nonconvex=NonConvex(
-                                                                            om_costs=cost['pp_oil_1']['o&m'] ),
+                                                                            om_costs=cost['pp_oil_1']['o&m'],
+                                                                            initial_status=gen_status.get( 'pp_oil_1', 0 ) ),
                                                                         fixed_costs=cost['pp_oil_1']['fix']
                                                                         )},
                                          fuel_curve={'1': 42, '0.75': 33, '0.5': 22, '0.25': 16} )
@@ -102,7 +116,8 @@ def create_optimization_model(mode, feedin, initial_batt_cap, cost, cap_pv, cap_
                                                                         min=0.3,
                                                                         max=1,
                                                                         nonconvex=NonConvex(
-                                                                            om_costs=cost['pp_oil_2']['o&m'] ),
+                                                                            om_costs=cost['pp_oil_2']['o&m'],
+                                                                            initial_status=gen_status.get( 'pp_oil_2', 0 ) ),
                                                                         fixed_costs=cost['pp_oil_2']['fix'],
                                                                         variable_costs=0 )},
                                          fuel_curve={'1': 42, '0.75': 33, '0.5': 22, '0.25': 16} )
@@ -113,7 +128,8 @@ def create_optimization_model(mode, feedin, initial_batt_cap, cost, cap_pv, cap_
                                                                         min=0.3,
                                                                         max=1,
                                                                         nonconvex=NonConvex(
-                                                                            om_costs=cost['pp_oil_3']['o&m'] ),
+                                                                            om_costs=cost['pp_oil_3']['o&m'],
+                                                                            initial_status=gen_status.get( 'pp_oil_3', 0 ) ),
                                                                         fixed_costs=cost['pp_oil_3']['fix'],
                                                                         variable_costs=0 )},
                                          fuel_curve={'1': 73, '0.75': 57, '0.5': 38, '0.25': 27} )
@@ -152,19 +168,60 @@ def create_optimization_model(mode, feedin, initial_batt_cap, cost, cap_pv, cap_
     if storage_source == 1 or PV_source == 1:
         inverter1 = add_inverter( b_dc, b_el, 'Inv_pv' )
 
+    return [energysystem, gen_set, storage]
+
+
+def create_optimization_model(mode, feedin, initial_batt_cap, cost, cap_pv, cap_batt,iterstatus=None, PV_source=True, storage_source=True,logger=False,
+                              gen_status=None, timeincrement=None, reserve_params=False):
+    """
+    Builds the operational model of one rolling horizon window with installed capacities cap_pv and cap_batt.
+    With reserve_params=True the spinning reserve and rotating mass limits are the mutable pyomo Params m.sr_limit
+    and m.rm_limit, so that a built model can be reused for a new demand forecast, see dispatch.py.
+    """
+
+    from oemof.solph import Model
+    import custom_constraints as constraints
+
+    if logger==1:
+        from oemof.tools import logger as oemof_logger
+        oemof_logger.define_logging()
+
+    energysystem, gen_set, storage = create_energysystem( feedin, initial_batt_cap, cost, cap_pv, cap_batt,
+                                                          iterstatus=iterstatus, PV_source=PV_source,
+                                                          storage_source=storage_source, gen_status=gen_status )
+
+    demand_feedin = feedin['demand_el']
+
     ################################# optimization ############################
     # create Optimization model based on energy_system
     logging.info( "Create optimization problem" )
 
-    m = Model( energysystem )
+    if timeincrement is None:
+        m = Model( energysystem )
+    else:
+        # variable resolution time index, see time_resolution.aggregate_timeseries()
+        m = Model( energysystem, timeincrement=timeincrement, objective_weighting=timeincrement )
+
+        # om costs per time step of the generators, weighted like the variable costs
+        constraints.om_costs_weighting( m, gen_set )
 
     ################################# constraints ############################
 
+    # reserves refer to the peak demand of a time step if the timeseries is aggregated
+    reserve_base = feedin['demand_max'] if 'demand_max' in feedin else demand_feedin
+
     sr_requirement = 0.2
-    sr_limit = demand_feedin * sr_requirement
+    sr_limit = reserve_base * sr_requirement
 
     rm_requirement = 0.4
-    rm_limit = demand_feedin * rm_requirement
+    rm_limit = reserve_base * rm_requirement
+
+    if reserve_params:
+        import pyomo.environ as po
+
+        m.sr_limit = po.Param( m.TIMESTEPS, initialize=dict( enumerate( sr_limit.values ) ), mutable=True )
+        m.rm_limit = po.Param( m.TIMESTEPS, initialize=dict( enumerate( rm_limit.values ) ), mutable=True )
+        sr_limit, rm_limit = m.sr_limit, m.rm_limit
 
     constraints.spinning_reserve_constraint( m, sr_limit, groups=gen_set, storage=storage )
 
@@ -177,14 +234,24 @@ def create_optimization_model(mode, feedin, initial_batt_cap, cost, cap_pv, cap_
     return [m, gen_set]
 
 
-def solve_and_create_results(m, lp_write=False, gap=0.01):
+def solve_and_create_results(m, lp_write=False, gap=0.01, model_file=os.path.join( 'results', 'Lifuka.mps.gz' ),
+                             threads=None):
+    from oemof.outputlib import processing
+    import model_export
+
+    # the model file is written with numeric names and a label map, see model_export.py
     if lp_write == True:
-        m.write( os.path.join( 'results', 'Lifuka.lp' ), io_options={'symbolic_solver_labels': True} )
+        model_export.export_model( m, model_file )
 
     # solve with specific optimization options (passed to pyomo)
     logging.info( "Solve optimization problem" )
 
-    m.solve( solver='gurobi', solve_kwargs={'tee':False}, cmdline_options={'MIPGap': gap} )
+    # threads limits the solver threads, e.g. of parallel jobs (job_service.py)
+    options = {'MIPGap': gap}
+    if threads is not None:
+        options['Threads'] = threads
+
+    m.solve( solver='gurobi', solve_kwargs={'tee':False}, cmdline_options=options )
 
     # cmdline_options = {'MIPGap': 0.01}
 
@@ -196,6 +263,8 @@ def solve_and_create_results(m, lp_write=False, gap=0.01):
 
 
 def sizing_results(results,m, sizing_list):
+    from oemof.outputlib import views
+
     res = {}
 
     for i in range( len( sizing_list ) ):
@@ -210,6 +279,8 @@ def sizing_results(results,m, sizing_list):
 
 
 def results_postprocessing(n, component_list, time_horizon=None):
+    from oemof.outputlib import views
+
     generator_list = []
 
     for i in range( len( component_list ) ):
@@ -225,10 +296,9 @@ def results_postprocessing(n, component_list, time_horizon=None):
     return res
 
 
-def get_timeseries(file='data/timeseries.csv'):
-    timeseries = pd.read_csv(file, sep=';' )
-    timeseries.set_index( pd.DatetimeIndex( timeseries['timestamp'], freq='H' ), inplace=True )
-    timeseries.drop( labels='timestamp', axis=1, inplace=True )
-    timeseries[timeseries['PV'] > 1]['PV'] = 1
-    return timeseries
+def get_timeseries(file='data/timeseries.csv', date_from=None, date_to=None):
+    """
+    Returns the timeseries holding pv and demand_el values, see timeseries_loader.load_timeseries()
+    """
+    return load_timeseries( file, date_from=date_from, date_to=date_to )
 
@@ -0,0 +1,339 @@
+"""
+Model export for audit files.
+
+Models are written in MPS format with compact numeric names (C0, C1, ... for columns, R0, R1, ... for rows) and a
+separate label map, which links every name to the variable or constraint it stands for. Files ending with .gz are
+compressed while they are written. export_model() can run the export of a matrix model on a background thread, so
+that writing the file overlaps with the solve:
+
+    export = model_export.export_model(fm, 'results/Lifuka.mps.gz', background=True)
+    fm.solve(...)
+    export.join()
+
+Pyomo models are always exported on the calling thread: their writer walks the model, which the solve and warm
+starts change, and as pure Python it holds the GIL, so it would not overlap with the solve anyway.
+
+Matrix models of fast_builder.py are written directly from their sparse matrix in free or fixed MPS format. Pyomo
+models are written by pyomo's MPS or LP writer without symbolic solver labels, the label map is taken from the
+symbol map of the writer.
+"""
+
+import csv
+import gzip
+import io
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import weakref
+
+import numpy as np
+from scipy import sparse
+
+CHUNK = 1 << 16
+
+
+def _open(filename):
+    directory = os.path.dirname(filename)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory, exist_ok=True)
+
+    if filename.endswith('.gz'):
+        # fast compression level, the files are written on every run
+        return io.TextIOWrapper(gzip.open(filename, 'wb', compresslevel=3), encoding='ascii', newline='\n')
+    return open(filename, 'w', newline='\n')
+
+
+def label_map_file(filename):
+    """Returns the name of the label map of the model file filename, e.g. Lifuka.labels.csv.gz of Lifuka.mps.gz"""
+    compressed = filename.endswith('.gz')
+    base = filename[:-3] if compressed else filename
+    base = os.path.splitext(base)[0]
+    return base + '.labels.csv' + ('.gz' if compressed else '')
+
+
+def _number(value, width=None):
+    # shortest exact representation, in fixed format the most precise one that fits into width characters
+    text = repr(float(value))
+    if width is None or len(text) <= width:
+        return text
+    for precision in range(width, 0, -1):
+        text = '%.*g' % (precision, value)
+        if len(text) <= width:
+            return text
+    raise ValueError('Value ' + repr(value) + ' does not fit into a fixed MPS field')
+
+
+class _MPSWriter(object):
+    # writes MPS lines in free or fixed format
+
+    def __init__ (self, f, fixed):
+        self.f = f
+        self.fixed = fixed
+        self.lines = []
+
+    def line (self, *fields):
+        # fields: code, name, name, value, name, value
+        if self.fixed:
+            code, name = fields[0], fields[1]
+            text = ' ' + code.ljust(2) + ' ' + name.ljust(8)
+            if len(fields) == 3:
+                text += '  ' + fields[2]
+            elif len(fields) > 3:
+                text += '  ' + fields[2].ljust(8) + '  ' + _number(fields[3], 12).rjust(12)
+            if len(fields) > 4:
+                text += '   ' + fields[4].ljust(8) + '  ' + _number(fields[5], 12).rjust(12)
+            self.lines.append(text.rstrip())
+        else:
+            values = [f if isinstance(f, str) else _number(f) for f in fields]
+            self.lines.append(' ' + ' '.join(v for v in values if v))
+
+        if len(self.lines) >= CHUNK:
+            self.flush()
+
+    def marker (self, kind):
+        # INTORG or INTEND marker of integer columns
+        if self.fixed:
+            self.lines.append('    MARKER    ' + "'MARKER'" + ' ' * 17 + "'" + kind + "'")
+        else:
+            self.lines.append(" MARKER 'MARKER' '" + kind + "'")
+
+    def section (self, name):
+        self.flush()
+        self.f.write(name + '\n')
+
+    def flush (self):
+        if self.lines:
+            self.f.write('\n'.join(self.lines) + '\n')
+            self.lines = []
+
+
+def write_mps(filename, c, A, lb, ub, row_lb, row_ub, integrality=None, constant=0.0, fixed=False,
+              name='microgrid'):
+    """
+    Writes the minimisation problem min c x + constant, row_lb <= A x <= row_ub, lb <= x <= ub in MPS format.
+    Columns are named C<j>, rows R<i> and the objective row OBJ. Rows without finite bound are not written.
+
+    :param filename:    model file, compressed if it ends with .gz                              str
+    :param A:           constraint matrix                                                       scipy.sparse matrix
+    :param integrality: 1 for integer columns, see scipy.optimize.milp                          np.array or None
+    :param fixed:       fixed instead of free MPS format, names have at most 8 characters       boolean
+    """
+    A = sparse.csc_matrix(A)
+    n_rows, n_columns = A.shape
+    if fixed and max(n_rows, n_columns) > 10 ** 7:
+        raise ValueError('Fixed MPS format only holds names of 8 characters')
+
+    row_lb = np.asarray(row_lb, dtype=float)
+    row_ub = np.asarray(row_ub, dtype=float)
+    lb = np.asarray(lb, dtype=float)
+    ub = np.asarray(ub, dtype=float)
+    integrality = np.zeros(n_columns) if integrality is None else np.asarray(integrality)
+
+    active = np.isfinite(row_lb) | np.isfinite(row_ub)
+    equal = active & (row_lb == row_ub)
+    less = active & ~equal & ~np.isfinite(row_lb)
+    ranged = active & ~equal & np.isfinite(row_lb) & np.isfinite(row_ub)
+
+    with _open(filename) as f:
+        w = _MPSWriter(f, fixed)
+        f.write('NAME          ' + name + '\n')
+
+        w.section('ROWS')
+        w.line('N', 'OBJ')
+        for i in np.flatnonzero(active):
+            w.line('E' if equal[i] else 'L' if less[i] else 'G', 'R' + str(i))
+
+        w.section('COLUMNS')
+        integer = False
+        for j in range(n_columns):
+            if bool(integrality[j]) != integer:
+                integer = not integer
+                w.marker('INTORG' if integer else 'INTEND')
+
+            column = 'C' + str(j)
+            entries = [('OBJ', c[j])] if c[j] != 0 else []
+            start, stop = A.indptr[j], A.indptr[j + 1]
+            entries += [('R' + str(i), v) for i, v in zip(A.indices[start:stop], A.data[start:stop])
+                        if active[i] and v != 0]
+            if not entries:
+                # columns without entries are declared with a zero objective coefficient
+                entries = [('OBJ', 0.0)]
+
+            for k in range(0, len(entries), 2):
+                fields = ['', column, entries[k][0], entries[k][1]]
+                if k + 1 < len(entries):
+                    fields += [entries[k + 1][0], entries[k + 1][1]]
+                w.line(*fields)
+        if integer:
+            w.marker('INTEND')
+
+        w.section('RHS')
+        if constant:
+            # the rhs of the objective row is the negative objective constant
+            w.line('', 'RHS', 'OBJ', -constant)
+        for i in np.flatnonzero(active):
+            rhs = row_ub[i] if less[i] else row_lb[i]
+            if rhs != 0:
+                w.line('', 'RHS', 'R' + str(i), rhs)
+
+        if ranged.any():
+            w.section('RANGES')
+            for i in np.flatnonzero(ranged):
+                w.line('', 'RNG', 'R' + str(i), row_ub[i] - row_lb[i])
+
+        w.section('BOUNDS')
+        for j in range(n_columns):
+            column = 'C' + str(j)
+            if lb[j] == ub[j]:
+                w.line('FX', 'BND', column, lb[j])
+            elif not np.isfinite(lb[j]) and not np.isfinite(ub[j]):
+                w.line('FR', 'BND', column)
+            else:
+                if not np.isfinite(lb[j]):
+                    w.line('MI', 'BND', column)
+                elif lb[j] != 0 or integrality[j]:
+                    w.line('LO', 'BND', column, lb[j])
+                if np.isfinite(ub[j]):
+                    w.line('UP', 'BND', column, ub[j])
+
+        w.section('ENDATA')
+
+    return filename
+
+
+def write_label_map(filename, labels):
+    """
+    Writes the label map of a model file as csv with the columns name and label.
+
+    :param labels:  (name, label) pairs                                                      iterable
+    """
+    with _open(filename) as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow(['name', 'label'])
+        writer.writerows(labels)
+
+    return filename
+
+
+def export_fast_model(fm, filename, fixed=False):
+    """
+    Writes a matrix model of fast_builder.py and its label map, e.g. C12,flow(PV,electricity_dc,3).
+
+    :param fm:          matrix model                                        fast_builder.FastModel
+    :param filename:    model file, compressed if it ends with .gz          str
+    :param fixed:       fixed instead of free MPS format                    boolean
+    :return: filename, label map                                            str, str
+    """
+    write_mps(filename, fm.c, fm.matrix(), fm.lb, fm.ub, fm.row_lb, fm.row_ub, fm.integrality,
+              constant=fm.constant, fixed=fixed)
+
+    def labels():
+        for key, (start, length) in fm.columns.items():
+            for t in range(length):
+                yield 'C' + str(start + t), key[0] + '(' + ','.join(key[1:]) + ',' + str(t) + ')'
+        for name, (start, length) in fm.rows.items():
+            for t in range(length):
+                yield 'R' + str(start + t), name + '(' + str(t) + ')'
+
+    return filename, write_label_map(label_map_file(filename), labels())
+
+
+def export_pyomo_model(m, filename):
+    """
+    Writes a pyomo model with pyomo's writer and numeric names, the format follows from the extension (.mps or .lp,
+    optionally with .gz). The label map holds the component names of the symbol map of the writer.
+
+    :param m:           operational model                                   om.solph.model
+    :param filename:    model file, compressed if it ends with .gz          str
+    :return: filename, label map                                            str, str
+    """
+    compressed = filename.endswith('.gz')
+    extension = os.path.splitext(filename[:-3] if compressed else filename)[1]
+    if extension not in ('.mps', '.lp'):
+        raise ValueError('Pyomo models are written as .mps or .lp, not ' + extension)
+
+    directory = os.path.dirname(filename)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory, exist_ok=True)
+
+    handle, target = tempfile.mkstemp(suffix=extension, dir=directory or None) if compressed else (None, filename)
+    if handle is not None:
+        os.close(handle)
+
+    try:
+        smap_id = m.write(target, io_options={'symbolic_solver_labels': False})[1]
+
+        if compressed:
+            with open(target, 'rb') as source, gzip.open(filename, 'wb', compresslevel=3) as f:
+                shutil.copyfileobj(source, f, CHUNK)
+    finally:
+        if compressed and os.path.isfile(target):
+            os.remove(target)
+
+    symbol_map = m.solutions.symbol_map[smap_id]
+
+    def labels():
+        for symbol, obj in symbol_map.bySymbol.items():
+            if isinstance(obj, weakref.ReferenceType):
+                obj = obj()
+            yield symbol, obj.name
+
+    labels_file = write_label_map(label_map_file(filename), labels())
+    m.solutions.delete_symbol_map(smap_id)
+
+    return filename, labels_file
+
+
+class ExportThread(threading.Thread):
+    """
+    Background export, join() waits for the file and raises the exception of a failed export.
+    """
+
+    def __init__ (self, model, filename, fixed=False):
+        super(ExportThread, self).__init__(name='export ' + filename, daemon=True)
+        self.model = model
+        self.filename = filename
+        self.fixed = fixed
+        self.files = None
+        self.error = None
+
+    def run (self):
+        start = time.time()
+        try:
+            if hasattr(self.model, 'structure'):
+                self.files = export_fast_model(self.model, self.filename, fixed=self.fixed)
+            else:
+                if self.fixed:
+                    raise ValueError('Pyomo models are only written in free MPS format')
+                self.files = export_pyomo_model(self.model, self.filename)
+            logging.info('Exported ' + self.filename + ' in ' + str(round(time.time() - start, 2)) + ' s')
+        except Exception as e:
+            self.error = e
+
+    def join (self, timeout=None):
+        super(ExportThread, self).join(timeout)
+        if self.error is not None:
+            raise self.error
+        return self.files
+
+
+def export_model(m, filename, fixed=False, background=False):
+    """
+    Exports a pyomo model or a matrix model of fast_builder.py, see export_pyomo_model() and export_fast_model().
+
+    :param background:  export a matrix model on a background thread, the returned thread is already
+                        started. Pyomo models are exported before the call returns              boolean
+    :return: thread of a background export, (filename, label map) otherwise ExportThread or tuple
+    """
+    thread = ExportThread(m, filename, fixed=fixed)
+    if background and hasattr(m, 'structure'):
+        thread.start()
+        return thread
+
+    thread.run()
+    if thread.error is not None:
+        raise thread.error
+    return thread.files
@@ -0,0 +1,142 @@
+"""
+Serialized model templates for repeated runs.
+
+A template is a compiled matrix model of fast_builder.py, i.e. the structure, the column and row layout and the
+coefficients of the model, saved to disk. Runs of the same topology, costs and horizon load the template and bind
+their timeseries to it, without oemof's node registry, Model(energysystem) or the rules of custom_constraints:
+
+    m = model_template.get_template(8760, cost, mode='investment')
+    model_template.bind_timeseries(m, feedin, 0.5)
+    m.solve()
+    results = m.results()
+
+Templates are stored in results/templates/ under a hash of everything they are compiled from, a template is only
+compiled if it is not found there. Results of a loaded template are keyed by labels, which is enough for
+main.results_postprocessing and solver_strategies.final_state.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from fast_builder import FastModel
+
+TEMPLATE_VERSION = 1
+TEMPLATES = os.path.join('results', 'templates')
+
+# feedin column of the fixed flow of a node
+PROFILES = {'demand': 'demand_el', 'PV': 'PV'}
+
+# templates loaded by this process
+_loaded = {}
+
+
+def template_key(hours, cost, mode='investment', timeincrement=None, **kwargs):
+    """
+    Returns the hash of the inputs a template is compiled from.
+    """
+    spec = {'version': TEMPLATE_VERSION, 'hours': hours, 'cost': cost, 'mode': mode,
+            'timeincrement': None if timeincrement is None else [float(x) for x in timeincrement]}
+    spec.update(kwargs)
+    return hashlib.sha1(json.dumps(spec, sort_keys=True, default=repr).encode()).hexdigest()
+
+
+def compile_template(hours, cost, mode='investment', timeincrement=None, cap_pv=None, cap_batt=None,
+                     iterstatus=None, gen_banks=None, sr_requirement=0.2, rm_requirement=0.4):
+    """
+    Compiles the matrix model of the topology of main.py or main_RH.py for hours time steps.
+
+    :param hours:           number of time steps                                                int
+    :param cost:            cost dict                                                           dict
+    :param mode:            'investment' or 'simulation' (main.py), 'rolling_horizon' for a
+                            window of main_RH.py with installed capacities cap_pv and cap_batt  str
+    :param timeincrement:   length of the time steps in hours, hourly if None                   list of int
+    :param iterstatus:      initial storage capacity relative (None, True) or absolute (False)  boolean
+    :return: template, not bound to data                                                        FastModel
+    """
+    start = time.time()
+
+    index = pd.date_range('2017-01-01', periods=hours, freq='h')
+    feedin = pd.DataFrame({'PV': np.zeros(hours), 'demand_el': np.zeros(hours)}, index=index)
+
+    if mode == 'rolling_horizon':
+        import main_RH
+        es, gen_set, storage = main_RH.create_energysystem(feedin, 0.5, cost, cap_pv, cap_batt, iterstatus=iterstatus)
+    else:
+        import main
+        es, gen_set, storage = main.create_energysystem(mode, feedin, 0.5, cost, iterstatus=iterstatus,
+                                                        gen_banks=gen_banks)
+
+    m = FastModel.from_energysystem(es, gen_set, storage, np.zeros(hours), np.zeros(hours), timeincrement)
+    m.es = None
+
+    flows = [f['name'] for f in m.structure['flows'] if f['fixed']]
+    m.structure['profiles'] = {name: PROFILES.get(name[0], PROFILES.get(name[1])) for name in flows}
+    m.structure['requirements'] = {'sr': sr_requirement, 'rm': rm_requirement}
+
+    logging.info('Compiled template of ' + str(hours) + ' time steps in ' + str(round(time.time() - start, 3)) + ' s')
+
+    return m
+
+
+def get_template(hours, cost, mode='investment', timeincrement=None, directory=TEMPLATES, **kwargs):
+    """
+    Returns the template of the inputs, see compile_template(). It is loaded from directory if it was compiled before
+    and compiled and saved otherwise. Templates are kept in memory for the following calls of the process.
+
+    :return: template, bound to the data of the last run of the process or to zeros                    FastModel
+    """
+    key = template_key(hours, cost, mode, timeincrement, **kwargs)
+    if key in _loaded:
+        return _loaded[key]
+
+    filename = os.path.join(directory, key + '.pkl')
+    if os.path.isfile(filename):
+        start = time.time()
+        m = FastModel.load(filename)
+        logging.info('Loaded template ' + filename + ' in ' + str(round(time.time() - start, 3)) + ' s')
+    else:
+        m = compile_template(hours, cost, mode, timeincrement, **kwargs)
+        m.save(filename)
+
+    _loaded[key] = m
+    return m
+
+
+def bind_timeseries(m, feedin, initial_capacity):
+    """
+    Binds a timeseries to a template: the fixed flows follow the feedin columns of PROFILES, the reserve limits
+    refer to demand_max if the timeseries is aggregated and to demand_el otherwise.
+
+    :param m:                   template                                                FastModel
+    :param feedin:              timeseries holding pv and demand_el values              pd.DataFrame
+    :param initial_capacity:    initial storage capacity, relative or absolute like
+                                the iterstatus the template was compiled with           float
+    :return: m
+    """
+    s = m.structure
+    if len(feedin) != s['timesteps']:
+        raise ValueError('The template covers ' + str(s['timesteps']) + ' time steps, the timeseries ' +
+                         str(len(feedin)))
+
+    reserve_base = (feedin['demand_max'] if 'demand_max' in feedin else feedin['demand_el']).values
+
+    data = {'actual_value': {name: feedin[column].values for name, column in s['profiles'].items()},
+            'sr_limit': reserve_base * s['requirements']['sr'],
+            'rm_limit': reserve_base * s['requirements']['rm'],
+            'initial_capacity': {st['label']: initial_capacity for st in s['storages']}}
+
+    m.bind(data)
+    m.index = feedin.index
+
+    return m
+
+
+def generator_labels(m):
+    """Returns the labels of the generators of a template"""
+    return [g['label'] for g in m.structure['generators']]
@@ -0,0 +1,224 @@
+"""
+Pareto front of total cost vs. diesel use or renewable share of the investment model.
+
+The front is computed with the epsilon constraint method: the cost optimal sizing is solved first, then the diesel
+fuel of the 'diesel' source is limited to values below its fuel use (custom_constraints.diesel_limit_constraint),
+or the renewable share of the demand is required to exceed its share (renewable_share_constraint). The epsilon points
+are solved in a pool of worker processes. Every point is warm started from the nearest solved point through a shared
+warm_start.SolutionStore. Segments of the front are refined by their midpoints until the cost changes by less than
+tol of the cost range between neighbouring points, i.e. where the front is flat, or until max_points are solved:
+
+    front = pareto.pareto_front(feedin, metric='diesel', points=5, max_points=20)
+"""
+
+import logging
+import multiprocessing
+import os
+
+import numpy as np
+import pandas as pd
+
+import main
+import warm_start
+
+COMPONENTS = ['demand', 'PV', 'storage', 'pp_oil_1', 'pp_oil_2', 'pp_oil_3', 'excess']
+SIZING = ['PV', 'storage']
+
+METRICS = ('diesel', 'renewable_share')
+
+
+def front_metrics(m, results, gen_set):
+    """
+    Returns the diesel fuel taken from the 'diesel' source and the renewable share of the demand, i.e. the share not
+    covered by the generators, of the solved model m.
+    """
+    w = np.array([m.timeincrement[t] for t in m.TIMESTEPS], dtype=float)
+    diesel, generation, consumption = 0.0, 0.0, 0.0
+
+    for (i, o), values in results.items():
+        if o is None or 'flow' not in values['sequences']:
+            continue
+        energy = float(np.dot(values['sequences']['flow'].values, w))
+        if str(i) == 'diesel':
+            diesel += energy
+        if i in gen_set:
+            generation += energy
+        if str(o) == 'demand':
+            consumption += energy
+
+    return {'diesel': diesel, 'renewable_share': 1 - generation / consumption if consumption else None}
+
+
+def _solve_point(args):
+    """
+    Worker of pareto_front: solves the investment model with the epsilon constraint of one point and returns its row
+    of the frontier table.
+    """
+    epsilon, metric, feedin, cost, gap, solver, store, threads = args
+
+    import cost_summary as lcoe
+    import custom_constraints as constraints
+
+    m, gen_set = main.create_energysystem_model('investment', feedin, 0.5, cost)
+
+    if epsilon is not None:
+        if metric == 'diesel':
+            constraints.diesel_limit_constraint(m, epsilon, m.es.groups['diesel'])
+        else:
+            constraints.renewable_share_constraint(m, epsilon, gen_set, m.es.groups['demand'])
+
+    parameters = {} if epsilon is None else {'epsilon_' + metric: epsilon}
+    scenario = warm_start.scenario_vector(cost, 'pareto_' + metric, len(feedin), **parameters)
+
+    row = {'metric': metric, 'epsilon': epsilon}
+
+    # oemof only warns if the solve ends without solution, reading the results of such a point may fail
+    try:
+        results = main.solve_and_create_results(m, lp_write=False, gap=gap, solver=solver,
+                                                warm_start=None if store is None else warm_start.SolutionStore(store),
+                                                scenario=scenario, threads=threads)
+    except Exception:
+        if main.termination_condition(m) in main.SOLVED:
+            raise
+        results = None
+
+    termination = main.termination_condition(m)
+    if termination not in main.SOLVED:
+        # epsilon beyond the reach of the investment bounds
+        logging.warning('Point ' + str(epsilon) + ' of the ' + metric + ' front is infeasible, the solver '
+                        'terminated with ' + str(termination))
+        row['feasible'] = False
+        return row
+
+    row['objective'] = float(m.objective())
+    row.update(front_metrics(m, results, gen_set))
+
+    sizing = main.sizing_results(results, m, SIZING)
+    for nodes, value in sizing.iloc[:, 0].items():
+        row['size_' + str(nodes[0])] = float(value)
+
+    economic = lcoe.get_lcoe(m, results, COMPONENTS)
+    for label, values in economic.iterrows():
+        for column, value in values.items():
+            row[column + '_' + label] = float(value)
+
+    costs = economic[['CAPEX', 'OPEX', 'fuel_cost']].values.astype(float).sum()
+    row['lcoe'] = costs / feedin['demand_el'].sum()
+
+    row['feasible'] = True
+    return row
+
+
+def refine(front, tol=0.02):
+    """
+    Returns the epsilon midpoints of the segments of the front that are not flat, i.e. whose cost changes by more than
+    tol of the cost range, and of the segment between the last feasible and the first infeasible point.
+
+    :param front:   frontier table of the points solved so far, the anchor has epsilon None     pd.DataFrame
+    :return: epsilon values to solve                                                             list of float
+    """
+    points = front[front['epsilon'].notnull()]
+    feasible = points[points['feasible'].astype(bool)]
+    anchor = front[front['epsilon'].isnull()].iloc[0]
+
+    # the anchor starts the front at its own metric value
+    start = pd.DataFrame([{'epsilon': anchor[anchor['metric']], 'objective': anchor['objective']}])
+    curve = pd.concat([start, feasible[['epsilon', 'objective']]]).sort_values('epsilon')
+
+    cost_range = curve['objective'].max() - curve['objective'].min()
+    if cost_range <= 0:
+        return []
+
+    epsilon = curve['epsilon'].values
+    cost = curve['objective'].values
+    res = [(epsilon[k] + epsilon[k + 1]) / 2 for k in range(len(curve) - 1)
+           if abs(cost[k + 1] - cost[k]) > tol * cost_range]
+
+    # boundary of the feasible region
+    infeasible = points[~points['feasible'].astype(bool)]['epsilon'].values
+    if len(infeasible) and len(feasible):
+        loose = feasible['epsilon'].max() if anchor['metric'] == 'renewable_share' else feasible['epsilon'].min()
+        tight = infeasible.min() if anchor['metric'] == 'renewable_share' else infeasible.max()
+        res += [(loose + tight) / 2]
+
+    solved = set(np.round(points['epsilon'].values.astype(float), 9))
+    return [e for e in res if np.round(e, 9) not in solved]
+
+
+def pareto_front(feedin, cost=None, metric='diesel', points=5, max_points=20, bound=None, tol=0.02, gap=0.01,
+                 solver='gurobi', processes=None, store='results/pareto_warm_starts.sqlite', filename=None):
+    """
+    The function computes the front of total cost vs. diesel fuel or renewable share of the investment model.
+
+    :param feedin:      timeseries holding pv and demand_el values                                  pd.DataFrame
+    :param cost:        cost dict, main.get_cost_dict(len(feedin)) if None                          dict
+    :param metric:      'diesel' (fuel limit) or 'renewable_share' (minimum share)                  str
+    :param points:      number of epsilon points of the first pass                                  int
+    :param max_points:  maximum number of solved points, the cost optimal anchor included           int
+    :param bound:       last epsilon of the first pass, 20 % of the diesel fuel of the anchor or
+                        a renewable share of 0.95 if None                                           float
+    :param tol:         cost change relative to the cost range below which a segment is flat        float
+    :param gap:         allowable gap of the optimization                                           float
+    :param solver:      solver name passed to pyomo                                                 str
+    :param processes:   number of worker processes, os.cpu_count() if None, each solves with an
+                        equal share of the cores as solver threads                                  int
+    :param store:       database of the warm starts of the points, no warm starts if None           str
+    :param filename:    csv file the frontier table is written to                                   str
+    :return: frontier table with objective, metrics, sizing and LCOE breakdown per point        pd.DataFrame
+    """
+    if metric not in METRICS:
+        raise ValueError('The metric ' + str(metric) + ' is not supported. It can be either [diesel] or '
+                         '[renewable_share]')
+    if solver == 'race':
+        raise ValueError('The matrix model of solver_race.py does not hold the epsilon constraint')
+
+    if cost is None:
+        cost = main.get_cost_dict(len(feedin))
+
+    # the cost optimal sizing anchors the front
+    anchor = _solve_point((None, metric, feedin, cost, gap, solver, store, None))
+    if not anchor['feasible']:
+        raise RuntimeError('The cost optimal investment model is infeasible')
+    rows = [anchor]
+
+    start = anchor[metric]
+    if bound is None:
+        bound = 0.2 * start if metric == 'diesel' else 0.95
+    epsilon = list(np.linspace(start, bound, points + 1)[1:])
+
+    # every worker gets an equal share of the cores for its solver
+    cpus = os.cpu_count() or 1
+    processes = processes or cpus
+    threads = max(1, cpus // processes)
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        while epsilon:
+            epsilon = epsilon[:max_points - len(rows)]
+            logging.info('Solving ' + str(len(epsilon)) + ' points of the ' + metric + ' front')
+
+            rows += pool.map(_solve_point, [(float(e), metric, feedin, cost, gap, solver, store, threads)
+                                            for e in epsilon])
+            epsilon = refine(pd.DataFrame(rows), tol) if len(rows) < max_points else []
+    finally:
+        pool.close()
+        pool.join()
+
+    front = pd.DataFrame(rows)
+    # anchor first, then from the loosest to the tightest epsilon
+    points = front[front['epsilon'].notnull()].sort_values('epsilon', ascending=metric == 'renewable_share')
+    front = pd.concat([front[front['epsilon'].isnull()], points]).reset_index(drop=True)
+
+    if filename is not None:
+        directory = os.path.dirname(filename)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        front.to_csv(filename, index=False)
+
+    return front
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    timeseries = main.get_timeseries('data/timeseries.csv')
+    pareto_front(timeseries, metric='diesel', filename='results/pareto_diesel.csv')
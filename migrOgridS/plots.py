@@ -1,22 +1,32 @@
 import pandas as pd
 import matplotlib.pyplot as plt
 
+# display names of the results columns, see main.results_postprocessing
+LEGEND = {"(('electricity', 'demand'), 'flow')": 'load',
+          "(('PV', 'electricity_dc'), 'flow')": 'PV',
+          "(('electricity_dc', 'storage'), 'flow')": 'storage_in',
+          "(('storage', 'None'), 'capacity')": 'storage_cap',
+          "(('storage', 'electricity_dc'), 'flow')": 'storage_out',
+          "(('pp_oil_1', 'electricity'), 'flow')": 'dg1',
+          "(('pp_oil_2', 'electricity'), 'flow')": 'dg2',
+          "(('pp_oil_3', 'electricity'), 'flow')": 'dg3',
+          "(('electricity', 'excess'), 'flow')":'excess'}
+
 
 def unit_commitment_plot(filename, title=None, date_from=None, date_to=None):
+    """
+    Plots the flows and the storage capacity of a results table.
 
-    legend = {"(('electricity', 'demand'), 'flow')": 'load',
-              "(('PV', 'electricity_dc'), 'flow')": 'PV',
-              "(('electricity_dc', 'storage'), 'flow')": 'storage_in',
-              "(('storage', 'None'), 'capacity')": 'storage_cap',
-              "(('storage', 'electricity_dc'), 'flow')": 'storage_out',
-              "(('pp_oil_1', 'electricity'), 'flow')": 'dg1',
-              "(('pp_oil_2', 'electricity'), 'flow')": 'dg2',
-              "(('pp_oil_3', 'electricity'), 'flow')": 'dg3',
-              "(('electricity', 'excess'), 'flow')":'excess'}
+    :param filename:    path of a results .csv file or the results table itself,
+                        e.g. result_log.ResultLog(path).read()                  str or pd.DataFrame
+    """
 
-    df = pd.read_csv( filename )
-    df.set_index( pd.DatetimeIndex( df['timestamp'], freq='H' ), inplace=True )
-    df.drop( 'timestamp', axis=1, inplace=True )
+    if isinstance( filename, pd.DataFrame ):
+        df = filename
+    else:
+        df = pd.read_csv( filename )
+        df.set_index( pd.DatetimeIndex( df['timestamp'], freq='H' ), inplace=True )
+        df.drop( 'timestamp', axis=1, inplace=True )
 
 
     if date_from is None:
@@ -34,7 +44,7 @@ def unit_commitment_plot(filename, title=None, date_from=None, date_to=None):
         if ('flow' in i or 'capacity' in i) and 'diesel_source' not in i:
             order += [i]
     df = df[order]
-    df.rename( columns=legend, inplace=True )
+    df.rename( columns=LEGEND, inplace=True )
 
     fig = plt.figure(figsize=(8,6))
 
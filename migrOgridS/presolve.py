@@ -0,0 +1,248 @@
+"""
+Presolve stage for the microgrid model: derives valid bounds for the PV and storage investment and for the generator
+status from demand and PV statistics, reserve requirements and cost ratios, and passes them to the model before
+it is solved.
+
+All bounds are valid for the formulation of main.create_energysystem_model, they only cut off solutions that
+cannot be optimal or feasible:
+
+- Upper bounds on PV and storage capacity follow from a feasible diesel-only schedule. Its operating cost C0 plus
+  the fixed costs of the generators is an upper bound of the optimal objective, which contains at least the same
+  fixed costs plus the annuities of PV and storage, so the annuities cannot exceed C0. The fuel of the schedule is
+  priced on the upper envelope of the fuel curve and its linearisation, so that C0 is not below the cost of the
+  schedule in the model.
+- Lower bounds on the storage capacity follow from the reserve and demand of hours the generators cannot cover
+  alone.
+- A generator is forced on in every hour in which the remaining generators cannot provide the residual demand plus
+  spinning reserve, even with the largest PV and storage capacity possible.
+"""
+
+import itertools
+import logging
+
+import numpy as np
+import pyomo.environ as po
+from oemof.solph.options import Investment
+
+from generator_bank import GeneratorBank
+
+
+def linear_fuel_curve(fuel_curve, nominal_value):
+    """
+    Returns the linearised fuel curve fuel = intercept * status + slope * flow of an EngineGenerator, i.e. the least
+    squares line through the points of its fuel_curve dict {load fraction: fuel consumption}.
+
+    :param fuel_curve:      e.g. {'1': 42, '0.75': 33, '0.5': 22, '0.25': 16}      dict
+    :param nominal_value:   nominal electrical output of the generator             float
+    :return: intercept, slope                                                       float, float
+    """
+    load = np.array([float(k) for k in fuel_curve.keys()])
+    fuel = np.array([float(v) for v in fuel_curve.values()])
+
+    slope, intercept = np.polyfit(load, fuel, 1)
+
+    return intercept, slope / nominal_value
+
+
+def fuel_envelope(fuel_curve, nominal_value, flow):
+    """
+    Returns the fuel consumption of one unit at the output flow on the upper envelope of the piecewise linear fuel
+    curve and its least squares line (linear_fuel_curve), which is not below the fuel of either formulation.
+
+    :param fuel_curve:      e.g. {'1': 42, '0.75': 33, '0.5': 22, '0.25': 16}      dict
+    :param nominal_value:   nominal electrical output of the generator             float
+    :param flow:            electrical output of the unit                          np.array
+    :return: fuel                                                                   np.array
+    """
+    points = sorted((float(k), float(v)) for k, v in fuel_curve.items())
+    load = np.array([p[0] for p in points])
+    fuel = np.array([p[1] for p in points])
+    x = np.asarray(flow, dtype=float) / nominal_value
+
+    # linear extrapolation of the first and last segment beyond the points of the curve
+    curve = np.interp(x, load, fuel)
+    below, above = x < load[0], x > load[-1]
+    curve[below] = fuel[0] + (x[below] - load[0]) * (fuel[1] - fuel[0]) / (load[1] - load[0])
+    curve[above] = fuel[-1] + (x[above] - load[-1]) * (fuel[-1] - fuel[-2]) / (load[-1] - load[-2])
+
+    intercept, slope = linear_fuel_curve(fuel_curve, nominal_value)
+
+    return np.maximum(curve, intercept + slope * np.asarray(flow, dtype=float))
+
+
+def generator_data(gen_set):
+    """
+    Collects the parameters of the generators, sorted by their maximum output like in custom_constraints. Output
+    limits and costs refer to one unit, 'units' is the number of identical units of a GeneratorBank and 1 for a
+    single generator.
+    """
+    data = []
+
+    for n in gen_set:
+        flow = list(n.outputs.values())[0]
+        fuel = list(n.inputs.values())[0]
+
+        if isinstance(n, GeneratorBank):
+            units, nominal_value, p_min, om = n.units, n.unit_nominal_value, n.min, n.om_costs
+        else:
+            units, nominal_value, p_min, om = 1, flow.nominal_value, flow.min[0], flow.nonconvex.om_costs
+
+        intercept, slope = linear_fuel_curve(n.fuel_curve, nominal_value)
+
+        data += [{'node': n,
+                  'bus': list(n.outputs.keys())[0],
+                  'units': units,
+                  'nominal_value': nominal_value,
+                  'p_min': p_min * nominal_value,
+                  'p_max': flow.max[0] * nominal_value,
+                  'om': om * nominal_value,
+                  'fixed': (flow.fixed_costs or 0) * flow.nominal_value,
+                  'fuel_price': fuel.variable_costs[0] or 0,
+                  'fuel_curve': n.fuel_curve,
+                  'intercept': intercept,
+                  'slope': slope}]
+
+    return sorted(data, key=lambda g: g['p_max'] * g['units'])
+
+
+def diesel_reference_cost(demand, reserve_base, gens, sr_requirement=0.2, rm_requirement=0.4, weights=1):
+    """
+    Returns the operating costs of a feasible diesel-only schedule (no PV, no storage), or None if the generators
+    cannot cover demand and reserves in every hour. For every hour the cheapest unit combination that respects the
+    generator order is taken, loaded proportionally to its size.
+
+    :param demand:          demand per time step                                    np.array
+    :param reserve_base:    demand the reserves refer to per time step              np.array
+    :param gens:            result of generator_data()
+    :param weights:         length of the time steps in hours                       float or np.array
+    :return: cost                                                                   float or None
+    """
+    p_min = np.array([g['p_min'] for g in gens])
+    p_max = np.array([g['p_max'] for g in gens])
+
+    # gen_order_constraint only orders the two smallest single generators
+    single = [i for i, g in enumerate(gens) if not isinstance(g['node'], GeneratorBank)]
+
+    best = np.full(len(demand), np.inf)
+
+    for combination in itertools.product(*[range(g['units'] + 1) for g in gens]):
+        count = np.array(combination)
+        on = count > 0
+
+        if len(single) > 1 and on[single[1]] and not on[single[0]]:
+            continue
+        if not on.any():
+            continue
+
+        capacity = (count * p_max).sum()
+        load = np.clip(demand[:, None] * p_max[on] / capacity, p_min[on], p_max[on])
+        output = (load * count[on]).sum(axis=1)
+
+        cost = sum(c * (g['fuel_price'] * fuel_envelope(g['fuel_curve'], g['nominal_value'], load[:, i]) + g['om'])
+                   for i, (g, c) in enumerate([(g, c) for g, c in zip(gens, count) if c > 0]))
+
+        feasible = (output >= demand - 1e-9) & \
+                   (capacity - output >= sr_requirement * reserve_base) & \
+                   (output >= rm_requirement * reserve_base)
+        best = np.where(feasible, np.minimum(best, cost), best)
+
+    if np.isinf(best).any():
+        return None
+
+    return float((best * weights).sum())
+
+
+def tighten_bounds(m, feedin, cost, gen_set, sr_requirement=0.2, rm_requirement=0.4, timeincrement=None):
+    """
+    The function derives bounds for the investment and status variables of the model m built by
+    main.create_energysystem_model and sets them on the model.
+
+    :param m:               operational model                                       om.solph.model
+    :param feedin:          timeseries holding pv and demand_el values              pd.DataFrame
+    :param cost:            cost dict derived from get_cost_dict()                  dict
+    :param gen_set:         generators of the model                                 list
+    :param sr_requirement:  spinning reserve as fraction of the demand              float
+    :param rm_requirement:  rotating mass as fraction of the demand                 float
+    :param timeincrement:   length of the time steps in hours, hourly if None       list of int
+    :return: bounds         derived bounds and the number of fixed status variables dict
+    """
+    demand = feedin['demand_el'].values
+    reserve_base = feedin['demand_max'].values if 'demand_max' in feedin else demand
+    pv_feedin = feedin['PV'].values
+    weights = 1 if timeincrement is None else np.asarray(timeincrement)
+
+    gens = generator_data(gen_set)
+    p_max_total = sum(g['p_max'] * g['units'] for g in gens)
+
+    pv = m.es.groups.get('PV')
+    storage = m.es.groups.get('storage')
+
+    bounds = {'pv_max': None, 'storage_min': 0.0, 'storage_max': None, 'fixed_status': 0}
+
+    if pv is not None:
+        pv_flow = list(pv.outputs.values())[0]
+        bounds['pv_max'] = pv_flow.nominal_value
+    if storage is not None:
+        ratio = storage.nominal_output_capacity_ratio
+        bounds['storage_max'] = storage.nominal_capacity
+
+    # cost ratio bounds from the diesel-only reference schedule
+    c0 = diesel_reference_cost(demand, reserve_base, gens, sr_requirement, rm_requirement, weights)
+
+    if c0 is not None:
+        budget = c0
+
+        if pv is not None and isinstance(pv_flow.investment, Investment):
+            bounds['pv_max'] = budget / cost['pv']['epc']
+            m.InvestmentFlow.invest[pv, list(pv.outputs.keys())[0]].setub(bounds['pv_max'])
+
+        if storage is not None and isinstance(storage.investment, Investment):
+            bounds['storage_max'] = budget / cost['storage']['epc']
+
+        if pv is not None and storage is not None and \
+                isinstance(pv_flow.investment, Investment) and isinstance(storage.investment, Investment):
+            m.investment_budget = po.Constraint(
+                expr=m.InvestmentFlow.invest[pv, list(pv.outputs.keys())[0]] * cost['pv']['epc'] +
+                m.GenericInvestmentStorageBlock.invest[storage] * cost['storage']['epc'] <= budget)
+
+    # the generators alone cannot cover demand and reserves in these hours
+    if storage is not None:
+        night = pv_feedin <= 0
+        shortage = np.concatenate(([0],
+                                   sr_requirement * reserve_base - p_max_total,
+                                   rm_requirement * reserve_base - p_max_total,
+                                   demand[night] - p_max_total,
+                                   (demand[night] + sr_requirement * reserve_base[night] - p_max_total) / 2))
+        bounds['storage_min'] = shortage.max() / ratio
+
+    if storage is not None and isinstance(storage.investment, Investment):
+        invest = m.GenericInvestmentStorageBlock.invest[storage]
+        invest.setlb(bounds['storage_min'])
+        if bounds['storage_max'] is not None:
+            invest.setub(max(bounds['storage_max'], bounds['storage_min']))
+
+    # generators that have to run in an hour even with the largest PV and storage possible
+    if bounds['pv_max'] is not None and (storage is None or bounds['storage_max'] is not None):
+        storage_output = 0 if storage is None else ratio * bounds['storage_max']
+
+        # online capacity >= generator output + spinning reserve - storage contribution
+        residual = np.maximum(demand - pv_feedin * bounds['pv_max'] - storage_output, 0)
+        required = residual + sr_requirement * reserve_base - storage_output
+
+        for g in gens:
+            others = p_max_total - g['p_max'] * g['units']
+            forced = np.flatnonzero(others < required - 1e-6)
+
+            if isinstance(g['node'], GeneratorBank):
+                # minimum number of online units of the bank
+                count = np.minimum(np.ceil((required - others - 1e-6) / g['p_max']), g['units'])
+                for t in forced:
+                    m.GeneratorBankBlock.count[g['node'], t].setlb(int(count[t]))
+            else:
+                for t in forced:
+                    m.NonConvexFlow.status[g['node'], g['bus'], t].setlb(1)
+            bounds['fixed_status'] += len(forced)
+
+    logging.info('Presolve bounds: ' + str(bounds))
+
+    return bounds
@@ -0,0 +1,154 @@
+import ast
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+
+class ResultLog(object):
+    """
+    Append-only, columnar on-disk log of rolling horizon results.
+
+    Every column of the committed results of a window is appended as raw float64 values to its own file in path,
+    together with an int64 file of timestamps. A small state file records the number of complete rows, the last
+    complete window and whatever the caller needs to resume the run (e.g. storage capacity, generator status and the
+    objective so far). It is only rewritten after all columns of a window are on disk, so a run that dies in
+    between resumes from the last complete window.
+
+    Parameters:
+        path:   directory holding the log, it is created if it does not exist
+    """
+
+    STATE = 'state.json'
+    INDEX = 'timestamp.bin'
+
+    def __init__ (self, path):
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        if os.path.isfile(os.path.join(path, self.STATE)):
+            with open(os.path.join(path, self.STATE)) as file:
+                self.state = json.load(file)
+            self._truncate()
+        else:
+            self.state = {'window': -1, 'rows': 0, 'columns': None}
+            self._clear()
+
+    def _column_file (self, i):
+        return os.path.join(self.path, 'column_' + str(i) + '.bin')
+
+    def _files (self):
+        return [os.path.join(self.path, self.INDEX)] + \
+               [self._column_file(i) for i in range(len(self.state['columns'] or []))]
+
+    def _truncate (self):
+        # drop rows of a window that was written only partially
+        size = self.state['rows'] * 8
+        for filename in self._files():
+            if os.path.isfile(filename) and os.path.getsize(filename) > size:
+                with open(filename, 'r+b') as file:
+                    file.truncate(size)
+
+    def _clear (self):
+        # files of a run that died before its first window was complete
+        for filename in os.listdir(self.path):
+            if filename == self.INDEX or (filename.startswith('column_') and filename.endswith('.bin')):
+                os.remove(os.path.join(self.path, filename))
+
+    def _write_state (self):
+        filename = os.path.join(self.path, self.STATE)
+        with open(filename + '.tmp', 'w') as file:
+            json.dump(self.state, file)
+        os.replace(filename + '.tmp', filename)
+
+    @property
+    def last_window (self):
+        """Index of the last completely written window, -1 for an empty log"""
+        return self.state['window']
+
+    def append (self, frame, window, **state):
+        """
+        Appends the committed results of a window and stores state for resuming the run.
+
+        :param frame:   committed results with DatetimeIndex, e.g. results_postprocessing(..., time_horizon=CH)
+        :param window:  index of the window                                        int
+        :param state:   json serialisable values to be returned by resume()
+        """
+        columns = [str(c) for c in frame.columns]
+
+        if self.state['columns'] is None:
+            self.state['columns'] = columns
+            self.state['tz'] = None if frame.index.tz is None else str(frame.index.tz)
+        elif columns != self.state['columns']:
+            raise ValueError('Columns of window ' + str(window) + ' do not match the columns of the log')
+
+        with open(os.path.join(self.path, self.INDEX), 'ab') as file:
+            file.write(frame.index.values.astype('datetime64[ns]').astype('<i8').tobytes())
+
+        values = frame.values.astype('<f8')
+        for i in range(len(columns)):
+            with open(self._column_file(i), 'ab') as file:
+                file.write(np.ascontiguousarray(values[:, i]).tobytes())
+
+        self.state.update(state)
+        self.state['window'] = window
+        self.state['rows'] += len(frame)
+        self._write_state()
+
+    def resume (self):
+        """Returns the state stored with the last complete window"""
+        return {k: v for k, v in self.state.items() if k not in ('window', 'rows', 'columns', 'tz')}
+
+    def read (self, columns=None, date_from=None, date_to=None):
+        """
+        Stitches the logged windows together. Only the requested columns and rows are read from disk.
+
+        :param columns:     column names as written by str(column), all if None      list of str
+        :param date_from:   first timestamp to read                                 str or pd.Timestamp
+        :param date_to:     last timestamp to read                                  str or pd.Timestamp
+        :return: results                                                            pd.DataFrame
+        """
+        rows = self.state['rows']
+        names = self.state['columns'] or []
+        if columns is None:
+            columns = names
+
+        if rows == 0:
+            return pd.DataFrame(columns=columns)
+
+        stamps = np.memmap(os.path.join(self.path, self.INDEX), dtype='<i8', mode='r', shape=(rows,))
+        index = pd.DatetimeIndex(np.asarray(stamps).view('datetime64[ns]'))
+        if self.state.get('tz') is not None:
+            index = index.tz_localize('UTC').tz_convert(self.state['tz'])
+
+        start = 0 if date_from is None else index.searchsorted(pd.Timestamp(date_from))
+        stop = rows if date_to is None else index.searchsorted(pd.Timestamp(date_to), side='right')
+
+        data = {}
+        for column in columns:
+            values = np.memmap(self._column_file(names.index(column)), dtype='<f8', mode='r', shape=(rows,))
+            data[column] = np.array(values[start:stop])
+
+        return pd.DataFrame(data, index=index[start:stop], columns=columns)
+
+    def results (self, m, date_from=None, date_to=None):
+        """
+        Returns the logged results in the structure of oemof.outputlib.processing.results(), so that they can be
+        passed to cost_summary.get_lcoe(m, ...). m only provides the nodes, it has to be built with the cost dict of
+        the logged horizon, e.g. main.get_cost_dict(SH).
+        """
+        frame = self.read(date_from=date_from, date_to=date_to)
+        frame.index.name = 'timestep'
+
+        results = {}
+        for column in frame.columns:
+            (source, target), variable = ast.literal_eval(column)
+            key = (m.es.groups[source], None if target == 'None' else m.es.groups[target])
+
+            if key not in results:
+                results[key] = {'scalars': pd.Series(), 'sequences': pd.DataFrame(index=frame.index)}
+            results[key]['sequences'][variable] = frame[column]
+
+        return results
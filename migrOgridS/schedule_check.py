@@ -0,0 +1,206 @@
+"""
+Feasibility check of dispatch schedules without building the model.
+
+check_schedule() evaluates the operating rules of the model for all hours at once with NumPy: the energy balance of
+the AC and DC bus, the storage balance, capacity and power limits, the output limits of the generators, the
+generator order, spinning reserve and rotating mass (custom_constraints) and optionally the N-1 criterion. It
+returns the violation of every rule per hour, 0 where the rule is met. Schedules can come from the heuristic of
+dispatch.py, from cached results (schedule_from_results) or be candidate MIP starts:
+
+    gens = presolve.generator_data(gen_set)
+    schedule = dispatch.heuristic_dispatch(demand, pv, soc, cap_batt, gens)
+    schedule.update({'demand': demand, 'pv': pv})
+    violations = schedule_check.check_schedule(schedule, gens, storage_data(storage, cap_batt, soc),
+                                               sr_limit=0.2 * demand, rm_limit=0.4 * demand)
+    print(schedule_check.summary(violations))
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def _label(g):
+    return g['label'] if 'label' in g else g['node'].label
+
+
+def storage_data(storage, size=None, initial_capacity=None):
+    """
+    Collects the parameters of a GenericStorage for check_schedule().
+
+    :param storage:             storage                                                         GenericStorage
+    :param size:                capacity, e.g. the investment, storage.nominal_capacity if None  float
+    :param initial_capacity:    absolute capacity before the first hour, the relative
+                                initial_capacity of storage times size if None                  float
+    :return: storage parameters                                                                 dict
+    """
+    size = storage.nominal_capacity if size is None else size
+    if initial_capacity is None:
+        initial_capacity = storage.initial_capacity * size
+
+    return {'nominal_capacity': size,
+            'initial_capacity': initial_capacity,
+            'capacity_min': storage.capacity_min[0],
+            'capacity_max': storage.capacity_max[0],
+            'capacity_loss': storage.capacity_loss[0],
+            'inflow_conversion_factor': storage.inflow_conversion_factor[0],
+            'outflow_conversion_factor': storage.outflow_conversion_factor[0],
+            'input_ratio': storage.nominal_input_capacity_ratio,
+            'output_ratio': storage.nominal_output_capacity_ratio}
+
+
+def schedule_from_results(results, gens, storage='storage', inverter='Inv_pv'):
+    """
+    Returns the schedule of results in the structure of oemof.outputlib.processing.results, keyed by nodes or labels
+    like the results of fast_builder.FastModel.results(). The status of a generator bank is its online count, other
+    generators without status sequence count as online while they produce.
+    """
+    labels = [_label(g) for g in gens]
+    res = {}
+    counts = {}
+
+    def add(key, values):
+        res[key] = res.get(key, 0) + values
+
+    for (i, o), values in results.items():
+        sequences = values['sequences']
+        if o is None:
+            if str(i) == storage and 'capacity' in sequences:
+                res['soc'] = sequences['capacity'].values
+            elif str(i) in labels and 'count' in sequences:
+                counts[str(i)] = sequences['count'].values
+            continue
+        flow = sequences['flow'].values
+        if str(o) == 'demand':
+            add('demand', flow)
+        elif str(o) == 'excess':
+            add('excess', flow)
+        elif str(i) == 'PV':
+            add('pv', flow)
+        elif str(o) == storage:
+            res['storage_in'] = flow
+        elif str(i) == storage:
+            res['storage_out'] = flow
+        elif str(i) == inverter:
+            res['inverter'] = flow
+        elif str(i) in labels:
+            res[str(i)] = flow
+            if 'status' in sequences:
+                res[str(i) + '_status'] = sequences['status'].values
+
+    for label in labels:
+        if label in res and label + '_status' not in res:
+            res[label + '_status'] = counts[label] if label in counts else (res[label] > 0) * 1.0
+
+    return res
+
+
+def check_schedule(schedule, gens, storage=None, sr_limit=None, rm_limit=None, n1_limit=None, timeincrement=1,
+                   inverter_efficiency=1.0):
+    """
+    Evaluates the operating rules for every hour of a schedule.
+
+    :param schedule:    'demand', 'pv' and optionally 'excess' and 'inverter' (DC to AC flow), the output
+                        <label> and status or online count <label>_status of every generator, and
+                        'storage_in', 'storage_out' and the absolute capacity 'soc' if storage is given  dict or pd.DataFrame
+    :param gens:        generator parameters, see presolve.generator_data(), or dicts with label,
+                        units, p_min and p_max, sorted by their maximum output                           list of dict
+    :param storage:     storage parameters, see storage_data(), no storage if None                       dict
+    :param sr_limit:    spinning reserve requirement per hour, not checked if None                       np.array
+    :param rm_limit:    rotating mass requirement per hour, not checked if None                          np.array
+    :param n1_limit:    N-1 requirement per hour, not checked if None                                    np.array
+    :param timeincrement: length of the time steps in hours                                              float or np.array
+    :param inverter_efficiency: efficiency of the inverter, see main.add_inverter()                      float
+    :return: violation of every rule per hour, 0 if it is met                                            pd.DataFrame
+    """
+    def get(key, default=None):
+        if key not in schedule:
+            if default is None:
+                raise KeyError('The schedule holds no ' + key)
+            return default
+        return np.asarray(schedule[key], dtype=float)
+
+    demand = get('demand')
+    T = len(demand)
+    zeros = np.zeros(T)
+    w = np.broadcast_to(np.asarray(timeincrement, dtype=float), (T,))
+
+    flow = {_label(g): get(_label(g)) for g in gens}
+    status = {_label(g): get(_label(g) + '_status') for g in gens}
+    generation = sum(flow.values()) if gens else zeros
+
+    res = {}
+
+    # bus balances, without inverter flow the DC bus is balanced by definition
+    pv = get('pv')
+    charge, discharge = (get('storage_in'), get('storage_out')) if storage is not None else (zeros, zeros)
+    inverter = get('inverter', pv - charge + discharge)
+    res['balance_dc'] = np.abs(pv + discharge - charge - inverter)
+    res['balance_ac'] = np.abs(generation + inverter * inverter_efficiency - demand - get('excess', zeros))
+
+    # storage
+    if storage is not None:
+        size = storage['nominal_capacity']
+        soc = get('soc')
+        previous = np.concatenate(([storage['initial_capacity']], soc[:-1]))
+        expected = previous * (1 - storage['capacity_loss']) + \
+            w * (charge * storage['inflow_conversion_factor'] - discharge / storage['outflow_conversion_factor'])
+
+        res['storage_balance'] = np.abs(soc - expected)
+        res['storage_min'] = np.maximum(storage['capacity_min'] * size - soc, 0)
+        res['storage_max'] = np.maximum(soc - storage['capacity_max'] * size, 0)
+        res['storage_input'] = np.maximum(charge - storage['input_ratio'] * size, 0)
+        res['storage_output'] = np.maximum(discharge - storage['output_ratio'] * size, 0)
+        res['storage_negative'] = np.maximum(-charge, 0) + np.maximum(-discharge, 0)
+
+    # generators, the status of a generator bank is its online count
+    for g in gens:
+        label = _label(g)
+        res['gen_status_' + label] = np.abs(status[label] - np.clip(np.round(status[label]), 0, g.get('units', 1)))
+        res['gen_min_' + label] = np.maximum(status[label] * g['p_min'] - flow[label], 0)
+        res['gen_max_' + label] = np.maximum(flow[label] - status[label] * g['p_max'], 0)
+
+    single = [_label(g) for g in gens if g.get('units', 1) == 1]
+    if len(single) >= 2:
+        res['gen_order'] = np.maximum(status[single[1]] - status[single[0]], 0)
+
+    # reserves, see custom_constraints.reserve_violations
+    headroom = sum(status[_label(g)] * g['p_max'] for g in gens) - generation if gens else zeros
+    if storage is not None:
+        available = soc - size * storage['capacity_min']
+        l_storage = size * storage['output_ratio']
+        sr_u_storage = available * storage['output_ratio']
+        rm_u_storage = available * storage['outflow_conversion_factor']
+    else:
+        l_storage = sr_u_storage = rm_u_storage = 0
+
+    if sr_limit is not None:
+        sr_limit = np.asarray(sr_limit, dtype=float)
+        res['spinning_reserve_l'] = np.maximum(sr_limit - headroom - l_storage, 0)
+        res['spinning_reserve_u'] = np.maximum(sr_limit - headroom - sr_u_storage, 0)
+
+    if rm_limit is not None:
+        rm_limit = np.asarray(rm_limit, dtype=float)
+        res['rotating_mass_l'] = np.maximum(rm_limit - generation - l_storage, 0)
+        res['rotating_mass_u'] = np.maximum(rm_limit - generation - rm_u_storage, 0)
+
+    # N-1: the online capacity without one unit of a running generator covers the limit, see n1_constraint
+    if n1_limit is not None:
+        n1_limit = np.asarray(n1_limit, dtype=float)
+        online_capacity = sum(status[_label(g)] * g['p_max'] for g in gens)
+        for g in gens:
+            online = np.minimum(status[_label(g)], 1)
+            res['n1_' + _label(g)] = np.maximum(n1_limit * online - (online_capacity - online * g['p_max']), 0)
+
+    index = schedule.index if isinstance(schedule, pd.DataFrame) else None
+    return pd.DataFrame(res, index=index)
+
+
+def summary(violations, tol=1e-6):
+    """Returns the number of violated hours and the largest violation of every rule"""
+    violated = violations > tol
+    return pd.DataFrame({'hours': violated.sum(), 'max': violations.max()})
+
+
+def is_feasible(violations, tol=1e-6):
+    """Checks if a schedule meets all rules within tol"""
+    return bool((violations.values <= tol).all())
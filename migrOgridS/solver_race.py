@@ -0,0 +1,295 @@
+"""
+Solver racing: several solver and parameter configurations solve the same model in parallel processes.
+
+The model is exported once as MPS file with numeric names (model_export.py) and every configuration runs as its own
+solver process with the target gap and the deadline as its limits. The first configuration that stops before the
+deadline with a solution, i.e. within the target gap, wins and the others are terminated. If none finishes in time,
+the best solution written at the deadline wins. Every race is appended to a log, default_config() returns the
+configuration that won most often for a model class.
+
+The open-source solvers cbc, HiGHS and glpsol are raced if their executables are found, HiGHS through
+scipy.optimize.milp is always available:
+
+    results = main.solve_and_create_results(m, solver='race', gap=0.01)
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+import model_export
+from fast_builder import FastModel
+
+RACE_LOG = os.path.join('results', 'race_log.csv')
+
+# solver configurations, options are passed to the solver as they are
+CONFIGS = [{'name': 'cbc', 'solver': 'cbc', 'options': []},
+           {'name': 'cbc_feaspump', 'solver': 'cbc', 'options': ['-feas', 'on', '-heuristicsOnOff', 'on']},
+           {'name': 'cbc_nocuts', 'solver': 'cbc', 'options': ['-cuts', 'off']},
+           {'name': 'highs', 'solver': 'highs', 'options': {}},
+           {'name': 'highs_heuristic', 'solver': 'highs', 'options': {'mip_heuristic_effort': 0.3}},
+           {'name': 'glpk', 'solver': 'glpk', 'options': ['--cuts']},
+           {'name': 'scipy_highs', 'solver': 'scipy', 'options': {}},
+           {'name': 'scipy_highs_nopresolve', 'solver': 'scipy', 'options': {'presolve': False}}]
+
+EXECUTABLES = {'cbc': 'cbc', 'highs': 'highs', 'glpk': 'glpsol'}
+
+
+def available(config):
+    """Checks if the solver of a configuration can be run on this machine"""
+    if config['solver'] == 'scipy':
+        return True
+    return shutil.which(EXECUTABLES[config['solver']]) is not None
+
+
+def _command(config, model, solution, gap, time_limit, directory):
+    solver, options = config['solver'], config['options']
+
+    if solver == 'cbc':
+        return [shutil.which('cbc'), model, '-ratioGap', str(gap), '-seconds', str(time_limit), '-threads', '1'] + \
+               list(options) + ['-solve', '-solu', solution]
+
+    if solver == 'highs':
+        options_file = os.path.join(directory, config['name'] + '.opt')
+        with open(options_file, 'w') as f:
+            for key, value in dict({'mip_rel_gap': gap, 'time_limit': time_limit, 'threads': 1}, **options).items():
+                f.write(key + ' = ' + str(value).lower() + '\n')
+        return [shutil.which('highs'), '--model_file', model, '--options_file', options_file,
+                '--solution_file', solution]
+
+    if solver == 'glpk':
+        return [shutil.which('glpsol'), '--freemps', model, '--mipgap', str(gap), '--tmlim', str(int(time_limit)),
+                '-w', solution] + list(options)
+
+    # scipy: the worker of this module solves the saved matrix model
+    options_file = os.path.join(directory, config['name'] + '.json')
+    with open(options_file, 'w') as f:
+        json.dump(dict({'mip_rel_gap': gap, 'time_limit': time_limit}, **options), f)
+    return [sys.executable, os.path.abspath(__file__), '--scipy', model, options_file, solution]
+
+
+def read_solution(solver, filename, n_columns):
+    """
+    Reads the solution file of a solver, columns are named C<j> in the model file.
+
+    :return: x      column values, None if the file holds no feasible solution                  np.array or None
+    """
+    if not os.path.isfile(filename):
+        return None
+
+    if solver == 'scipy':
+        return np.load(filename)
+
+    x = np.zeros(n_columns)
+
+    with open(filename) as f:
+        lines = f.read().splitlines()
+
+    if solver == 'cbc':
+        # e.g. "Optimal - objective value 6709.92" followed by "index name value reduced cost"
+        if not lines or lines[0].startswith(('Infeasible', 'Integer infeasible', 'Unbounded')) or \
+                'objective value' not in lines[0]:
+            return None
+        for line in lines[1:]:
+            fields = line.replace('**', ' ').split()
+            if len(fields) >= 3 and fields[1].startswith('C'):
+                x[int(fields[1][1:])] = float(fields[2])
+        return x
+
+    if solver == 'highs':
+        if '# Primal solution values' not in lines:
+            return None
+        i = lines.index('# Primal solution values')
+        if lines[i + 1].strip() != 'Feasible':
+            return None
+        i = next(k for k in range(i, len(lines)) if lines[k].startswith('# Columns'))
+        for line in lines[i + 1:]:
+            if line.startswith('#'):
+                break
+            name, value = line.split()[:2]
+            x[int(name[1:])] = float(value)
+        return x
+
+    # glpk raw format: "s mip rows columns status objective", "j column value"
+    status = next((line.split() for line in lines if line.startswith('s ')), None)
+    if status is None or status[4] not in ('o', 'f'):
+        return None
+    for line in lines:
+        if line.startswith('j '):
+            fields = line.split()
+            x[int(fields[1]) - 1] = float(fields[2])
+    return x
+
+
+def race(m, configs=None, gap=0.01, deadline=600, cpus=None, model_class=None, log=RACE_LOG, grace=10):
+    """
+    Races solver configurations on the model m and keeps the solution of the winner.
+
+    :param m:           matrix model or pyomo model of main.create_energysystem_model, the
+                        solution is loaded into the pyomo model                                 FastModel or model
+    :param configs:     configurations to race, CONFIGS if None, unavailable ones are skipped    list of dict
+    :param gap:         target gap                                                              float
+    :param deadline:    seconds after which the best solution found wins                        float
+    :param cpus:        CPU budget, one process per configuration, os.cpu_count() if None       int
+    :param model_class: name of the model class in the log, e.g. 'investment_8760'               str
+    :param log:         csv file the race is appended to, no log if None                        str
+    :param grace:       seconds the solvers get to write their solution at the deadline         float
+    :return: fast       matrix model holding the winning solution                               FastModel
+             report     winner and result of every configuration                                dict
+    """
+    if isinstance(m, FastModel):
+        fast, pm = m, None
+    else:
+        reserve = m.reserve
+        fast = FastModel.from_energysystem(m.es, reserve['groups'], reserve['storage'], reserve['sr_limit'],
+                                           reserve['rm_limit'], [m.timeincrement[t] for t in m.TIMESTEPS])
+        pm = m
+
+    configs = [c for c in (CONFIGS if configs is None else configs) if available(c)]
+    budget = cpus or os.cpu_count() or 1
+    if len(configs) > budget:
+        logging.info('Racing ' + str(budget) + ' of ' + str(len(configs)) + ' configurations within the CPU budget')
+        configs = configs[:budget]
+    if not configs:
+        raise RuntimeError('No solver available for the race')
+
+    directory = tempfile.mkdtemp(prefix='race_')
+    try:
+        files = {}
+        if any(c['solver'] != 'scipy' for c in configs):
+            files['mps'] = os.path.join(directory, 'model.mps')
+            model_export.write_mps(files['mps'], fast.c, fast.matrix(), fast.lb, fast.ub, fast.row_lb, fast.row_ub,
+                                   fast.integrality, constant=fast.constant)
+        if any(c['solver'] == 'scipy' for c in configs):
+            files['scipy'] = os.path.join(directory, 'model.pkl')
+            fast.save(files['scipy'])
+
+        start = time.time()
+        processes = {}
+        for config in configs:
+            model = files['scipy' if config['solver'] == 'scipy' else 'mps']
+            solution = os.path.join(directory, config['name'] + '.sol')
+            output = open(os.path.join(directory, config['name'] + '.log'), 'w')
+            command = _command(config, model, solution, gap, deadline, directory)
+            processes[config['name']] = (config, solution, output,
+                                         subprocess.Popen(command, stdout=output, stderr=subprocess.STDOUT,
+                                                          cwd=os.path.dirname(os.path.abspath(__file__))))
+
+        results = {}
+        winner = None
+
+        while processes and winner is None:
+            elapsed = time.time() - start
+            for name, (config, solution, output, process) in list(processes.items()):
+                if process.poll() is None:
+                    continue
+                output.close()
+                del processes[name]
+
+                x = read_solution(config['solver'], solution, fast.n_columns)
+                objective = None if x is None else float(fast.c.dot(x)) + fast.constant
+                in_time = elapsed < deadline
+                results[name] = {'time': elapsed, 'objective': objective,
+                                 'status': 'failed' if x is None else 'target' if in_time else 'deadline', 'x': x}
+
+                if x is not None and in_time:
+                    winner = name
+                    break
+
+            if elapsed > deadline + grace:
+                break
+            time.sleep(0.05)
+
+        for name, (config, solution, output, process) in processes.items():
+            process.kill()
+            process.wait()
+            output.close()
+            results.setdefault(name, {'time': time.time() - start, 'objective': None, 'status': 'terminated',
+                                      'x': None})
+
+        if winner is None:
+            solved = [name for name in results if results[name]['x'] is not None]
+            if not solved:
+                raise RuntimeError('No configuration found a solution within the deadline')
+            winner = min(solved, key=lambda name: results[name]['objective'])
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    fast.x = results[winner]['x']
+    if pm is not None:
+        fast.load_into(pm)
+
+    report = {'winner': winner, 'status': results[winner]['status'], 'time': results[winner]['time'],
+              'objective': results[winner]['objective'],
+              'results': {name: {k: v for k, v in r.items() if k != 'x'} for name, r in results.items()}}
+
+    logging.info('Race won by ' + winner + ' (' + report['status'] + ') in ' + str(round(report['time'], 2)) + ' s')
+
+    if log is not None:
+        _log_race(log, model_class, report)
+
+    return fast, report
+
+
+def _log_race(log, model_class, report):
+    rows = pd.DataFrame([{'time_stamp': pd.Timestamp.now().isoformat(), 'model_class': model_class,
+                          'config': name, 'status': r['status'], 'time': r['time'], 'objective': r['objective'],
+                          'winner': name == report['winner']} for name, r in report['results'].items()])
+
+    directory = os.path.dirname(log)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory, exist_ok=True)
+    rows.to_csv(log, mode='a', index=False, header=not os.path.isfile(log))
+
+
+def race_winners(log=RACE_LOG):
+    """Returns how often every configuration won per model class"""
+    races = pd.read_csv(log)
+    return races[races['winner']].groupby(['model_class', 'config']).size().unstack(fill_value=0)
+
+
+def default_config(model_class, log=RACE_LOG, configs=None):
+    """
+    Returns the configuration that won most races of model_class, None if there is no race of the class in the log.
+    """
+    if not os.path.isfile(log):
+        return None
+    winners = race_winners(log)
+    if model_class not in winners.index:
+        return None
+    name = winners.loc[model_class].idxmax()
+    return next((c for c in (CONFIGS if configs is None else configs) if c['name'] == name), None)
+
+
+def _solve_scipy(model, options_file, solution):
+    # worker of the scipy configurations
+    with open(options_file) as f:
+        options = json.load(f)
+
+    fast = FastModel.load(model)
+    presolve = options.pop('presolve', True)
+
+    from scipy.optimize import Bounds, LinearConstraint, milp
+    res = milp(fast.c, integrality=fast.integrality, bounds=Bounds(fast.lb, fast.ub),
+               constraints=LinearConstraint(fast.matrix(), fast.row_lb, fast.row_ub),
+               options=dict(options, presolve=presolve))
+    if res.x is not None:
+        # np.save appends .npy to names without it
+        with open(solution, 'wb') as f:
+            np.save(f, res.x)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Worker of the scipy race configurations')
+    parser.add_argument('--scipy', nargs=3, metavar=('MODEL', 'OPTIONS', 'SOLUTION'), required=True)
+    args = parser.parse_args()
+    _solve_scipy(*args.scipy)
@@ -1,60 +1,341 @@
+import logging
+import multiprocessing
+import os
+
 import pandas as pd
 from oemof.outputlib import views,processing
+from oemof.solph import components
 import cost_summary as lcoe
-import main
+import main_RH as main
+import model_template
+from result_log import ResultLog
+from time_resolution import resolution_increments, aggregate_timeseries
+
+
+def window_indices(n, SH, PH, CH):
+    """
+    The function returns the start and stop positions of all rolling horizon windows. Window k covers the
+    prediction horizon [k * CH, k * CH + PH) of which only the first CH hours are committed.
+
+    :param n:   length of the timeseries                    int
+    :param SH:  simulation horizon in hours                 int
+    :param PH:  prediction horizon in hours                 int
+    :param CH:  control horizon in hours                    int
+    :return: starts, stops                                  list of int
+    """
+    if CH > PH:
+        raise ValueError( 'The control horizon CH must not exceed the prediction horizon PH' )
+
+    starts = [k * CH for k in range( int( SH / CH ) )]
+    stops = [min( start + PH, n ) for start in starts]
+
+    return starts, stops
+
+
+def window(timeseries, start, stop):
+    """
+    Returns the rows start:stop of timeseries as a DataFrame that shares its data with timeseries instead of copying
+    it, which timeseries.iloc does for every window.
+    """
+    return pd.DataFrame( timeseries.values[start:stop], index=timeseries.index[start:stop],
+                         columns=timeseries.columns, copy=False )
+
+
+def aggregate_window(feedin_RH, resolution, CH):
+    """
+    Aggregates a window to the variable resolution given by resolution, see time_resolution.resolution_increments().
+    The committed CH hours have to stay hourly.
+
+    :return: feedin_RH, timeincrement   unchanged window and None if resolution is None
+    """
+    if resolution is None:
+        return feedin_RH, None
+
+    timeincrement = resolution_increments( len( feedin_RH ), resolution )
+    if any( increment != 1 for increment in timeincrement[:CH] ):
+        raise ValueError( 'The control horizon CH has to lie within the hourly part of the resolution' )
+
+    return aggregate_timeseries( feedin_RH, timeincrement ), timeincrement
+
+
+def committed_objective(m, results, CH):
+    """
+    The function returns the costs of the first CH time steps of a solved window, i.e. the committed part of the
+    objective. Fixed costs are taken as they are and therefore have to be prorated by CH in the cost dict.
+
+    :param m:       operational model                               om.solph.model
+    :param results: results of the window                           dict
+    :param CH:      control horizon in hours                        int
+    :return: objective                                              float
+    """
+    objective = 0.0
 
+    for (i, o), flow in m.flows.items():
+        sequences = results[(i, o)]['sequences'].iloc[:CH]
 
-def rolling_horizon(PV, Storage, SH=8760,PH=120, CH=120,):
-    iter = 0
-    start = 0
-    stop = PH
+        if flow.variable_costs[0] is not None:
+            objective += sum( sequences['flow'].iloc[t] * flow.variable_costs[t] for t in range( len( sequences ) ) )
+
+        if flow.nonconvex is not None and getattr( flow.nonconvex, 'om_costs', None ) is not None:
+            objective += sequences['status'].sum() * flow.nonconvex.om_costs * flow.nominal_value
+
+        if flow.fixed_costs is not None and flow.nominal_value is not None:
+            objective += flow.fixed_costs * flow.nominal_value
+
+    for node in m.es.nodes:
+        if isinstance( node, components.GenericStorage ) and node.fixed_costs is not None:
+            objective += node.fixed_costs * node.nominal_capacity
+
+    return objective
+
+
+def final_state(results, gen_set, CH):
+    """
+    Returns the storage capacity and the generator status at the end of the control horizon, which are the initial
+    conditions of the next window. A last window shorter than CH ends with its last time step.
+    """
+    capacity = views.node( results, 'storage' )['sequences'][(('storage', 'None'), 'capacity')]
+    last = min( CH, len( capacity ) ) - 1
+    capacity = capacity.iloc[last]
+
+    gen_status = {}
+    for n in gen_set:
+        # generators or their labels
+        label = getattr( n, 'label', n )
+        sequences = views.node( results, label )['sequences']
+        gen_status[label] = int( round( sequences[((label, 'electricity'), 'status')].iloc[last] ) )
+
+    return capacity, gen_status
+
+
+def rolling_horizon(PV, Storage, SH=8760,PH=120, CH=120, log_path=None, resolution=None, file='data/timeseries.csv',
+                    progress=None, cost=None, template=False, threads=None):
+    """
+    Receding horizon simulation of the operation. Every window looks PH hours ahead, but only its first CH hours are
+    committed. The storage capacity at the end of the committed part is the initial condition of the next window and
+    the annuities are prorated by CH. Only the storage state is carried over between windows: the generators have
+    neither startup costs nor minimum up and down times (see main_RH.create_energysystem()), so their status at the
+    end of a window does not constrain the next one. It is only recorded in the log for information.
+
+    :param PV:      installed PV capacity                               float
+    :param Storage: installed storage capacity                          float
+    :param SH:      simulation horizon in hours                         int
+    :param PH:      prediction horizon in hours                         int
+    :param CH:      control horizon in hours, CH <= PH                  int
+    :param log_path: directory of a ResultLog the committed results of
+                    every window are appended to. An existing log is
+                    resumed after its last complete window              str or None
+    :param resolution: (hours, step length) pairs of a variable
+                    resolution look-ahead, e.g. ((24, 1), (72, 4),
+                    (None, 24)), hourly if None                         tuple or None
+    :param file:    timeseries holding pv and demand_el values          str
+    :param progress: called with (window, number of windows, model)
+                    after every solved window                           callable or None
+    :param cost:    cost dict of one window, get_cost_dict(CH) if None  dict or None
+    :param template: solve the windows with matrix model templates of
+                    model_template.py instead of building pyomo models  boolean
+    :param threads: number of solver threads, all cores if None         int or None
+    :return: objective  costs of the committed hours                    float
+    """
     mode = 'simulation'
     initial_capacity=0.5
+    gen_status = None
 
     path = 'results'
     filepath = '/diesel_pv_batt_PH120_P1_B1'
 
     components_list = ['demand', 'PV', 'storage', 'pp_oil_1', 'pp_oil_2', 'pp_oil_3', 'excess']
 
-    results_list = []
-    economic_list = []
+    if cost is None:
+        cost = main.get_cost_dict( CH )
+    timeseries = main.get_timeseries( file )
 
-    cost = main.get_cost_dict( PH )
-    file = 'data/timeseries.csv'
+    starts, stops = window_indices( len( timeseries ), SH, PH, CH )
+    objective=0.0
+    first = 0
 
-    timeseries = pd.read_csv( file, sep=';' )
-    timeseries.set_index( pd.DatetimeIndex( timeseries['timestamp'], freq='H' ), inplace=True )
-    timeseries.drop( labels='timestamp', axis=1, inplace=True )
-    timeseries[timeseries['PV'] > 1] = 1
+    log = None
+    if log_path is not None:
+        log = ResultLog( log_path )
+        if log.last_window >= 0:
+            state = log.resume()
+            initial_capacity = state['initial_capacity']
+            gen_status = state['gen_status']
+            objective = state['objective']
+            first = log.last_window + 1
+            logging.info( 'Resuming rolling horizon after window ' + str( first ) )
 
-    itermax = int( (SH / CH) - 1 )
-    objective=0.0
+    for iter in range( first, len( starts ) ):
+
+        feedin_RH, timeincrement = aggregate_window( window( timeseries, starts[iter], stops[iter] ), resolution, CH )
 
-    while iter <= itermax:
+        print( str( iter + 1 ) + '/' + str( len( starts ) ) )
+
+        if template:
+            m = model_template.get_template( len( feedin_RH ), cost, mode='rolling_horizon', timeincrement=timeincrement,
+                                             cap_pv=PV, cap_batt=Storage, iterstatus=(iter == 0) )
+            model_template.bind_timeseries( m, feedin_RH, initial_capacity )
+            m.solve()
+            results_el = m.results()
+            objective += m.objective( hours=CH )
+            gen_set = model_template.generator_labels( m )
 
-        if iter == 0:
-            status = True
         else:
-            status = False
+            m, gen_set = main.create_optimization_model( mode, feedin_RH, initial_capacity, cost, PV, Storage,
+                                                         iterstatus=(iter == 0), gen_status=gen_status,
+                                                         timeincrement=timeincrement )
+
+            results_el = main.solve_and_create_results( m, threads=threads )
+            objective += committed_objective( m, results_el, CH )
 
-        feedin_RH = timeseries.iloc[start:stop]
+        initial_capacity, gen_status = final_state( results_el, gen_set, CH )
 
-        print( str( iter + 1 ) + '/' + str( itermax + 1 ) )
+        if log is not None:
+            log.append( main.results_postprocessing( results_el, components_list, time_horizon=CH ), iter,
+                        initial_capacity=float( initial_capacity ), gen_status=gen_status, objective=objective )
 
-        m = main.create_optimization_model( mode, feedin_RH, initial_capacity,cost,PV, Storage,  iterstatus=status)[0]
+        if progress is not None:
+            progress( iter + 1, len( starts ), m )
 
-        results_el = main.solve_and_create_results( m )
-        objective+=processing.meta_results(m)['objective']
+    return objective
 
-        initial_capacity = views.node( results_el, 'storage' )['sequences'][(('storage', 'None'), 'capacity')][CH - 1]
 
-        start += CH
-        stop += CH
+def heuristic_soc(feedin, cap_pv, cap_batt, initial_capacity=0.5, input_ratio=0.546, output_ratio=0.546,
+                  inflow_efficiency=0.92, outflow_efficiency=0.92, capacity_min=0.5, capacity_max=1):
+    """
+    The function estimates the battery state of charge with a greedy rule-based dispatch: PV surplus charges the
+    battery, deficits are discharged down to capacity_min and the rest is left to the generators. The storage
+    defaults equal the parameters of main_RH.create_optimization_model.
 
-        iter += 1
+    :param feedin:              timeseries holding pv and demand_el values              pd.DataFrame
+    :param cap_pv:              installed PV capacity                                   float
+    :param cap_batt:            installed storage capacity                              float
+    :param initial_capacity:    initial SOC of the battery takes                        float values from 0-1
+    :return: soc                absolute storage capacity at the end of every hour      pd.Series
+    """
+    net_load = feedin['PV'].values * cap_pv - feedin['demand_el'].values
 
+    soc_min = capacity_min * cap_batt
+    soc_max = capacity_max * cap_batt
+    soc = initial_capacity * cap_batt
+    res = []
+
+    for net in net_load:
+        if net > 0:
+            soc += min(net, input_ratio * cap_batt, (soc_max - soc) / inflow_efficiency) * inflow_efficiency
+        else:
+            soc -= min(-net, output_ratio * cap_batt, max(soc - soc_min, 0) * outflow_efficiency) / outflow_efficiency
+        res += [soc]
+
+    return pd.Series(res, index=feedin.index)
+
+
+def _solve_window(args):
+    """
+    Worker of rolling_horizon_parallel: solves one window and returns its committed objective and the state at the
+    end of the control horizon.
+    """
+    feedin_RH, initial_capacity, status, gen_status, cost, PV, Storage, CH, resolution, threads = args
+
+    feedin_RH, timeincrement = aggregate_window( feedin_RH, resolution, CH )
+
+    m, gen_set = main.create_optimization_model( 'simulation', feedin_RH, initial_capacity, cost, PV, Storage,
+                                                 iterstatus=status, gen_status=gen_status,
+                                                 timeincrement=timeincrement )
+
+    results_el = main.solve_and_create_results( m, threads=threads )
+    capacity, gen_status = final_state( results_el, gen_set, CH )
+
+    return committed_objective( m, results_el, CH ), capacity, gen_status
+
+
+def rolling_horizon_parallel(PV, Storage, SH=8760, PH=120, CH=120, soc_estimate=None, tol=1.0, max_passes=10,
+                             processes=None, resolution=None, file='data/timeseries.csv', cost=None):
+    """
+    Time-parallel variant of rolling_horizon. All windows are solved concurrently from estimated initial storage
+    capacities. Afterwards only the windows whose initial capacity differs from the final capacity of the preceding
+    window by more than tol are re-solved, until all window boundaries are consistent.
+
+    :param PV:              installed PV capacity                                       float
+    :param Storage:         installed storage capacity                                  float
+    :param SH:              simulation horizon in hours                                 int
+    :param PH:              prediction horizon in hours                                 int
+    :param CH:              control horizon in hours                                    int
+    :param soc_estimate:    absolute storage capacity estimate for every hour,
+                            heuristic_soc() is used if None                             pd.Series or None
+    :param tol:             allowed boundary mismatch of the storage capacity [kWh]     float
+    :param max_passes:      maximum number of parallel sweeps                           int
+    :param processes:       number of worker processes, os.cpu_count() if None, each
+                            solves with an equal share of the cores as solver threads   int or None
+    :param resolution:      variable resolution look-ahead, see rolling_horizon()       tuple or None
+    :param file:            timeseries holding pv and demand_el values                  str
+    :param cost:            cost dict of one window, get_cost_dict(CH) if None          dict or None
+    :return: objective      costs of the committed hours of all windows                 float
+             passes         number of parallel sweeps used (1 = no reconciliation)      int
+    """
+    initial_capacity = 0.5
+
+    if cost is None:
+        cost = main.get_cost_dict( CH )
+    timeseries = main.get_timeseries( file )
+
+    starts, stops = window_indices( len( timeseries ), SH, PH, CH )
+    n_windows = len( starts )
+
+    if soc_estimate is None:
+        soc_estimate = heuristic_soc( timeseries.iloc[:SH], PV, Storage, initial_capacity )
+
+    # the first window starts from the relative initial capacity, all others from absolute capacities
+    initial = [initial_capacity] + [soc_estimate.iloc[start - 1] for start in starts[1:]]
+    objectives = [0.0] * n_windows
+    final = [None] * n_windows
+
+    # generator status is not estimated, a window takes the status of its predecessor once that one is solved. It is
+    # only informational (see rolling_horizon), so status mismatches at the window boundaries are not reconciled
+    initial_status = [None] * n_windows
+    final_status = [None] * n_windows
+
+    pending = list( range( n_windows ) )
+    passes = 0
+
+    # every worker gets an equal share of the cores for its solver
+    cpus = os.cpu_count() or 1
+    processes = processes or cpus
+    threads = max( 1, cpus // processes )
+
+    pool = multiprocessing.Pool( processes )
+
+    try:
+        while pending and passes < max_passes:
+            passes += 1
+            logging.info( 'Pass ' + str( passes ) + ': solving ' + str( len( pending ) ) + '/' + str( n_windows ) +
+                          ' windows' )
+
+            args = [(window( timeseries, starts[k], stops[k] ), initial[k], k == 0, initial_status[k], cost, PV,
+                     Storage, CH, resolution, threads) for k in pending]
+
+            for k, (objective, capacity, gen_status) in zip( pending, pool.map( _solve_window, args ) ):
+                objectives[k] = objective
+                final[k] = capacity
+                final_status[k] = gen_status
+
+            pending = []
+            for k in range( 1, n_windows ):
+                if abs( final[k - 1] - initial[k] ) > tol:
+                    initial[k] = final[k - 1]
+                    initial_status[k] = final_status[k - 1]
+                    pending += [k]
+    finally:
+        pool.close()
+        pool.join()
+
+    if pending:
+        logging.warning( str( len( pending ) ) + ' windows still inconsistent after ' + str( passes ) + ' passes' )
+
+    logging.info( 'Rolling horizon reconciled in ' + str( passes ) + ' passes' )
+
+    return sum( objectives ), passes
 
-    return objective
 
 if __name__ == '__main__':
     PV=250
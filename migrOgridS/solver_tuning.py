@@ -0,0 +1,276 @@
+"""
+Solver parameter tuning over a corpus of microgrid models.
+
+The corpus holds matrix models of fast_builder.py of different horizons, modes, system sizes and weeks of the year,
+either generated by build_corpus() or collected from real runs by add_to_corpus(). tune() searches solver
+configurations, i.e. the configurations of solver_race.py and random samples of the parameters in SPACE, with
+successive halving: all candidates solve the smallest models of the corpus in parallel, the better half continues on
+the next larger models and so on. Candidates are scored on their time to the target gap, runs that do not reach it
+within the time limit count twice the time limit. The best candidate is saved as named profile:
+
+    solver_tuning.build_corpus()
+    solver_tuning.tune('results/corpus', 'nightly', gap=0.01)
+    results = main.solve_and_create_results(m, profile='nightly')
+"""
+
+import glob
+import hashlib
+import json
+import logging
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import model_template
+import solver_race
+from fast_builder import FastModel
+
+CORPUS = os.path.join('results', 'corpus')
+PROFILES = os.path.join('results', 'profiles')
+
+# parameters of the solvers, cbc options are passed as '-name value', glpsol values are flags
+SPACE = {'cbc': {'-cuts': ['on', 'off', 'root'],
+                 '-heuristicsOnOff': ['on', 'off'],
+                 '-preprocess': ['on', 'off', 'sos'],
+                 '-feas': ['on', 'off'],
+                 '-strong': [0, 5, 10]},
+         'highs': {'presolve': ['on', 'off'],
+                   'mip_heuristic_effort': [0.02, 0.05, 0.2, 0.5],
+                   'mip_detect_symmetry': [True, False],
+                   'mip_lp_age_limit': [5, 10, 20]},
+         'glpk': {'branching': ['--first', '--last', '--mostf', '--drtom', '--pcost'],
+                  'backtracking': ['--dfs', '--bfs', '--bestp', '--bestb'],
+                  'cuts': ['', '--cuts'],
+                  'presolve': ['', '--intopt']},
+         'scipy': {'presolve': [True, False]}}
+
+
+def build_corpus(directory=CORPUS, horizons=(168, 720), modes=('simulation', 'investment'), weeks=(0, 26),
+                 sizes=(), file='data/timeseries.csv', gen_banks=None):
+    """
+    Generates the corpus: one model per mode, horizon and start week, and one rolling horizon window per
+    horizon, start week and size.
+
+    :param horizons:    number of time steps                                                    list of int
+    :param modes:       'simulation' and/or 'investment' models of main.py                      list of str
+    :param weeks:       start weeks of the timeseries                                           list of int
+    :param sizes:       installed PV and storage capacities of rolling horizon windows          list of tuple
+    :param gen_banks:   generator banks, see main.create_energysystem()                         list or None
+    :return: files of the corpus                                                                list of str
+    """
+    import main
+
+    timeseries = main.get_timeseries(file)
+    jobs = [(mode, {}) for mode in modes] + \
+           [('rolling_horizon', {'cap_pv': cap_pv, 'cap_batt': cap_batt}) for cap_pv, cap_batt in sizes]
+
+    files = []
+    for hours in horizons:
+        cost = main.get_cost_dict(hours)
+        for mode, kwargs in jobs:
+            if mode != 'rolling_horizon':
+                kwargs = dict(kwargs, gen_banks=gen_banks)
+            m = model_template.compile_template(hours, cost, mode, **kwargs)
+            for week in weeks:
+                feedin = timeseries.iloc[week * 168:week * 168 + hours]
+                if len(feedin) < hours:
+                    continue
+                model_template.bind_timeseries(m, feedin, 0.5)
+
+                name = '_'.join([mode, str(hours), 'w' + str(week)] +
+                                [str(kwargs[k]) for k in ('cap_pv', 'cap_batt') if k in kwargs])
+                files.append(os.path.join(directory, name + '.pkl'))
+                m.save(files[-1])
+
+    logging.info('Built corpus of ' + str(len(files)) + ' models in ' + directory)
+    return files
+
+
+def add_to_corpus(m, name, directory=CORPUS):
+    """Adds the pyomo model m of main.create_energysystem_model to the corpus"""
+    reserve = m.reserve
+    fast = FastModel.from_energysystem(m.es, reserve['groups'], reserve['storage'], reserve['sr_limit'],
+                                       reserve['rm_limit'], [m.timeincrement[t] for t in m.TIMESTEPS])
+    filename = os.path.join(directory, name + '.pkl')
+    fast.save(filename)
+    return filename
+
+
+def read_corpus(directory=CORPUS):
+    """Returns the files of the corpus, ordered from the smallest to the largest model"""
+    models = [(FastModel.load(f), f) for f in glob.glob(os.path.join(directory, '*.pkl'))]
+    return [f for m, f in sorted(models, key=lambda item: (item[0].n_columns, item[1]))]
+
+
+def _options(solver, choice):
+    if solver == 'cbc':
+        return [token for key in sorted(choice) for token in (key, str(choice[key]))]
+    if solver == 'glpk':
+        return [choice[key] for key in sorted(choice) if choice[key]]
+    return dict(choice)
+
+
+def candidates(samples=16, seed=0, solvers=None):
+    """
+    Returns the configurations of solver_race.CONFIGS and samples random configurations drawn from SPACE, for the
+    solvers available on this machine.
+
+    :param solvers: solvers to sample, all of SPACE if None                                     list of str
+    """
+    configs = [c for c in solver_race.CONFIGS if solver_race.available(c) and
+               (solvers is None or c['solver'] in solvers)]
+    sampled = [s for s in (solvers or sorted(SPACE)) if solver_race.available({'solver': s})]
+
+    rng = random.Random(seed)
+    seen = set(json.dumps([c['solver'], c['options']], sort_keys=True) for c in configs)
+    drawn = 0
+    for _ in range(samples * 10):
+        if drawn >= samples or not sampled:
+            break
+        solver = rng.choice(sampled)
+        choice = {key: rng.choice(values) for key, values in SPACE[solver].items()}
+        options = _options(solver, choice)
+        key = json.dumps([solver, options], sort_keys=True)
+        if key in seen:
+            continue
+        seen.add(key)
+        configs.append({'name': 'tuned_' + solver + '_' + hashlib.sha1(key.encode()).hexdigest()[:8],
+                        'solver': solver, 'options': options})
+        drawn += 1
+    return configs
+
+
+def evaluate(config, model, gap=0.01, time_limit=300):
+    """
+    Solves the corpus model file model with config.
+
+    :return: time to the target gap, 2 * time_limit if it was not reached                   float
+    """
+    fast = FastModel.load(model)
+    try:
+        report = solver_race.race(fast, configs=[config], gap=gap, deadline=time_limit, cpus=1, log=None)[1]
+    except RuntimeError:
+        return 2.0 * time_limit
+    return report['time'] if report['status'] == 'target' else 2.0 * time_limit
+
+
+def score(times, shift=1.0):
+    """Shifted geometric mean of solve times, which weighs relative differences of small and large models alike"""
+    return float(np.exp(np.mean(np.log(np.asarray(times) + shift))) - shift)
+
+
+def tune(corpus, name, gap=0.01, time_limit=300, configs=None, samples=16, rungs=3, workers=None, seed=0,
+         directory=PROFILES):
+    """
+    Searches the configuration with the shortest time to the target gap on the corpus and saves it as profile name.
+
+    :param corpus:      corpus directory or list of model files                                 str or list
+    :param gap:         target gap                                                              float
+    :param time_limit:  seconds per run                                                         float
+    :param configs:     candidates, candidates(samples, seed) if None                           list of dict
+    :param rungs:       number of corpus parts of successive halving, from small to large       int
+    :param workers:     parallel runs, os.cpu_count() if None                                   int
+    :return: profile                                                                            dict
+    """
+    models = read_corpus(corpus) if isinstance(corpus, str) else list(corpus)
+    if not models:
+        raise ValueError('The corpus is empty')
+    configs = candidates(samples, seed) if configs is None else configs
+    baseline = configs[0]['name']
+
+    parts = [list(part) for part in np.array_split(models, min(rungs, len(models)))]
+    times = {c['name']: {} for c in configs}
+    alive = list(configs)
+
+    start = time.time()
+    with ThreadPoolExecutor(workers or os.cpu_count() or 1) as pool:
+        for k, part in enumerate(parts):
+            jobs = {(c['name'], model): pool.submit(evaluate, c, model, gap, time_limit) for c in alive for model in part}
+            for (config, model), job in jobs.items():
+                times[config][model] = job.result()
+
+            ranking = sorted(alive, key=lambda c: score(list(times[c['name']].values())))
+            logging.info('Tuning rung ' + str(k + 1) + ' of ' + str(len(parts)) + ': ' + str(len(alive)) +
+                         ' candidates on ' + str(len(part)) + ' models, best ' + ranking[0]['name'])
+            if k < len(parts) - 1:
+                alive = ranking[:max(1, (len(ranking) + 1) // 2)]
+            else:
+                alive = ranking
+
+    best = alive[0]
+    # the baseline may have been dropped, it is compared on the models it solved
+    compared = list(times[baseline])
+    profile = {'name': name,
+               'config': best,
+               'gap': gap,
+               'time_limit': time_limit,
+               'score': score([times[best['name']][m] for m in models]),
+               'baseline': baseline,
+               'speedup': score([times[baseline][m] for m in compared]) /
+               max(score([times[best['name']][m] for m in compared]), 1e-9),
+               'corpus': [os.path.basename(m) for m in models],
+               'times': {c: {os.path.basename(m): t for m, t in v.items()} for c, v in times.items()},
+               'created': pd.Timestamp.now().isoformat(),
+               'tuning_time': time.time() - start}
+
+    save_profile(profile, directory)
+    logging.info('Tuned profile ' + name + ': ' + best['name'] + ' with score ' + str(round(profile['score'], 2)) +
+                 ' s')
+    return profile
+
+
+def save_profile(profile, directory=PROFILES):
+    if not os.path.isdir(directory):
+        os.makedirs(directory, exist_ok=True)
+    filename = os.path.join(directory, profile['name'] + '.json')
+    with open(filename, 'w') as f:
+        json.dump(profile, f, indent=2)
+    return filename
+
+
+def load_profile(name, directory=PROFILES):
+    """Returns the profile name of directory, name can also be the file of a profile"""
+    filename = name if name.endswith('.json') else os.path.join(directory, name + '.json')
+    if not os.path.isfile(filename):
+        raise ValueError('Unknown solver profile ' + name + ', see solver_tuning.tune()')
+    with open(filename) as f:
+        return json.load(f)
+
+
+
+def profile_settings(name, solver='gurobi', gap=0.01, directory=PROFILES, default_solver='gurobi', default_gap=0.01):
+    """
+    Returns solver, gap and race configurations of main.solve_and_create_results() for the profile name. Only the
+    arguments left at their defaults are replaced by the profile: the gap by the tuned gap and the solver by a race of
+    the tuned configuration. An explicit solver is kept, 'race' races the tuned configuration. If the configuration
+    cannot be run on this machine, the requested solver is kept.
+
+    :return: solver, gap, configs       configs of solver_race.race() or None          str, float, list of dict
+    """
+    profile = load_profile(name, directory)
+    config = profile['config']
+
+    if gap == default_gap and profile['gap'] != gap:
+        logging.info('Solver profile ' + name + ': gap ' + str(profile['gap']) + ' instead of ' + str(gap))
+        gap = profile['gap']
+
+    if solver not in (default_solver, 'race'):
+        logging.info('Solver profile ' + name + ': the requested solver ' + solver + ' is kept')
+        return solver, gap, None
+
+    if not solver_race.available(config):
+        logging.warning('The configuration ' + config['name'] + ' of solver profile ' + name + ' is not available, '
+                        'solving with ' + solver)
+        return solver, gap, None
+
+    logging.info('Solver profile ' + name + ': racing ' + config['name'] + ' instead of ' + solver)
+    return 'race', gap, [config]
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    tune(build_corpus(), 'default')
@@ -0,0 +1,307 @@
+"""
+Two-stage stochastic investment model.
+
+The PV and storage investment is the first stage decision, shared by S demand and PV scenarios with probabilities,
+the operation of every scenario is the second stage. Every scenario is a matrix model of fast_builder.py, bound to
+its timeseries from one compiled template (model_template.py). Two solution methods are available:
+
+- 'extensive_form': the scenario models are stacked into one MILP whose investment columns are shared, with the
+  probability weighted objective. Exact, but its size grows with S.
+- 'progressive_hedging': every scenario is solved on its own with the multipliers w_s and the proximal term
+  rho / 2 (x_s - x_mean)^2 on its investment x_s, the multipliers are updated until the investments of the scenarios
+  agree. The proximal term is linearised by SEGMENTS pieces on either side of x_mean, so that HiGHS solves the
+  subproblems. The subproblems of an iteration run in a pool of worker
+  processes, which load the scenario models from disk.
+
+In both cases the operation of every scenario is finally solved with the investment fixed to the first stage
+decision:
+
+    res = stochastic.stochastic_investment([feedin_1, feedin_2, feedin_3], [0.5, 0.3, 0.2])
+    print(res['sizing'], res['expected_cost'])
+"""
+
+import copy
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.optimize import Bounds, LinearConstraint, milp
+
+import model_template
+from fast_builder import FastModel
+
+METHODS = ('extensive_form', 'progressive_hedging')
+
+# pieces of the linearised proximal term on either side of x_mean
+SEGMENTS = 8
+
+# proximal weight of progressive hedging, relative to the costs
+RHO = 1.0
+
+
+def first_stage(fast):
+    """Returns the keys of the investment columns of a matrix model"""
+    return sorted(key for key in fast.columns if key[0] == 'invest')
+
+
+def _first_stage_columns(fast):
+    return np.concatenate([fast.column(key) for key in first_stage(fast)])
+
+
+def scenario_models(scenarios, cost, timeincrement=None, initial_capacity=0.5, **kwargs):
+    """
+    Returns the investment matrix model of every scenario, bound to the scenario timeseries.
+
+    :param scenarios:   timeseries holding pv and demand_el values, all of the same length       list of pd.DataFrame
+    :param cost:        cost dict                                                               dict
+    :return: models                                                                             list of FastModel
+    """
+    hours = len(scenarios[0])
+    if any(len(feedin) != hours for feedin in scenarios):
+        raise ValueError('The scenarios have to cover the same number of time steps')
+
+    template = model_template.get_template(hours, cost, 'investment', timeincrement, **kwargs)
+    return [model_template.bind_timeseries(copy.deepcopy(template), feedin, initial_capacity) for feedin in scenarios]
+
+
+def extensive_form(models, probabilities, gap=0.01, time_limit=None):
+    """
+    Solves the extensive form of the scenario models.
+
+    :return: first stage investment, objective and the solution of every scenario                 np.array, float, list
+    """
+    shared = _first_stage_columns(models[0])
+    n_first = len(shared)
+
+    A, c, lb, ub, integrality, row_lb, row_ub, offsets = [], [], [], [], [], [], [], []
+    constant = 0.0
+    n = n_first
+
+    # the investment columns of all scenarios are mapped to the first n_first columns
+    c_first = np.zeros(n_first)
+    lb_first, ub_first = models[0].lb[shared], models[0].ub[shared]
+
+    for fast, p in zip(models, probabilities):
+        first = _first_stage_columns(fast)
+        second = np.setdiff1d(np.arange(fast.n_columns), first)
+
+        mapping = np.empty(fast.n_columns, dtype=int)
+        mapping[first] = np.arange(n_first)
+        mapping[second] = n + np.arange(len(second))
+        offsets.append(mapping)
+
+        c_first += p * fast.c[first]
+        c.append(p * fast.c[second])
+        lb.append(fast.lb[second])
+        ub.append(fast.ub[second])
+        integrality.append(fast.integrality[second])
+        constant += p * fast.constant
+
+        M = fast.matrix().tocoo()
+        A.append((M.row, mapping[M.col], M.data, fast.n_rows))
+        row_lb.append(fast.row_lb)
+        row_ub.append(fast.row_ub)
+        n += len(second)
+
+    rows, cols, vals = [], [], []
+    n_rows = 0
+    for r, k, v, m in A:
+        rows.append(r + n_rows)
+        cols.append(k)
+        vals.append(v)
+        n_rows += m
+    A = sparse.csr_matrix((np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))), shape=(n_rows, n))
+
+    c = np.concatenate([c_first] + c)
+    options = {'mip_rel_gap': gap}
+    if time_limit is not None:
+        options['time_limit'] = time_limit
+
+    start = time.time()
+    res = milp(c, integrality=np.concatenate([models[0].integrality[shared]] + integrality),
+               bounds=Bounds(np.concatenate([lb_first] + lb), np.concatenate([ub_first] + ub)),
+               constraints=LinearConstraint(A, np.concatenate(row_lb), np.concatenate(row_ub)), options=options)
+    logging.info('Extensive form of ' + str(len(models)) + ' scenarios with ' + str(n) + ' columns: ' + res.message +
+                 ' in ' + str(round(time.time() - start, 2)) + ' s')
+
+    if res.x is None:
+        raise RuntimeError('No solution of the extensive form: ' + res.message)
+
+    return res.x[:n_first], float(res.fun) + constant, [res.x[mapping] for mapping in offsets]
+
+
+def _subproblem(args):
+    """
+    Worker of progressive_hedging: solves one scenario model with the multipliers w and the linearised proximal term
+    rho / 2 (x - x_mean)^2 with pieces of width on its investment x. If rho is None, the investment is fixed to x_mean,
+    or free if x_mean is None too. box is the upper bound of the investment, beyond the last piece the proximal term only grows linearly.
+
+    :return: investment, cost of the scenario without multipliers and proximal term                  np.array, float
+    """
+    filename, w, x_mean, rho, width, box, gap, time_limit = args
+
+    fast = FastModel.load(filename)
+    first = _first_stage_columns(fast)
+    k = len(first)
+    options = {'mip_rel_gap': gap}
+    if time_limit is not None:
+        options['time_limit'] = time_limit
+
+    if rho is None:
+        lb, ub = fast.lb.copy(), fast.ub.copy()
+        if x_mean is not None:
+            lb[first] = ub[first] = x_mean
+        res = milp(fast.c, integrality=fast.integrality, bounds=Bounds(lb, ub),
+                   constraints=LinearConstraint(fast.matrix(), fast.row_lb, fast.row_ub), options=options)
+        if res.x is None:
+            raise RuntimeError('No solution of the scenario ' + filename + ': ' + res.message)
+        return res.x[first], float(fast.c.dot(res.x)) + fast.constant
+
+    # pieces d+ and d- of the deviation with x - sum d+ + sum d- = x_mean, the slope of piece j is rho (j + 0.5) width
+    J = SEGMENTS
+    E = sparse.csr_matrix((np.ones(k), (np.arange(k), first)), shape=(k, fast.n_columns))
+    P = sparse.csr_matrix((np.ones(k * J), (np.repeat(np.arange(k), J), np.arange(k * J))), shape=(k, k * J))
+    A = sparse.vstack([sparse.hstack([fast.matrix(), sparse.csr_matrix((fast.n_rows, 2 * k * J))]),
+                       sparse.hstack([E, -P, P])], format='csr')
+
+    slope = (np.outer(rho * width, np.arange(J) + 0.5)).ravel()
+    pieces = np.outer(width, np.ones(J))
+    pieces[:, -1] = np.inf
+
+    c = np.concatenate([fast.c, slope, slope])
+    c[first] += w
+    ub = fast.ub.copy()
+    ub[first] = np.minimum(ub[first], box)
+
+    res = milp(c, integrality=np.concatenate([fast.integrality, np.zeros(2 * k * J)]),
+               bounds=Bounds(np.concatenate([fast.lb, np.zeros(2 * k * J)]),
+                             np.concatenate([ub, pieces.ravel(), pieces.ravel()])),
+               constraints=LinearConstraint(A, np.concatenate([fast.row_lb, x_mean]),
+                                            np.concatenate([fast.row_ub, x_mean])), options=options)
+    if res.x is None:
+        raise RuntimeError('No solution of the subproblem ' + filename + ': ' + res.message)
+
+    x = res.x[:fast.n_columns]
+    return x[first], float(fast.c.dot(x)) + fast.constant
+
+
+def progressive_hedging(files, probabilities, rho=RHO, tol=1e-3, max_iter=50, gap=0.01, time_limit=None, pool=None):
+    """
+    Progressive hedging over the saved scenario models files.
+
+    :param rho:         factor of the cost proportional proximal weight, i.e. rho times the cost
+                        coefficient over the spread of the investments of the single scenarios       float
+    :param tol:         convergence threshold of sum_s p_s |x_s - x_mean| / |x_mean|                  float
+    :return: first stage investment, iterations and the convergence history                          np.array, int, list
+    """
+    p = np.asarray(probabilities, dtype=float)
+    fast = FastModel.load(files[0])
+    first = _first_stage_columns(fast)
+    run = pool.map if pool is not None else lambda f, jobs: [f(job) for job in jobs]
+
+    # iteration 0: every scenario sizes its own system
+    res = run(_subproblem, [(f, None, None, None, None, None, gap, time_limit) for f in files])
+    x = np.array([r[0] for r in res])
+    x_mean = p.dot(x)
+
+    # cost proportional rho, the pieces of the proximal term cover the spread of the single scenarios and the
+    # hedged investment is searched up to twice their largest investment
+    spread = np.maximum(np.abs(x - x_mean).max(axis=0), 1.0)
+    rho = rho * np.maximum(np.abs(fast.c[first]), 1e-3) / spread
+    width = 2 * spread / SEGMENTS
+    box = np.minimum(fast.ub[first], 2 * x.max(axis=0) + 1)
+    w = rho * (x - x_mean)
+
+    history = []
+    for iteration in range(1, max_iter + 1):
+        res = run(_subproblem, [(f, w[s], x_mean, rho, width, box, gap, time_limit) for s, f in enumerate(files)])
+        x = np.array([r[0] for r in res])
+        x_mean = p.dot(x)
+        w += rho * (x - x_mean)
+
+        deviation = float(p.dot(np.abs(x - x_mean).sum(axis=1)) / max(np.abs(x_mean).sum(), 1e-9))
+        history.append({'iteration': iteration, 'deviation': deviation,
+                        'expected_cost': float(p.dot([r[1] for r in res]))})
+        logging.info('Progressive hedging iteration ' + str(iteration) + ': deviation ' + str(round(deviation, 6)))
+
+        if deviation < tol:
+            break
+
+    return x_mean, len(history), history
+
+
+def stochastic_investment(scenarios, probabilities=None, cost=None, method='progressive_hedging', gap=0.01, rho=RHO,
+                          tol=1e-3, max_iter=50, processes=None, time_limit=None, **kwargs):
+    """
+    The function sizes PV and storage against S scenarios.
+
+    :param scenarios:       timeseries holding pv and demand_el values, all of the same length   list of pd.DataFrame
+    :param probabilities:   probability of every scenario, equal if None                         list of float
+    :param cost:            cost dict, main.get_cost_dict(len(scenarios[0])) if None            dict
+    :param method:          'extensive_form' or 'progressive_hedging'                           str
+    :param gap:             allowable gap of the optimization of every (sub)problem              float
+    :param rho:             proximal weight of progressive hedging, relative to the costs        float
+    :param tol:             convergence threshold of progressive hedging                         float
+    :param processes:       number of worker processes, os.cpu_count() if None, at most one
+                            per scenario                                                        int
+    :param kwargs:          further inputs of the template, see model_template.compile_template()
+    :return: sizing, expected cost, scenario table and convergence history                       dict
+    """
+    if method not in METHODS:
+        raise ValueError('The method ' + str(method) + ' is not supported. It can be either [extensive_form] or '
+                         '[progressive_hedging]')
+
+    if probabilities is None:
+        probabilities = [1.0 / len(scenarios)] * len(scenarios)
+    if len(probabilities) != len(scenarios) or abs(sum(probabilities) - 1) > 1e-6:
+        raise ValueError('The probabilities have to sum up to 1, one per scenario')
+
+    if cost is None:
+        import main
+        cost = main.get_cost_dict(len(scenarios[0]))
+
+    start = time.time()
+    models = scenario_models(scenarios, cost, **kwargs)
+    keys = first_stage(models[0])
+
+    history, iterations = [], None
+    if method == 'extensive_form':
+        x, objective, _ = extensive_form(models, probabilities, gap=gap, time_limit=time_limit)
+
+    directory = tempfile.mkdtemp(prefix='stochastic_')
+    # the workers solve the subproblems of progressive hedging and the operation of the scenarios
+    pool = multiprocessing.Pool(min(processes or os.cpu_count() or 1, len(models)))
+    try:
+        files = []
+        for s, fast in enumerate(models):
+            files.append(os.path.join(directory, 'scenario_' + str(s) + '.pkl'))
+            fast.save(files[-1])
+
+        if method == 'progressive_hedging':
+            x, iterations, history = progressive_hedging(files, probabilities, rho=rho, tol=tol, max_iter=max_iter,
+                                                         gap=gap, time_limit=time_limit, pool=pool)
+
+        # operation of every scenario with the first stage decision
+        res = pool.map(_subproblem, [(f, None, x, None, None, None, gap, time_limit) for f in files])
+    finally:
+        pool.close()
+        pool.join()
+        shutil.rmtree(directory, ignore_errors=True)
+
+    costs = np.array([r[1] for r in res])
+    table = pd.DataFrame({'probability': probabilities, 'objective': costs,
+                          'demand': [feedin['demand_el'].sum() for feedin in scenarios]})
+    table['lcoe'] = table['objective'] / table['demand']
+
+    sizing = {key[1]: float(value) for key, value in zip(keys, x)}
+    logging.info('Stochastic investment of ' + str(len(scenarios)) + ' scenarios (' + method + ') in ' +
+                 str(round(time.time() - start, 2)) + ' s: ' + str(sizing))
+
+    return {'sizing': sizing, 'expected_cost': float(np.dot(probabilities, costs)), 'scenarios': table,
+            'iterations': iterations, 'history': history, 'method': method}
@@ -0,0 +1,106 @@
+"""
+FastModel compiled from a hand-built structure of describe(): one generator, a storage and a fixed demand on one
+bus, three time steps. The generator has to run in the first and the last hour, the storage shifts its initial
+energy, so the optimal objective is 2 * (intercept + om) + slope * (demand - initial energy) times the fuel price.
+"""
+
+import numpy as np
+import pytest
+
+from fast_builder import FastModel
+
+T = 3
+DEMAND = np.array([40.0, 0.0, 40.0])
+
+
+def _flow(name, nominal_value=None, fixed=False, nonconvex=False, variable_costs=0.0, min=0.0):
+    return {'name': name,
+            'nominal_value': nominal_value,
+            'min': np.full(T, min),
+            'max': np.ones(T),
+            'fixed': fixed,
+            'nonconvex': nonconvex,
+            'variable_costs': np.full(T, variable_costs),
+            'fixed_costs': 0,
+            'investment': None}
+
+
+def structure(timeincrement=None):
+    return {'timesteps': T,
+            'timeincrement': np.ones(T) if timeincrement is None else np.asarray(timeincrement, dtype=float),
+            'buses': ['electricity'],
+            'flows': [_flow(('diesel', 'gen'), variable_costs=1.0),
+                      _flow(('electricity', 'demand'), nominal_value=1, fixed=True),
+                      _flow(('electricity', 'excess')),
+                      _flow(('electricity', 'storage')),
+                      _flow(('gen', 'electricity'), nominal_value=100, nonconvex=True, min=0.3),
+                      _flow(('storage', 'electricity'))],
+            'transformers': [],
+            'generators': [{'label': 'gen',
+                            'fuel': ('diesel', 'gen'),
+                            'output': ('gen', 'electricity'),
+                            'bank': False,
+                            'units': 1,
+                            'unit_nominal_value': 100,
+                            'min': np.full(T, 0.3),
+                            'max': np.ones(T),
+                            'om_costs': 0.01,
+                            'intercept': 5.0,
+                            'slope': 0.2}],
+            'storages': [{'label': 'storage',
+                          'input': ('electricity', 'storage'),
+                          'output': ('storage', 'electricity'),
+                          'nominal_capacity': 20,
+                          'investment': None,
+                          'capacity_loss': np.zeros(T),
+                          'inflow_conversion_factor': np.ones(T),
+                          'outflow_conversion_factor': np.ones(T),
+                          'capacity_min': np.zeros(T),
+                          'capacity_max': np.ones(T),
+                          'input_ratio': None,
+                          'output_ratio': None,
+                          'fixed_costs': 0,
+                          'relative_initial': True}],
+            'reserve': {'generators': [], 'storage': None}}
+
+
+def data(initial_capacity=0.5):
+    return {'actual_value': {('electricity', 'demand'): DEMAND},
+            'sr_limit': np.zeros(T),
+            'rm_limit': np.zeros(T),
+            'initial_capacity': {'storage': initial_capacity}}
+
+
+def test_objective():
+    fast = FastModel(structure(), data())
+    objective = fast.solve(gap=0)
+
+    # om costs of 0.01 per hour and kW of the 100 kW generator
+    assert objective == pytest.approx(2 * (5.0 + 0.01 * 100) + 0.2 * (DEMAND.sum() - 10))
+    assert fast.values(('status', 'gen')) == pytest.approx([1, 0, 1])
+
+
+def test_storage_balance():
+    fast = FastModel(structure(), data())
+    fast.solve(gap=0)
+
+    capacity = fast.values(('capacity', 'storage'))
+    charge = fast.values(('flow', 'electricity', 'storage'))
+    discharge = fast.values(('flow', 'storage', 'electricity'))
+    previous = np.concatenate(([0.5 * 20], capacity[:-1]))
+
+    assert capacity == pytest.approx(previous + charge - discharge)
+    assert np.all(capacity >= -1e-9) and np.all(capacity <= 20 + 1e-9)
+
+
+def test_bind_initial_capacity():
+    # without initial energy the generator covers the whole demand
+    fast = FastModel(structure(), data(initial_capacity=0))
+    assert fast.solve(gap=0) == pytest.approx(2 * (5.0 + 0.01 * 100) + 0.2 * DEMAND.sum())
+
+
+def test_timeincrement_weights_costs():
+    # a two hour step doubles fuel and om costs of the generator, but the demand of the middle step is 0
+    fast = FastModel(structure(timeincrement=[2, 1, 1]), data(initial_capacity=0))
+    fuel = 5.0 + 0.2 * DEMAND[0]
+    assert fast.solve(gap=0) == pytest.approx(2 * (fuel + 0.01 * 100) + (5.0 + 0.2 * DEMAND[2] + 0.01 * 100))
@@ -0,0 +1,112 @@
+"""
+Parity of the matrix model of fast_builder.py with the pyomo model of main.create_energysystem_model on the first
+day of data/timeseries.csv, in simulation and investment mode, with and without a GeneratorBank.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('oemof.solph')
+po = pytest.importorskip('pyomo.environ')
+
+from oemof.outputlib import processing  # noqa: E402
+
+import cost_summary as lcoe  # noqa: E402
+import main  # noqa: E402
+from fast_builder import FastModel  # noqa: E402
+
+SOLVER = 'cbc'
+HOURS = 24
+GAP = 1e-6
+RTOL = 1e-4
+FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'timeseries.csv')
+
+BANK = [{'label': 'pp_bank', 'units': 3, 'unit_nominal_value': 80,
+         'fuel_curve': {'1': 20, '0.75': 16, '0.5': 11, '0.25': 8}}]
+
+if not po.SolverFactory(SOLVER).available(exception_flag=False):
+    pytest.skip(SOLVER + ' is not available', allow_module_level=True)
+
+
+@pytest.fixture(scope='module', params=[('simulation', None), ('investment', None),
+                                        ('simulation', BANK), ('investment', BANK)],
+                ids=['simulation', 'investment', 'simulation-bank', 'investment-bank'])
+def models(request):
+    mode, gen_banks = request.param
+
+    feedin = main.get_timeseries(FILE).iloc[:HOURS]
+    cost = main.get_cost_dict(HOURS)
+    for bank in gen_banks or []:
+        cost[bank['label']] = dict(cost['pp_oil_1'])
+
+    pm, gen_set = main.create_energysystem_model(mode, feedin, 0.5, cost, gen_banks=gen_banks)
+    pm.solve(solver=SOLVER, solve_kwargs={'tee': False}, cmdline_options={'ratioGap': GAP})
+    pyomo_objective = po.value(pm.objective)
+    pyomo_results = processing.results(pm)
+
+    reserve_base = feedin['demand_el']
+    fast = FastModel.from_energysystem(pm.es, gen_set, pm.es.groups.get('storage'), reserve_base * 0.2,
+                                       reserve_base * 0.4)
+    fast.solve(gap=GAP)
+
+    # results of the pyomo model at the solution of the matrix model
+    fast.load_into(pm)
+    loaded_results = processing.results(pm)
+
+    components = [c for c in ['demand', 'PV', 'storage'] + [g.label for g in gen_set] + ['excess']
+                  if c in pm.es.groups]
+
+    return {'pm': pm, 'fast': fast, 'pyomo_objective': pyomo_objective, 'pyomo_results': pyomo_results,
+            'loaded_results': loaded_results, 'fast_results': fast.results(), 'components': components}
+
+
+def test_objective(models):
+    assert models['fast'].objective() == pytest.approx(models['pyomo_objective'], rel=RTOL)
+    # the pyomo objective at the solution of the matrix model
+    assert po.value(models['pm'].objective) == pytest.approx(models['fast'].objective(), rel=RTOL)
+
+
+def test_feasible_in_pyomo(models):
+    pm = models['pm']
+    for row in pm.component_data_objects(po.Constraint, active=True):
+        body = po.value(row.body)
+        if row.has_lb():
+            assert body >= po.value(row.lower) - 1e-6, row.name
+        if row.has_ub():
+            assert body <= po.value(row.upper) + 1e-6, row.name
+
+
+def test_results_structure(models):
+    pyomo_results, fast_results = models['pyomo_results'], models['fast_results']
+
+    assert sorted(map(str, pyomo_results)) == sorted(map(str, fast_results))
+    for key in pyomo_results:
+        assert sorted(pyomo_results[key]['sequences'].columns) == sorted(fast_results[key]['sequences'].columns)
+        assert sorted(pyomo_results[key]['scalars'].index) == sorted(fast_results[key]['scalars'].index)
+
+
+def test_flows(models):
+    loaded_results, fast_results = models['loaded_results'], models['fast_results']
+
+    for key in loaded_results:
+        for column in loaded_results[key]['sequences'].columns:
+            np.testing.assert_allclose(fast_results[key]['sequences'][column].values,
+                                       loaded_results[key]['sequences'][column].values, atol=1e-6,
+                                       err_msg=str(key) + ' ' + str(column))
+        for name, value in loaded_results[key]['scalars'].items():
+            assert fast_results[key]['scalars'][name] == pytest.approx(value, abs=1e-6)
+
+
+def test_postprocessing(models):
+    pm, fast, components = models['pm'], models['fast'], models['components']
+
+    expected = main.results_postprocessing(models['loaded_results'], components)
+    actual = main.results_postprocessing(models['fast_results'], components)
+    pd.testing.assert_frame_equal(actual, expected[actual.columns], check_exact=False, atol=1e-6)
+
+    expected = lcoe.get_lcoe(pm, models['loaded_results'], components)
+    actual = lcoe.get_lcoe(fast, models['fast_results'], components)
+    np.testing.assert_allclose(actual.values.astype(float), expected.values.astype(float), rtol=RTOL, atol=1e-6)
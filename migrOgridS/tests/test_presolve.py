@@ -0,0 +1,50 @@
+"""
+The bounds of presolve.tighten_bounds must not cut off the optimum: the investment model of the first days of
+data/timeseries.csv has the same optimal objective with and without them.
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip('oemof.solph')
+po = pytest.importorskip('pyomo.environ')
+
+import main  # noqa: E402
+import presolve  # noqa: E402
+
+SOLVER = 'cbc'
+HOURS = 48
+GAP = 1e-6
+FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'timeseries.csv')
+
+FUEL_CURVE = {'1': 42, '0.75': 33, '0.5': 22, '0.25': 16}
+
+
+def test_fuel_envelope():
+    flow = np.linspace(0, 200, 41)
+    intercept, slope = presolve.linear_fuel_curve(FUEL_CURVE, 186)
+    envelope = presolve.fuel_envelope(FUEL_CURVE, 186, flow)
+
+    assert np.all(envelope >= intercept + slope * flow - 1e-9)
+    for load, fuel in FUEL_CURVE.items():
+        assert presolve.fuel_envelope(FUEL_CURVE, 186, np.array([float(load) * 186]))[0] >= fuel - 1e-9
+
+
+@pytest.mark.parametrize('mode', ['simulation', 'investment'])
+def test_bounds_keep_optimum(mode):
+    if not po.SolverFactory(SOLVER).available(exception_flag=False):
+        pytest.skip(SOLVER + ' is not available')
+
+    feedin = main.get_timeseries(FILE).iloc[:HOURS]
+    cost = main.get_cost_dict(HOURS)
+
+    objectives = {}
+    for presolve_bounds in (False, True):
+        m, gen_set = main.create_energysystem_model(mode, feedin, 0.5, cost, presolve_bounds=presolve_bounds)
+        m.solve(solver=SOLVER, solve_kwargs={'tee': False}, cmdline_options={'ratioGap': GAP})
+        assert main.termination_condition(m) in main.SOLVED
+        objectives[presolve_bounds] = po.value(m.objective)
+
+    assert objectives[True] == pytest.approx(objectives[False], rel=1e-5)
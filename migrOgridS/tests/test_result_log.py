@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+
+from result_log import ResultLog
+
+
+def window(start, values):
+    index = pd.date_range(start, periods=len(values), freq=pd.Timedelta(hours=1))
+    return pd.DataFrame({"(('gen', 'el'), 'flow')": values}, index=index)
+
+
+def test_append_read(tmp_path):
+    log = ResultLog(str(tmp_path))
+    log.append(window('2017-01-01', [1.0, 2.0]), 0, capacity=5.0)
+    log.append(window('2017-01-01 02:00', [3.0]), 1, capacity=4.0)
+
+    resumed = ResultLog(str(tmp_path))
+    assert resumed.last_window == 1
+    assert resumed.resume() == {'capacity': 4.0}
+    assert resumed.read().iloc[:, 0].tolist() == [1.0, 2.0, 3.0]
+
+
+def test_resume_after_partial_window(tmp_path):
+    log = ResultLog(str(tmp_path))
+    log.append(window('2017-01-01', [1.0, 2.0]), 0)
+
+    # the run dies while the second window is written
+    with open(str(tmp_path / ResultLog.INDEX), 'ab') as file:
+        file.write(np.zeros(1, dtype='<i8').tobytes())
+
+    log = ResultLog(str(tmp_path))
+    log.append(window('2017-01-01 02:00', [3.0]), 1)
+
+    frame = log.read()
+    assert frame.iloc[:, 0].tolist() == [1.0, 2.0, 3.0]
+    assert frame.index[-1] == pd.Timestamp('2017-01-01 02:00')
+
+
+def test_resume_after_crash_in_first_window(tmp_path):
+    # the run dies before the state of the first window is written
+    with open(str(tmp_path / ResultLog.INDEX), 'wb') as file:
+        file.write(np.zeros(2, dtype='<i8').tobytes())
+    with open(str(tmp_path / 'column_0.bin'), 'wb') as file:
+        file.write(np.full(2, 99.0, dtype='<f8').tobytes())
+
+    log = ResultLog(str(tmp_path))
+    log.append(window('2017-01-01', [1.0, 2.0]), 0)
+
+    frame = log.read()
+    assert frame.iloc[:, 0].tolist() == [1.0, 2.0]
+    assert frame.index[0] == pd.Timestamp('2017-01-01')
@@ -0,0 +1,152 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import schedule_check
+from fast_builder import FastModel
+from test_fast_builder import data, structure
+
+GENS = [{'label': 'gen_1', 'units': 1, 'p_min': 30, 'p_max': 100},
+        {'label': 'gen_2', 'units': 1, 'p_min': 30, 'p_max': 100}]
+
+STORAGE = {'nominal_capacity': 100, 'initial_capacity': 50, 'capacity_min': 0.2, 'capacity_max': 1,
+           'capacity_loss': 0, 'inflow_conversion_factor': 1, 'outflow_conversion_factor': 1,
+           'input_ratio': 0.5, 'output_ratio': 0.5}
+
+
+def schedule():
+    """Feasible schedule of three hours: PV charges the storage in the second hour"""
+    return {'demand': np.array([100.0, 100.0, 150.0]),
+            'pv': np.array([0.0, 80.0, 0.0]),
+            'excess': np.zeros(3),
+            'gen_1': np.array([80.0, 40.0, 100.0]),
+            'gen_1_status': np.ones(3),
+            'gen_2': np.array([0.0, 0.0, 40.0]),
+            'gen_2_status': np.array([0.0, 0.0, 1.0]),
+            'storage_in': np.array([0.0, 20.0, 0.0]),
+            'storage_out': np.array([20.0, 0.0, 10.0]),
+            'soc': np.array([30.0, 50.0, 40.0])}
+
+
+def check(s, **kwargs):
+    limits = {'sr_limit': np.full(3, 20.0), 'rm_limit': np.full(3, 40.0), 'n1_limit': np.zeros(3)}
+    limits.update(kwargs)
+    return schedule_check.check_schedule(s, GENS, STORAGE, **limits)
+
+
+def violated(violations):
+    return sorted(schedule_check.summary(violations).query('hours > 0').index)
+
+
+def test_feasible():
+    violations = check(schedule())
+    assert schedule_check.is_feasible(violations), violated(violations)
+
+
+def test_dataframe_index():
+    s = pd.DataFrame(schedule(), index=pd.date_range('2017-01-01', periods=3, freq=pd.Timedelta(hours=1)))
+    assert check(s).index.equals(s.index)
+
+
+def test_balance():
+    s = schedule()
+    s['gen_1'][0] = 70
+    s['gen_1_status'][0] = 1
+    violations = check(s)
+    assert violations['balance_ac'][0] == pytest.approx(10)
+    assert violated(violations) == ['balance_ac']
+
+
+def test_balance_dc():
+    s = schedule()
+    s['inverter'] = s['pv'] - s['storage_in'] + s['storage_out']
+    s['inverter'][2] += 5
+    s['gen_2'][2] -= 5
+    assert violated(check(s)) == ['balance_dc']
+
+
+def test_storage_balance():
+    s = schedule()
+    s['soc'][1] = 45
+    s['soc'][2] = 35
+    violations = check(s)
+    assert violations['storage_balance'][1] == pytest.approx(5)
+    assert 'storage_balance' in violated(violations)
+
+
+def test_storage_limits():
+    s = schedule()
+    s['storage_out'][0] = 60
+    s['gen_1'][0] = 40
+    s['soc'] = np.array([-10.0, 10.0, 0.0])
+    names = violated(check(s))
+    assert 'storage_output' in names
+    assert 'storage_min' in names
+
+
+def test_gen_min_max():
+    s = schedule()
+    s['gen_1'][1] = 20
+    s['storage_in'][1] = 0
+    s['soc'] = np.array([30.0, 30.0, 20.0])
+    names = violated(check(s))
+    assert 'gen_min_gen_1' in names
+
+    s = schedule()
+    s['gen_2'][2] = 40
+    s['gen_2_status'][2] = 0
+    assert 'gen_max_gen_2' in violated(check(s))
+
+
+def test_gen_status():
+    s = schedule()
+    s['gen_1_status'][0] = 0.5
+    assert 'gen_status_gen_1' in violated(check(s))
+
+
+def test_gen_order():
+    s = schedule()
+    s['gen_1'][2], s['gen_1_status'][2] = 0, 0
+    s['gen_2_status'][2] = 1
+    s['gen_2'][2] = 100
+    s['storage_out'][2] = 50
+    s['soc'][2] = 0
+    assert 'gen_order' in violated(check(s))
+
+
+def test_spinning_reserve():
+    violations = check(schedule(), sr_limit=np.array([0.0, 0.0, 120.0]))
+    # headroom of 60 kW plus the output ratio of the 20 kWh above the minimum capacity
+    assert violations['spinning_reserve_u'][2] == pytest.approx(50)
+    # headroom of 60 kW plus the power limit of 50 kW of the storage
+    assert violations['spinning_reserve_l'][2] == pytest.approx(10)
+    assert violated(violations) == ['spinning_reserve_l', 'spinning_reserve_u']
+
+
+def test_rotating_mass():
+    violations = check(schedule(), rm_limit=np.array([0.0, 0.0, 170.0]))
+    # generation of 140 kW plus stored energy above the minimum of 20 kWh
+    assert violations['rotating_mass_u'][2] == pytest.approx(10)
+    assert violated(violations) == ['rotating_mass_u']
+
+
+def test_n1():
+    violations = check(schedule(), n1_limit=np.array([0.0, 0.0, 150.0]))
+    # without one of the running generators 100 kW remain online
+    assert violations['n1_gen_1'][2] == pytest.approx(50)
+    assert violated(violations) == ['n1_gen_1', 'n1_gen_2']
+
+
+def test_fast_model_results():
+    fast = FastModel(structure(), data())
+    fast.solve(gap=0)
+
+    gens = [{'label': 'gen', 'units': 1, 'p_min': 30, 'p_max': 100}]
+    storage = dict(STORAGE, nominal_capacity=20, initial_capacity=10, capacity_min=0, input_ratio=1, output_ratio=1)
+
+    s = schedule_check.schedule_from_results(fast.results(), gens)
+    s['pv'] = np.zeros(3)
+
+    assert s['gen_status'].tolist() == pytest.approx([1, 0, 1])
+    violations = schedule_check.check_schedule(s, gens, storage)
+    assert schedule_check.is_feasible(violations), violated(violations)
@@ -0,0 +1,27 @@
+import json
+
+import solver_tuning
+
+
+def write_profile(directory, solver='scipy'):
+    profile = {'name': 'tuned', 'gap': 0.05, 'config': {'name': 'tuned_' + solver, 'solver': solver, 'options': {}}}
+    with open(str(directory / 'tuned.json'), 'w') as f:
+        json.dump(profile, f)
+
+
+def test_profile_replaces_defaults(tmp_path):
+    write_profile(tmp_path)
+    solver, gap, configs = solver_tuning.profile_settings('tuned', directory=str(tmp_path))
+    assert (solver, gap) == ('race', 0.05)
+    assert [c['name'] for c in configs] == ['tuned_scipy']
+
+
+def test_profile_keeps_explicit_arguments(tmp_path):
+    write_profile(tmp_path)
+    assert solver_tuning.profile_settings('tuned', 'cbc', 0.001, directory=str(tmp_path)) == ('cbc', 0.001, None)
+
+
+def test_profile_unavailable_configuration(tmp_path, monkeypatch):
+    write_profile(tmp_path, solver='cbc')
+    monkeypatch.setattr(solver_tuning.solver_race, 'available', lambda config: False)
+    assert solver_tuning.profile_settings('tuned', directory=str(tmp_path)) == ('gurobi', 0.05, None)
@@ -0,0 +1,109 @@
+"""
+Progressive hedging converges to the investment of the extensive form on three scenarios of a hand-built PV, storage
+and generator system of one day. The generator has neither minimum load nor fuel intercept, so that the scenario
+problems are convex and progressive hedging is exact.
+"""
+
+import numpy as np
+import pytest
+
+import stochastic
+from fast_builder import FastModel
+
+T = 24
+HOURS = np.arange(T)
+SUN = np.clip(np.sin((HOURS - 6) / 12 * np.pi), 0, None)
+
+
+def _flow(name, nominal_value=None, fixed=False, nonconvex=False, variable_costs=0.0, min=0.0, investment=None):
+    return {'name': name,
+            'nominal_value': nominal_value,
+            'min': np.full(T, min),
+            'max': np.ones(T),
+            'fixed': fixed,
+            'nonconvex': nonconvex,
+            'variable_costs': np.full(T, variable_costs),
+            'fixed_costs': 0,
+            'investment': investment}
+
+
+def _investment(ep_costs):
+    return {'ep_costs': ep_costs, 'minimum': 0, 'maximum': np.inf}
+
+
+STRUCTURE = {'timesteps': T,
+             'timeincrement': np.ones(T),
+             'buses': ['electricity'],
+             'flows': [_flow(('PV', 'electricity'), fixed=True, investment=_investment(1.0)),
+                       _flow(('diesel', 'gen'), variable_costs=1.0),
+                       _flow(('electricity', 'demand'), nominal_value=1, fixed=True),
+                       _flow(('electricity', 'excess')),
+                       _flow(('electricity', 'storage')),
+                       _flow(('gen', 'electricity'), nominal_value=200, nonconvex=True),
+                       _flow(('storage', 'electricity'))],
+             'transformers': [],
+             'generators': [{'label': 'gen',
+                             'fuel': ('diesel', 'gen'),
+                             'output': ('gen', 'electricity'),
+                             'bank': False,
+                             'units': 1,
+                             'unit_nominal_value': 200,
+                             'min': np.zeros(T),
+                             'max': np.ones(T),
+                             'om_costs': 0.0,
+                             'intercept': 0.0,
+                             'slope': 0.3}],
+             'storages': [{'label': 'storage',
+                           'input': ('electricity', 'storage'),
+                           'output': ('storage', 'electricity'),
+                           'nominal_capacity': None,
+                           'investment': _investment(0.1),
+                           'capacity_loss': np.zeros(T),
+                           'inflow_conversion_factor': np.full(T, 0.95),
+                           'outflow_conversion_factor': np.full(T, 0.95),
+                           'capacity_min': np.zeros(T),
+                           'capacity_max': np.ones(T),
+                           'input_ratio': 0.5,
+                           'output_ratio': 0.5,
+                           'fixed_costs': 0,
+                           'relative_initial': True}],
+             'reserve': {'generators': [], 'storage': None}}
+
+
+def scenario(pv, demand):
+    return FastModel(STRUCTURE, {'actual_value': {('PV', 'electricity'): pv, ('electricity', 'demand'): demand},
+                                 'sr_limit': np.zeros(T), 'rm_limit': np.zeros(T),
+                                 'initial_capacity': {'storage': 0}})
+
+
+@pytest.fixture
+def models():
+    demand = 60 + 30 * np.sin(HOURS / 24 * 2 * np.pi)
+    return [scenario(SUN, demand), scenario(0.4 * SUN, demand), scenario(0.8 * SUN, 1.2 * demand)]
+
+
+def test_progressive_hedging_converges_to_extensive_form(models, tmp_path):
+    probabilities = [0.5, 0.3, 0.2]
+    x_ef, objective, _ = stochastic.extensive_form(models, probabilities, gap=0)
+
+    files = []
+    for s, fast in enumerate(models):
+        files.append(str(tmp_path / ('scenario_' + str(s) + '.pkl')))
+        fast.save(files[-1])
+    x_ph, iterations, history = stochastic.progressive_hedging(files, probabilities, tol=1e-4, max_iter=100, gap=0)
+
+    assert iterations < 100
+    assert history[-1]['deviation'] < 1e-4
+    np.testing.assert_allclose(x_ph, x_ef, rtol=1e-3)
+
+    # expected cost of the operation with the hedged investment
+    costs = [stochastic._subproblem((f, None, x_ph, None, None, None, 0, None))[1] for f in files]
+    assert np.dot(probabilities, costs) == pytest.approx(objective, rel=1e-4)
+
+
+def test_extensive_form_shares_investment(models):
+    x, objective, solutions = stochastic.extensive_form(models, [0.5, 0.3, 0.2], gap=0)
+    first = stochastic._first_stage_columns(models[0])
+    for solution in solutions:
+        np.testing.assert_allclose(solution[first], x)
+    assert np.all(x > 0)
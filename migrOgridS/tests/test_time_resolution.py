@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from time_resolution import aggregate_timeseries, disaggregate_results, resolution_increments
+
+HOURS = 24 * 7
+
+
+@pytest.fixture
+def feedin():
+    rng = np.random.default_rng(0)
+    index = pd.date_range('2017-01-01', periods=HOURS, freq=pd.Timedelta(hours=1))
+    return pd.DataFrame({'PV': rng.uniform(0, 1, HOURS), 'demand_el': rng.uniform(100, 300, HOURS)}, index=index)
+
+
+def test_increments_cover_hours():
+    increments = resolution_increments(HOURS)
+    assert sum(increments) == HOURS
+    assert increments[:24] == [1] * 24
+
+
+def test_energy_conserved(feedin):
+    increments = resolution_increments(HOURS)
+    aggregated = aggregate_timeseries(feedin, increments)
+    assert len(aggregated) == len(increments)
+
+    hourly = disaggregate_results(aggregated[['PV', 'demand_el']], increments, feedin.index)
+
+    assert hourly.index.equals(feedin.index)
+    np.testing.assert_allclose(hourly.sum().values, feedin.sum().values)
+    # energy of every step is kept within the step
+    np.testing.assert_allclose((aggregated[['PV', 'demand_el']].values * np.asarray(increments)[:, None]).sum(axis=0),
+                               feedin.sum().values)
+
+
+def test_peak_demand(feedin):
+    aggregated = aggregate_timeseries(feedin, resolution_increments(HOURS))
+    assert (aggregated['demand_max'] >= aggregated['demand_el']).all()
+    assert aggregated['demand_max'].max() == feedin['demand_el'].max()
+
+
+def test_capacity_interpolated():
+    increments = [1, 4, 2]
+    index = pd.date_range('2017-01-01', periods=3, freq=pd.Timedelta(hours=5))
+    results = pd.DataFrame({'capacity': [10.0, 30.0, 20.0], 'flow': [1.0, 2.0, 3.0]}, index=index)
+
+    hourly = disaggregate_results(results, increments)
+
+    assert len(hourly) == 7
+    assert hourly.index[1] - hourly.index[0] == pd.Timedelta(hours=1)
+    assert hourly['flow'].tolist() == [1, 2, 2, 2, 2, 3, 3]
+    assert hourly['capacity'].tolist() == [10, 15, 20, 25, 30, 25, 20]
+
+
+def test_increments_mismatch(feedin):
+    with pytest.raises(ValueError):
+        aggregate_timeseries(feedin, [24] * 6)
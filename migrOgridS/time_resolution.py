@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+
+
+def resolution_increments(n, steps=((24, 1), (72, 4), (None, 24))):
+    """
+    The function returns the lengths of the time steps of a variable resolution time index covering n hours.
+
+    :param n:       number of hours to cover                                                    int
+    :param steps:   sequence of (hours, step length) pairs, e.g. the default keeps the first 24 hours hourly,
+                    aggregates the next 72 hours to 4 hour blocks and the remainder to 24 hour blocks.
+                    hours=None covers the remainder                                             tuple
+    :return: increments     length of every time step in hours, the last step of each part
+                            is shortened to fit                                                 list of int
+    """
+    increments = []
+    covered = 0
+
+    for hours, length in steps:
+        end = n if hours is None else min(covered + hours, n)
+        while covered < end:
+            increments += [min(length, end - covered)]
+            covered += increments[-1]
+
+    if covered < n:
+        increments += [1] * (n - covered)
+
+    return increments
+
+
+def aggregate_timeseries(feedin, increments):
+    """
+    The function aggregates an hourly timeseries to the time steps given by increments. PV and demand are averaged
+    over every step, so that power times step length conserves energy. The column 'demand_max' holds the peak demand
+    of every step, which is the basis of the spinning reserve and rotating mass limits.
+
+    :param feedin:      hourly timeseries holding pv and demand_el values                   pd.DataFrame
+    :param increments:  length of every time step in hours, see resolution_increments()     list of int
+    :return: aggregated timeseries indexed by the first hour of every step                  pd.DataFrame
+    """
+    increments = np.asarray(increments)
+    if increments.sum() != len(feedin):
+        raise ValueError('The increments cover ' + str(increments.sum()) + ' hours, the timeseries ' +
+                         str(len(feedin)))
+
+    starts = np.concatenate(([0], np.cumsum(increments)[:-1]))
+
+    aggregated = pd.DataFrame(np.add.reduceat(feedin.values, starts, axis=0) / increments[:, None],
+                              index=feedin.index[starts], columns=feedin.columns)
+    aggregated['demand_max'] = np.maximum.reduceat(feedin['demand_el'].values, starts)
+
+    return aggregated
+
+
+def disaggregate_results(results, increments, index=None):
+    """
+    The function maps results of a variable resolution model back to the hourly grid. Flows and status values are
+    held constant within every step, so that power times step length conserves energy, storage capacities are
+    interpolated linearly between the ends of the steps.
+
+    :param results:     results table of the aggregated model, e.g. results_postprocessing()    pd.DataFrame
+    :param increments:  length of every time step in hours                                      list of int
+    :param index:       hourly index of the original timeseries, hourly from the first
+                        time step of results if None                                            pd.DatetimeIndex
+    :return: hourly results table                                                               pd.DataFrame
+    """
+    increments = np.asarray(increments)[:len(results)]
+    hours = increments.sum()
+
+    if index is None:
+        index = pd.date_range(results.index[0], periods=hours, freq=pd.Timedelta(hours=1))
+
+    hourly = pd.DataFrame(np.repeat(results.values, increments, axis=0), index=index[:hours],
+                          columns=results.columns)
+
+    ends = np.cumsum(increments) - 1
+    for column in results.columns:
+        if 'capacity' in str(column):
+            hourly[column] = np.interp(np.arange(hours), ends, results[column].values)
+
+    return hourly
@@ -0,0 +1,206 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+CACHE = '.cache'
+
+
+def _file_hash (file):
+    sha = hashlib.sha1()
+    with open(file, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def _cache_dir (file):
+    return os.path.join(os.path.dirname(os.path.abspath(file)), CACHE, os.path.basename(file))
+
+
+def _separator (file):
+    with open(file) as f:
+        header = f.readline()
+    return ';' if ';' in header else ','
+
+
+def parse_timeseries (file, sep=None):
+    """
+    Parses a timeseries csv with a 'timestamp' column in TIMESTAMP_FORMAT and float columns, e.g. PV and demand_el.
+    The separator is taken from the header line if sep is None.
+
+    :return: timestamps, columns, values    UTC nanoseconds, column names, float64 array [time, column]
+    """
+    if sep is None:
+        sep = _separator(file)
+
+    columns = [c for c in pd.read_csv(file, sep=sep, nrows=0).columns if c != 'timestamp']
+    frame = pd.read_csv(file, sep=sep, dtype=dict({c: 'float64' for c in columns}, timestamp=str))
+
+    stamps = pd.to_datetime(frame['timestamp'], format=TIMESTAMP_FORMAT, utc=True)
+    stamps = stamps.values.astype('datetime64[ns]').astype('<i8')
+
+    return stamps, columns, frame[columns].values
+
+
+def validate (stamps, columns, values, file=''):
+    """
+    Checks a parsed timeseries and clips the PV capacity factor to 1 in place. Raises ValueError for missing
+    values, negative demand and timestamps that are not strictly increasing.
+    """
+    if len(stamps) > 1 and not (np.diff(stamps) > 0).all():
+        raise ValueError('Timestamps of ' + file + ' are not strictly increasing')
+
+    missing = ~np.isfinite(values)
+    if missing.any():
+        row, column = np.argwhere(missing)[0]
+        raise ValueError('Missing value in ' + file + ', column ' + columns[column] + ', row ' + str(row))
+
+    if 'demand_el' in columns and (values[:, columns.index('demand_el')] < 0).any():
+        raise ValueError('Negative demand in ' + file)
+
+    if 'PV' in columns:
+        np.minimum(values[:, columns.index('PV')], 1, out=values[:, columns.index('PV')])
+
+    return values
+
+
+def _read_cache (file, directory):
+    meta_file = os.path.join(directory, 'meta.json')
+    if not os.path.isfile(meta_file):
+        return None
+
+    with open(meta_file) as f:
+        meta = json.load(f)
+
+    stat = os.stat(file)
+    if meta['mtime'] != stat.st_mtime or meta['size'] != stat.st_size:
+        # touched or changed, only a new hash invalidates the cache
+        if meta['size'] != stat.st_size or meta['sha1'] != _file_hash(file):
+            return None
+        meta['mtime'] = stat.st_mtime
+        _write_json(meta_file, meta)
+
+    return meta
+
+
+def _write_json (filename, data):
+    with open(filename + '.' + str(os.getpid()), 'w') as f:
+        json.dump(data, f)
+    os.replace(filename + '.' + str(os.getpid()), filename)
+
+
+def _write_cache (file, directory, stamps, columns, values):
+    if not os.path.isdir(directory):
+        os.makedirs(directory, exist_ok=True)
+
+    stat = os.stat(file)
+    arrays = [('timestamp', stamps)] + [(str(i), np.ascontiguousarray(values[:, i])) for i in range(len(columns))]
+
+    for name, array in arrays:
+        filename = os.path.join(directory, name + '.npy')
+        with open(filename + '.' + str(os.getpid()), 'wb') as f:
+            np.save(f, array)
+        os.replace(filename + '.' + str(os.getpid()), filename)
+
+    meta = {'mtime': stat.st_mtime, 'size': stat.st_size, 'sha1': _file_hash(file), 'columns': columns,
+            'first': int(stamps[0]) if len(stamps) else None, 'last': int(stamps[-1]) if len(stamps) else None}
+    _write_json(os.path.join(directory, 'meta.json'), meta)
+
+    return meta
+
+
+def _load_file (file, sep, columns, start, stop, cache):
+    # returns timestamps and the requested columns of file within [start, stop] (ns), memory mapped from the cache
+    directory = _cache_dir(file)
+    meta = _read_cache(file, directory) if cache else None
+
+    if meta is None:
+        stamps, names, values = parse_timeseries(file, sep)
+        validate(stamps, names, values, file)
+        if cache:
+            meta = _write_cache(file, directory, stamps, names, values)
+        else:
+            first = np.searchsorted(stamps, start) if start is not None else 0
+            last = np.searchsorted(stamps, stop, side='right') if stop is not None else len(stamps)
+            columns = names if columns is None else columns
+            return stamps[first:last], {c: values[first:last, names.index(c)] for c in columns}
+
+    if (start is not None and meta['last'] is not None and meta['last'] < start) or \
+            (stop is not None and meta['first'] is not None and meta['first'] > stop):
+        return np.empty(0, dtype='<i8'), {}
+
+    stamps = np.load(os.path.join(directory, 'timestamp.npy'), mmap_mode='r')
+    first = np.searchsorted(stamps, start) if start is not None else 0
+    last = np.searchsorted(stamps, stop, side='right') if stop is not None else len(stamps)
+
+    columns = meta['columns'] if columns is None else columns
+    data = {}
+    for c in columns:
+        values = np.load(os.path.join(directory, str(meta['columns'].index(c)) + '.npy'), mmap_mode='r')
+        data[c] = np.array(values[first:last])
+
+    return np.array(stamps[first:last]), data
+
+
+def _timestamp (value):
+    if value is None:
+        return None
+    value = pd.Timestamp(value)
+    if value.tz is None:
+        value = value.tz_localize('UTC')
+    return value.tz_convert('UTC').value
+
+
+def load_timeseries (file='data/timeseries.csv', sep=None, columns=None, date_from=None, date_to=None, cache=True):
+    """
+    The function loads a timeseries holding pv and demand_el values. The csv is parsed once with explicit dtypes and
+    timestamp format, validated and the PV capacity factor clipped to 1. A binary copy is cached next to the file in
+    .cache/ and reused as long as the modification time or, if the file was only touched, its hash is unchanged.
+    Rows and columns are read from the memory mapped cache, so that only the requested range is loaded.
+
+    :param file:        csv file or list of csv files covering consecutive periods, e.g. one per year;
+                        files outside date_from:date_to are not read from the cache            str or list of str
+    :param sep:         separator, taken from the header line if None                           str or None
+    :param columns:     columns to load, all if None                                            list of str
+    :param date_from:   first timestamp to load                                                 str or pd.Timestamp
+    :param date_to:     last timestamp to load                                                  str or pd.Timestamp
+    :param cache:       use and write the binary cache                                          boolean
+    :return: timeseries with hourly DatetimeIndex, naive in UTC                                 pd.DataFrame
+    """
+    files = [file] if isinstance(file, str) else list(file)
+    start, stop = _timestamp(date_from), _timestamp(date_to)
+
+    stamps = []
+    data = []
+    for f in files:
+        s, d = _load_file(f, sep, columns, start, stop, cache)
+        if len(s):
+            stamps += [s]
+            data += [d]
+
+    if not data:
+        return pd.DataFrame(columns=columns)
+
+    names = list(data[0].keys())
+    stamps = np.concatenate(stamps)
+    # naive timestamps in UTC like the index of the former pd.read_csv based loaders
+    index = pd.DatetimeIndex(stamps.view('datetime64[ns]'), name='timestamp')
+    if len(index) > 2:
+        index = pd.DatetimeIndex(index, freq='infer')
+
+    return pd.DataFrame({c: np.concatenate([d[c] for d in data]) for c in names}, index=index)
+
+
+def load_sites (sites, columns=None, date_from=None, date_to=None, cache=True):
+    """
+    Loads the timeseries of several sites, see load_timeseries().
+
+    :param sites:   {site: file or list of files}                                               dict
+    :return: {site: timeseries}                                                                 dict
+    """
+    return {site: load_timeseries(file, columns=columns, date_from=date_from, date_to=date_to, cache=cache)
+            for site, file in sites.items()}
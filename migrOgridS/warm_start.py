@@ -0,0 +1,343 @@
+"""
+Cross-scenario warm starts.
+
+Scenario studies solve many closely related models, e.g. for neighbouring fuel prices, PV capex or reserve
+fractions. The solution store keeps the commitment schedule and the capacities of every solved scenario, indexed by
+its parameter vector. Before a new solve the nearest solved scenario of the same model class (mode and horizon) is
+looked up and its solution prepared as MIP start:
+
+1. The generator status, online counts and investments of the neighbour are taken over and clipped to the bounds
+   of the new model, e.g. from presolve.
+2. The remaining LP of the matrix model (fast_builder.py) is solved with status and investments fixed. If it is
+   infeasible, the schedule is repaired: in every hour in which the online capacity cannot cover the residual
+   demand plus spinning reserve and the rotating mass requirement of the new scenario, further units are switched
+   on in generator order, and the LP is solved again.
+3. If the LP is feasible, its complete solution is loaded into the pyomo model as start values, otherwise the start
+   is rejected. The start is also rejected if it violates one of the SIDE_CONSTRAINTS of the pyomo model, which the
+   matrix model does not hold, e.g. the epsilon constraint of a Pareto point (pareto.py).
+
+    store = warm_start.SolutionStore('results/warm_starts.sqlite')
+    results = main.solve_and_create_results(m, warm_start=store, scenario=warm_start.scenario_vector(cost, mode, 8760))
+    print(store.report())
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import time
+
+import numpy as np
+from scipy.optimize import Bounds, LinearConstraint, milp
+
+from fast_builder import FastModel, pyomo_variable, node_label
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS solutions (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    model_class TEXT,
+    parameters  TEXT,
+    solution    TEXT,
+    objective   REAL,
+    solve_time  REAL,
+    neighbour   INTEGER,
+    accepted    INTEGER,
+    repaired    INTEGER,
+    created     REAL
+)
+"""
+
+
+# constraints of custom_constraints.py that only the pyomo model holds
+SIDE_CONSTRAINTS = ('diesel_limit', 'renewable_share')
+
+
+def scenario_vector(cost, mode, hours, sizes=None, sr_requirement=0.2, rm_requirement=0.4, **kwargs):
+    """
+    Returns the model class and the parameter vector of a scenario.
+
+    :param cost:    cost dict, every entry becomes a parameter, e.g. 'pp_oil_1.var'             dict
+    :param mode:    'investment' or 'simulation'                                                str
+    :param hours:   horizon                                                                     int
+    :param sizes:   installed capacities of a simulation, e.g. {'PV': 264, 'storage': 337}      dict or None
+    :return: model_class, parameters                                                            str, dict
+    """
+    parameters = {}
+    for component, values in cost.items():
+        for key, value in values.items():
+            parameters[component + '.' + key] = float(value)
+    for component, value in (sizes or {}).items():
+        parameters['size.' + component] = float(value)
+    parameters['sr_requirement'] = float(sr_requirement)
+    parameters['rm_requirement'] = float(rm_requirement)
+    parameters.update({k: float(v) for k, v in kwargs.items()})
+
+    return mode + '_' + str(hours), parameters
+
+
+def distance(a, b):
+    """Euclidean distance of the relative differences of two parameter vectors, missing parameters count as 1"""
+    d = 0.0
+    for key in set(a) | set(b):
+        if key not in a or key not in b:
+            d += 1
+        else:
+            scale = max(abs(a[key]), abs(b[key]), 1e-9)
+            d += ((a[key] - b[key]) / scale) ** 2
+    return d ** 0.5
+
+
+def _key(key):
+    return '|'.join(str(k) for k in key)
+
+
+class SolutionStore(object):
+    """
+    Solved scenarios in a SQLite database, shared by parallel workers.
+
+    Parameters:
+        path:   database file, it is created if it does not exist
+    """
+
+    def __init__ (self, path='results/warm_starts.sqlite'):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+
+        connection = self._connect()
+        try:
+            connection.execute(SCHEMA)
+        finally:
+            connection.close()
+
+    def _connect (self):
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def nearest (self, model_class, parameters):
+        """Returns the nearest solved scenario of model_class as dict, None if there is none"""
+        connection = self._connect()
+        try:
+            rows = connection.execute('SELECT id, parameters FROM solutions WHERE model_class = ?',
+                                      (model_class,)).fetchall()
+            if not rows:
+                return None
+            best = min(rows, key=lambda row: distance(parameters, json.loads(row['parameters'])))
+            row = connection.execute('SELECT * FROM solutions WHERE id = ?', (best['id'],)).fetchone()
+        finally:
+            connection.close()
+
+        res = dict(row)
+        res['parameters'] = json.loads(res['parameters'])
+        res['solution'] = json.loads(res['solution'])
+        res['distance'] = distance(parameters, res['parameters'])
+        return res
+
+    def prepare (self, m, scenario):
+        """
+        Looks up the nearest solved scenario and loads its repaired solution into the pyomo model m as start values.
+        m has to be built by main.create_energysystem_model.
+
+        :param scenario:    model class and parameter vector, see scenario_vector()             tuple
+        :return: start      matrix model, neighbour id, accepted and number of repaired hours    dict
+        """
+        reserve = m.reserve
+        timeincrement = [m.timeincrement[t] for t in m.TIMESTEPS]
+        fast = FastModel.from_energysystem(m.es, reserve['groups'], reserve['storage'], reserve['sr_limit'],
+                                           reserve['rm_limit'], timeincrement)
+        start = {'fast': fast, 'neighbour': None, 'accepted': False, 'repaired': 0}
+
+        neighbour = self.nearest(*scenario)
+        if neighbour is None:
+            return start
+        start['neighbour'] = neighbour['id']
+
+        begin = time.time()
+        fixed = self._fixed_values(m, fast, neighbour['solution'])
+
+        x = complete_start(fast, fixed)
+        if x is None:
+            start['repaired'] = repair_commitment(fast, fixed)
+            x = complete_start(fast, fixed)
+
+        if x is not None:
+            fast.x = x
+            fast.load_into(m)
+            start['accepted'] = side_constraints_met(m)
+
+        logging.info('Warm start from scenario ' + str(neighbour['id']) + ' (distance ' +
+                     str(round(neighbour['distance'], 4)) + '): ' + ('accepted' if start['accepted'] else 'rejected') +
+                     ', ' + str(start['repaired']) + ' hours repaired in ' + str(round(time.time() - begin, 3)) + ' s')
+        return start
+
+    @staticmethod
+    def _fixed_values (m, fast, solution):
+        # integer and investment values of the neighbour, clipped to the bounds of the pyomo variables of m
+        nodes = {node_label(n): n for n in m.es.nodes}
+        investment = [st['label'] for st in fast.structure['storages'] if st['investment'] is not None]
+
+        fixed = {}
+        for key in fast.columns:
+            if _key(key) not in solution:
+                continue
+            values = np.array(solution[_key(key)], dtype=float)
+            if len(values) != fast.columns[key][1]:
+                continue
+            for t in range(len(values)):
+                var = pyomo_variable(m, nodes, investment, key, t)
+                lower, upper = var.lb, var.ub
+                values[t] = min(max(values[t], -np.inf if lower is None else lower), np.inf if upper is None else upper)
+            fixed[key] = values
+        return fixed
+
+    def record (self, m, scenario, solve_time, start):
+        """Stores the solution of the solved pyomo model m, start is the return value of prepare()"""
+        fast = start['fast']
+        nodes = {node_label(n): n for n in m.es.nodes}
+        investment = [st['label'] for st in fast.structure['storages'] if st['investment'] is not None]
+
+        solution = {}
+        for key, (first, length) in fast.columns.items():
+            if key[0] in ('status', 'count', 'invest'):
+                solution[_key(key)] = [pyomo_variable(m, nodes, investment, key, t).value for t in range(length)]
+
+        connection = self._connect()
+        try:
+            connection.execute(
+                'INSERT INTO solutions (model_class, parameters, solution, objective, solve_time, neighbour, accepted, '
+                'repaired, created) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (scenario[0], json.dumps(scenario[1]), json.dumps(solution), float(m.objective()), solve_time,
+                 start['neighbour'], int(start['accepted']), start['repaired'], time.time()))
+        finally:
+            connection.close()
+
+    def report (self, model_class=None):
+        """
+        Returns how often warm starts were tried and accepted and the solve time they saved compared with the mean
+        solve time of the cold solves of the same model class.
+
+        :return: report per model class                                                      dict
+        """
+        connection = self._connect()
+        try:
+            rows = [dict(row) for row in connection.execute(
+                'SELECT model_class, solve_time, neighbour, accepted FROM solutions').fetchall()]
+        finally:
+            connection.close()
+
+        res = {}
+        for c in sorted(set(row['model_class'] for row in rows)):
+            if model_class is not None and c != model_class:
+                continue
+            cold = [row['solve_time'] for row in rows if row['model_class'] == c and row['neighbour'] is None]
+            warm = [row for row in rows if row['model_class'] == c and row['neighbour'] is not None]
+            accepted = [row['solve_time'] for row in warm if row['accepted']]
+            mean_cold = float(np.mean(cold)) if cold else None
+
+            res[c] = {'solves': len(cold) + len(warm),
+                      'warm_starts': len(warm),
+                      'accepted': len(accepted),
+                      'acceptance_rate': len(accepted) / len(warm) if warm else None,
+                      'mean_cold_time': mean_cold,
+                      'mean_warm_time': float(np.mean(accepted)) if accepted else None,
+                      'time_saved': sum(mean_cold - t for t in accepted) if mean_cold is not None else None}
+        return res
+
+
+def side_constraints_met(m, rtol=1e-6):
+    """Checks the start values loaded into the pyomo model m against the SIDE_CONSTRAINTS it holds"""
+    import pyomo.environ as po
+
+    for name in SIDE_CONSTRAINTS:
+        constraint = getattr(m, name, None)
+        if constraint is None or not constraint.active:
+            continue
+        body = po.value(constraint.body, exception=False)
+        if body is None:
+            return False
+        for bound, sign in ((constraint.lower, -1), (constraint.upper, 1)):
+            if bound is None:
+                continue
+            bound = po.value(bound)
+            if sign * (body - bound) > rtol * max(abs(bound), 1):
+                return False
+    return True
+
+
+def complete_start(fast, fixed):
+    """
+    Solves the LP of the matrix model with the columns of fixed set to their values and returns the complete
+    solution, None if it is infeasible.
+    """
+    lb, ub = fast.lb.copy(), fast.ub.copy()
+    for key, values in fixed.items():
+        columns = fast.column(key)
+        lb[columns] = ub[columns] = values
+
+    res = milp(fast.c, integrality=np.zeros(fast.n_columns), bounds=Bounds(lb, ub),
+               constraints=LinearConstraint(fast.matrix(), fast.row_lb, fast.row_ub))
+    return res.x
+
+
+def repair_commitment(fast, fixed):
+    """
+    Switches on further units in generator order in every hour in which the online capacity of fixed is below the
+    residual demand plus spinning reserve or below the rotating mass requirement. With the storage idle and the
+    surplus in the excess sink the schedule is then feasible. fixed is changed in place.
+
+    :param fast:    bound matrix model                                                          FastModel
+    :param fixed:   {column key: values} of the status, count and investment columns             dict
+    :return: number of repaired hours                                                           int
+    """
+    s = fast.structure
+    T = s['timesteps']
+    buses = set(s['buses'])
+    flows = {f['name']: f for f in s['flows']}
+
+    demand = np.zeros(T)
+    pv = np.zeros(T)
+    for name, profile in fast.data['actual_value'].items():
+        if name[0] in buses:
+            demand += profile * (flows[name]['nominal_value'] or 1)
+        elif flows[name]['investment'] is None:
+            pv += profile * flows[name]['nominal_value']
+        else:
+            pv += profile * fixed.get(('invest',) + name, [0])[0]
+
+    required = np.maximum(np.maximum(demand - pv, 0) + fast.data['sr_limit'], fast.data['rm_limit'])
+
+    gens = sorted([g for g in s['generators'] if g['label'] in s['reserve']['generators']],
+                  key=lambda g: s['reserve']['generators'].index(g['label']))
+
+    online = {}
+    for g in gens:
+        key = ('count' if g['bank'] else 'status', g['label'])
+        online[key] = np.round(fixed[key]) if key in fixed else np.zeros(T)
+        fixed[key] = online[key]
+
+    def capacity():
+        return sum(online[('count' if g['bank'] else 'status', g['label'])] * g['max'] * g['unit_nominal_value']
+                   for g in gens)
+
+    short = capacity() < required - 1e-6
+    repaired = int(short.sum())
+
+    for g in gens:
+        if not short.any():
+            break
+        key = ('count' if g['bank'] else 'status', g['label'])
+        while short.any():
+            add = short & (online[key] < g['units'])
+            if not add.any():
+                break
+            online[key][add] += 1
+            short = capacity() < required - 1e-6
+
+    # generator order of custom_constraints.gen_order_constraint
+    single = [('status', g['label']) for g in gens if not g['bank']]
+    if len(single) >= 2:
+        np.maximum(online[single[0]], online[single[1]], out=online[single[0]])
+
+    return repaired